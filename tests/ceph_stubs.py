@@ -84,8 +84,32 @@ def install_ceph_stubs():
     else:
         return False
 
-    sys.modules["rados"] = _make_module("rados", {"Rados": Rados})
+    sys.modules["rados"] = _make_module(
+        "rados",
+        {
+            "Rados": Rados,
+            "ObjectBusy": type("ObjectBusy", (Exception,), {}),
+            "ObjectExists": type("ObjectExists", (Exception,), {}),
+        },
+    )
     sys.modules["rbd"] = _make_module(
-        "rbd", {"RBD": RBD, "Group": Group, "Image": Image}
+        "rbd",
+        {
+            "RBD": RBD,
+            "Group": Group,
+            "Image": Image,
+            # Values from librbd.h
+            "RBD_SNAP_NAMESPACE_TYPE_USER": 0,
+            "RBD_SNAP_NAMESPACE_TYPE_GROUP": 1,
+            "RBD_FEATURE_LAYERING": 1,
+            "RBD_FEATURE_STRIPINGV2": 2,
+            "RBD_FEATURE_EXCLUSIVE_LOCK": 4,
+            "RBD_FEATURE_OBJECT_MAP": 8,
+            "RBD_FEATURE_FAST_DIFF": 16,
+            "RBD_FEATURE_DEEP_FLATTEN": 32,
+            "RBD_FEATURE_JOURNALING": 64,
+            "RBD_FLAG_OBJECT_MAP_INVALID": 1,
+            "RBD_FLAG_FAST_DIFF_INVALID": 2,
+        },
     )
     return True
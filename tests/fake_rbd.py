@@ -0,0 +1,145 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""In-memory stand-ins for the ``rados``/``rbd`` objects used by the helpers.
+
+Unlike the stubs of ceph_stubs.py, which fail as soon as they are used,
+these implement the few calls the pure-Python helpers make, so that the
+helpers can be unit tested without a cluster. They are passed to the code
+under test explicitly, or patched into the helper module by a fixture.
+"""
+
+
+class FakeCompletion:
+    """Stand-in for :class:`rbd.Completion`."""
+
+    def __init__(self, ret):
+        self._ret = ret
+
+    def get_return_value(self):
+        return self._ret
+
+
+class FakeImage:
+    """Stand-in for an open :class:`rbd.Image`, backed by a bytearray.
+
+    Asynchronous I/Os complete at once. ``changes`` is the list of the
+    (offset, length, exists) extents reported by diff_iterate(), whatever
+    the snapshot diffed from.
+    """
+
+    def __init__(
+        self,
+        size=0,
+        name="img",
+        read_only=False,
+        write_error=0,
+        obj_size=4096,
+    ):
+        self.name = name
+        self.obj_size = obj_size
+        self.read_only = read_only
+        self.data = bytearray(size)
+        self.changes = []
+        self.writes = []
+        self.write_error = write_error
+        self.closed = False
+        self.flushes = 0
+
+    def size(self):
+        return len(self.data)
+
+    def stat(self):
+        return {"size": len(self.data), "obj_size": self.obj_size}
+
+    def read(self, offset, length):
+        end = offset + length
+        return bytes(self.data[offset:end])
+
+    def write(self, data, offset):
+        if not isinstance(data, bytes):
+            raise TypeError("data must be a byte string")
+        end = offset + len(data)
+        self.writes.append((offset, len(data)))
+        self.data[offset:end] = data
+        return len(data)
+
+    def aio_write(self, data, offset, oncomplete):
+        if self.write_error:
+            oncomplete(FakeCompletion(self.write_error))
+            return
+        oncomplete(FakeCompletion(self.write(data, offset)))
+
+    def aio_read(self, offset, length, oncomplete):
+        oncomplete(FakeCompletion(length), self.read(offset, length))
+
+    def flush(self):
+        self.flushes += 1
+
+    def diff_iterate(self, offset, length, from_snapshot, iterate_cb):
+        end = offset + length
+        for start, size, exists in self.changes:
+            lo, hi = max(start, offset), min(start + size, end)
+            if lo < hi:
+                iterate_cb(lo, hi - lo, exists)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeIoctx:
+    """Stand-in for :class:`rados.Ioctx`."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.namespace = ""
+        self.state = "open"
+
+    def set_namespace(self, namespace):
+        self.namespace = namespace
+
+    def get_namespace(self):
+        return self.namespace
+
+    def close(self):
+        self.state = "closed"
+
+
+class FakeRados:
+    """Stand-in for :class:`rados.Rados`, counting its instances."""
+
+    instances = []
+
+    def __init__(self, conffile=None):
+        self.conffile = conffile
+        self.state = "configuring"
+        self.pings = 0
+        self.ping_error = None
+        FakeRados.instances.append(self)
+
+    def connect(self):
+        self.state = "connected"
+
+    def open_ioctx(self, pool):
+        return FakeIoctx(pool)
+
+    def get_cluster_stats(self):
+        self.pings += 1
+        if self.ping_error is not None:
+            raise self.ping_error
+        return {}
+
+    def shutdown(self):
+        self.state = "shutdown"
+
+
+class FakeRBD:
+    """Stand-in for :class:`rbd.RBD`, listing the images of ``names``."""
+
+    names = []
+
+    def list(self, ioctx):
+        return list(self.names)
+
+    def namespace_exists(self, ioctx, namespace):
+        return True
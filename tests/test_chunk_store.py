@@ -0,0 +1,113 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from vm_manager.helpers.chunk_store import ChunkStore, ChunkStoreException
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkStore(str(tmp_path / "store"), create=True)
+
+
+def _manifest(*digests):
+    return {
+        "disks": [
+            {
+                "role": "system",
+                "chunks": [[i * 4, d] for i, d in enumerate(digests)],
+            }
+        ]
+    }
+
+
+# ── Chunks ───────────────────────────────────────────────────────────
+
+
+class TestChunks:
+    def test_put_and_get(self, store):
+        digest, written = store.put_chunk(b"abcd")
+        assert written
+        assert digest == ChunkStore.digest(b"abcd")
+        assert store.has_chunk(digest)
+        assert store.get_chunk(digest) == b"abcd"
+
+    def test_put_is_deduplicated(self, store):
+        digest, _ = store.put_chunk(b"abcd")
+        assert store.put_chunk(b"abcd") == (digest, False)
+
+    def test_missing_chunk_raises(self, store):
+        with pytest.raises(ChunkStoreException, match="missing"):
+            store.get_chunk(ChunkStore.digest(b"abcd"))
+
+    def test_corrupted_chunk_raises(self, store):
+        digest, _ = store.put_chunk(b"abcd")
+        path = os.path.join(store.path, "chunks", digest[:2], digest)
+        with open(path, "wb") as f:
+            f.write(b"abce")
+        with pytest.raises(ChunkStoreException, match="corrupted"):
+            store.get_chunk(digest)
+
+    def test_no_temporary_file_is_left(self, store):
+        digest, _ = store.put_chunk(b"abcd")
+        directory = os.path.join(store.path, "chunks", digest[:2])
+        assert os.listdir(directory) == [digest]
+
+
+# ── Manifests ────────────────────────────────────────────────────────
+
+
+class TestManifests:
+    def test_save_and_load(self, store):
+        manifest = _manifest(store.put_chunk(b"abcd")[0])
+        store.save_manifest("vm1", "b1", manifest)
+        assert store.backup_exists("vm1", "b1")
+        assert store.load_manifest("vm1", "b1") == manifest
+
+    def test_save_twice_raises(self, store):
+        store.save_manifest("vm1", "b1", _manifest())
+        with pytest.raises(ChunkStoreException, match="already exists"):
+            store.save_manifest("vm1", "b1", _manifest())
+
+    def test_missing_backup(self, store):
+        assert not store.backup_exists("vm1", "b1")
+        with pytest.raises(ChunkStoreException, match="does not exist"):
+            store.load_manifest("vm1", "b1")
+        with pytest.raises(ChunkStoreException, match="does not exist"):
+            store.remove_backup("vm1", "b1")
+
+    def test_list_and_remove(self, store):
+        assert store.list_backups("vm1") == []
+        store.save_manifest("vm1", "b2", _manifest())
+        store.save_manifest("vm1", "b1", _manifest())
+        assert store.list_backups("vm1") == ["b1", "b2"]
+        store.remove_backup("vm1", "b1")
+        assert store.list_backups("vm1") == ["b2"]
+
+
+# ── Store and gc ─────────────────────────────────────────────────────
+
+
+class TestStore:
+    def test_missing_store_raises(self, tmp_path):
+        with pytest.raises(ChunkStoreException, match="not a chunk store"):
+            ChunkStore(str(tmp_path / "store"))
+
+    def test_existing_store_is_opened(self, store):
+        assert ChunkStore(store.path).path == store.path
+
+    def test_gc_removes_unused_chunks(self, store):
+        shared = store.put_chunk(b"shared")[0]
+        kept = store.put_chunk(b"kept")[0]
+        dropped = store.put_chunk(b"dropped")[0]
+        store.save_manifest("vm1", "b1", _manifest(shared, dropped))
+        store.save_manifest("vm2", "b1", _manifest(shared, kept))
+        store.remove_backup("vm1", "b1")
+        assert store.gc() == 1
+        assert store.has_chunk(shared)
+        assert store.has_chunk(kept)
+        assert not store.has_chunk(dropped)
+        assert store.gc() == 0
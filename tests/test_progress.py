@@ -0,0 +1,192 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import datetime
+import json
+
+from vm_manager.helpers.progress import (
+    ProgressFile,
+    ProgressTracker,
+    format_progress,
+    list_progress,
+    progress_dir_writable,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _tracker(records, clock, **kwargs):
+    return ProgressTracker(
+        "import",
+        "system_vm1",
+        consumers=[records.append],
+        vm="vm1",
+        clock=clock,
+        **kwargs,
+    )
+
+
+def _timestamp(seconds_ago):
+    return (
+        datetime.datetime.now().astimezone()
+        - datetime.timedelta(seconds=seconds_ago)
+    ).isoformat(timespec="seconds")
+
+
+# ── ProgressTracker ──────────────────────────────────────────────────
+
+
+class TestProgressTracker:
+    def test_updates_are_throttled(self):
+        records, clock = [], FakeClock()
+        tracker = _tracker(records, clock, total=100)
+        tracker(10)
+        clock.now = 0.5
+        tracker(20)
+        clock.now = 1.5
+        tracker(30)
+        assert [record["done"] for record in records] == [10, 30]
+
+    def test_last_update_and_finish_are_always_passed(self):
+        records, clock = [], FakeClock()
+        with _tracker(records, clock, total=100) as tracker:
+            tracker(10)
+            tracker(100)
+        assert [r["done"] for r in records] == [10, 100, 100]
+        assert records[-1]["state"] == "done"
+        assert records[-1]["percent"] == 100.0
+
+    def test_rate_and_eta(self):
+        records, clock = [], FakeClock()
+        tracker = _tracker(records, clock, total=100)
+        clock.now = 2.0
+        tracker(50)
+        assert records[-1]["rate"] == 25.0
+        assert records[-1]["eta"] == 2.0
+        assert records[-1]["percent"] == 50.0
+
+    def test_exception_marks_failed(self):
+        records, clock = [], FakeClock()
+        try:
+            with _tracker(records, clock):
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        assert records[-1]["state"] == "failed"
+        assert records[-1]["error"] == "boom"
+
+    def test_failing_consumer_does_not_interrupt(self):
+        def broken(record):
+            raise OSError("read-only")
+
+        records = []
+        tracker = ProgressTracker(
+            "import",
+            "system_vm1",
+            total=10,
+            consumers=[broken, records.append],
+        )
+        assert tracker(10) == 0
+        assert records[-1]["done"] == 10
+
+
+# ── ProgressFile and list_progress ───────────────────────────────────
+
+
+class TestProgressFile:
+    def test_records_are_listed_back(self, tmp_path):
+        directory = str(tmp_path)
+        with ProgressTracker(
+            "copy",
+            "data/vm1",
+            total=4,
+            consumers=[ProgressFile(directory)],
+            vm="vm1",
+        ) as tracker:
+            tracker(2)
+        ProgressTracker(
+            "import",
+            "system_vm2",
+            consumers=[ProgressFile(directory)],
+            vm="vm2",
+        ).update(1)
+        records = {r["target"]: r for r in list_progress(directory=directory)}
+        assert sorted(records) == ["data/vm1", "system_vm2"]
+        assert records["data/vm1"]["state"] == "done"
+        assert records["system_vm2"]["state"] == "running"
+        assert [r["target"] for r in list_progress("vm2", directory)] == [
+            "system_vm2"
+        ]
+
+    def test_missing_directory_lists_nothing(self, tmp_path):
+        assert list_progress(directory=str(tmp_path / "missing")) == []
+
+    def test_stale_running_records(self, tmp_path):
+        for target, state, updated in (
+            ("old", "running", _timestamp(600)),
+            ("recent", "running", _timestamp(10)),
+            ("finished", "done", _timestamp(600)),
+        ):
+            record = {
+                "vm": "vm1",
+                "operation": "import",
+                "target": target,
+                "state": state,
+                "started": _timestamp(1000),
+                "updated": updated,
+            }
+            (tmp_path / (target + ".json")).write_text(json.dumps(record))
+        states = {
+            r["target"]: r["state"]
+            for r in list_progress(directory=str(tmp_path), stale_timeout=300)
+        }
+        assert states == {
+            "old": "stale",
+            "recent": "running",
+            "finished": "done",
+        }
+
+    def test_timestamps_without_offset_are_local(self, tmp_path):
+        old = datetime.datetime.now() - datetime.timedelta(seconds=600)
+        record = {
+            "vm": "vm1",
+            "operation": "import",
+            "target": "system_vm1",
+            "state": "running",
+            "started": old.isoformat(timespec="seconds"),
+            "updated": old.isoformat(timespec="seconds"),
+        }
+        (tmp_path / "a.json").write_text(json.dumps(record))
+        records = list_progress(directory=str(tmp_path), stale_timeout=300)
+        assert records[0]["state"] == "stale"
+
+    def test_directory_writable(self, tmp_path):
+        assert progress_dir_writable(str(tmp_path / "progress"))
+        (tmp_path / "file").write_text("")
+        assert not progress_dir_writable(str(tmp_path / "file" / "progress"))
+
+
+def test_format_stale_record():
+    record = {
+        "operation": "import",
+        "target": "system_vm1",
+        "state": "stale",
+        "done": 5,
+        "total": 10,
+        "unit": "B",
+        "percent": 50.0,
+        "rate": None,
+        "eta": None,
+        "elapsed": 3.0,
+        "updated": "2026-01-01T00:00:16+00:00",
+    }
+    assert format_progress(record) == (
+        "import system_vm1: 50.0% (5.0 B/10.0 B, stale, last updated "
+        "2026-01-01T00:00:16+00:00)"
+    )
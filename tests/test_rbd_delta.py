@@ -0,0 +1,119 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from vm_manager.helpers.rbd_delta import (
+    DeltaReader,
+    DeltaWriter,
+    RbdDeltaException,
+)
+
+
+@pytest.fixture
+def delta(tmp_path):
+    path = str(tmp_path / "vm1.delta")
+    with DeltaWriter(path, "vm1", "snap2", since="snap1") as writer:
+        writer.add_disk("system", "system_vm1", 64)
+        writer.add_extent(0, 4, b"abcd")
+        writer.add_extent(16, 8)
+        writer.add_disk(1, "data1_vm1", 32)
+        writer.add_extent(8, 2, b"ef")
+        assert writer.data_size == 6
+    return path
+
+
+def _corrupt(path, offset, data, whence=0):
+    with open(path, "r+b") as fd:
+        fd.seek(offset, whence)
+        fd.write(data)
+
+
+# ── Round trip ───────────────────────────────────────────────────────
+
+
+class TestRoundTrip:
+    def test_index(self, delta):
+        with DeltaReader(delta) as reader:
+            assert reader.vm == "vm1"
+            assert reader.snapshot == "snap2"
+            assert reader.since == "snap1"
+            assert [
+                (disk["role"], disk["name"], disk["size"])
+                for disk in reader.disks
+            ] == [("system", "system_vm1", 64), (1, "data1_vm1", 32)]
+
+    def test_extents(self, delta):
+        with DeltaReader(delta) as reader:
+            reader.verify()
+            system, data1 = reader.disks
+            assert list(reader.iter_extents(system)) == [
+                (0, 4, b"abcd"),
+                (16, 8, None),
+            ]
+            assert list(reader.iter_extents(data1)) == [(8, 2, b"ef")]
+
+    def test_full_backup_has_no_since(self, tmp_path):
+        path = str(tmp_path / "full.delta")
+        with DeltaWriter(path, "vm1", "snap1"):
+            pass
+        with DeltaReader(path) as reader:
+            reader.verify()
+            assert reader.since is None
+            assert reader.disks == []
+
+
+# ── Writer errors ────────────────────────────────────────────────────
+
+
+class TestWriter:
+    def test_extent_without_disk_raises(self, tmp_path):
+        with pytest.raises(RbdDeltaException, match="No disk"):
+            with DeltaWriter(str(tmp_path / "a.delta"), "vm1", "s") as writer:
+                writer.add_extent(0, 1, b"a")
+
+    def test_extent_length_mismatch_raises(self, tmp_path):
+        with pytest.raises(ValueError):
+            with DeltaWriter(str(tmp_path / "a.delta"), "vm1", "s") as writer:
+                writer.add_disk("system", "system_vm1", 8)
+                writer.add_extent(0, 2, b"a")
+
+    def test_partial_file_is_removed_on_error(self, tmp_path):
+        with pytest.raises(RuntimeError):
+            with DeltaWriter(str(tmp_path / "a.delta"), "vm1", "s"):
+                raise RuntimeError("boom")
+        assert list(tmp_path.iterdir()) == []
+
+
+# ── Reader rejections ────────────────────────────────────────────────
+
+
+class TestReader:
+    def test_checksum_mismatch(self, delta):
+        _corrupt(delta, 12, b"X")
+        with DeltaReader(delta) as reader:
+            with pytest.raises(RbdDeltaException, match="checksum"):
+                reader.verify()
+
+    def test_truncated_trailer(self, delta):
+        with open(delta, "r+b") as fd:
+            fd.truncate(fd.seek(0, 2) - 1)
+        with pytest.raises(RbdDeltaException, match="truncated"):
+            DeltaReader(delta)
+
+    def test_bad_trailer_offset(self, delta):
+        _corrupt(delta, -24, b"\xff" * 8, whence=2)
+        with pytest.raises(RbdDeltaException, match="corrupted"):
+            DeltaReader(delta)
+
+    def test_not_a_delta_file(self, tmp_path):
+        path = tmp_path / "a.delta"
+        path.write_bytes(b"NOTADELTA" * 8)
+        with pytest.raises(RbdDeltaException, match="not a delta"):
+            DeltaReader(str(path))
+
+    def test_empty_file(self, tmp_path):
+        path = tmp_path / "a.delta"
+        path.write_bytes(b"")
+        with pytest.raises(RbdDeltaException, match="corrupted"):
+            DeltaReader(str(path))
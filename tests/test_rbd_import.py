@@ -0,0 +1,187 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+
+import pytest
+
+from fake_rbd import FakeImage
+
+from vm_manager.helpers.rbd_import import (
+    AioImporter,
+    AllocationMap,
+    RbdImportException,
+    split_range,
+)
+
+OBJ = 4096
+
+
+def _extent(start, length, data, present=True):
+    extent = {"start": start, "length": length, "data": data}
+    if data:
+        extent["offset"] = start
+    else:
+        extent["present"] = present
+    return extent
+
+
+@pytest.fixture
+def raw(tmp_path):
+    """A raw image: one object of data, one of zeros, one unallocated."""
+    path = tmp_path / "disk.raw"
+    path.write_bytes(b"a" * OBJ + bytes(2 * OBJ))
+    allocation = AllocationMap(
+        [
+            _extent(0, OBJ, True),
+            _extent(OBJ, OBJ, False),
+            _extent(2 * OBJ, OBJ, False, present=False),
+        ]
+    )
+    return str(path), {"virtual-size": 3 * OBJ}, allocation
+
+
+def _import(raw, image, **kwargs):
+    path, info, allocation = raw
+    importer_args = {
+        k: kwargs.pop(k) for k in ("sparse", "cancel") if k in kwargs
+    }
+    return AioImporter(queue_depth=2, **importer_args).import_image(
+        path, "raw", image, info=info, allocation=allocation, **kwargs
+    )
+
+
+# ── AllocationMap ────────────────────────────────────────────────────
+
+
+class TestAllocationMap:
+    def test_state(self):
+        assert AllocationMap.state(_extent(0, 1, True)) == AllocationMap.DATA
+        assert AllocationMap.state(_extent(0, 1, False)) == AllocationMap.ZERO
+        assert (
+            AllocationMap.state(_extent(0, 1, False, present=False))
+            == AllocationMap.UNALLOCATED
+        )
+
+    def test_state_without_present_is_zero(self):
+        extent = {"start": 0, "length": 1, "data": False}
+        assert AllocationMap.state(extent) == AllocationMap.ZERO
+
+    def test_bytes_in_and_data_extents(self, raw):
+        allocation = raw[2]
+        assert allocation.bytes_in(AllocationMap.DATA) == OBJ
+        assert allocation.bytes_in(AllocationMap.ZERO) == OBJ
+        assert allocation.bytes_in(AllocationMap.UNALLOCATED) == OBJ
+        assert allocation.data_extents() == [allocation.extents[0]]
+
+
+# ── split_range ──────────────────────────────────────────────────────
+
+
+class TestSplitRange:
+    def test_cuts_at_multiples_of_chunk_size(self):
+        assert list(split_range(3, 10, 4)) == [(3, 1), (4, 4), (8, 4), (12, 1)]
+
+    def test_aligned_range(self):
+        assert list(split_range(8, 8, 4)) == [(8, 4), (12, 4)]
+
+    def test_empty_range(self):
+        assert list(split_range(5, 0, 4)) == []
+
+
+# ── AioImporter ──────────────────────────────────────────────────────
+
+
+class TestAioImporter:
+    def test_dirty_target_gets_zeros_written(self, raw):
+        image = FakeImage(3 * OBJ)
+        image.data[:] = b"x" * (3 * OBJ)
+        stats = _import(raw, image)
+        assert image.data == b"a" * OBJ + bytes(2 * OBJ)
+        assert stats == {"bytes_written": 3 * OBJ, "bytes_skipped": 0}
+
+    def test_zeroed_target_only_gets_the_data(self, raw):
+        image = FakeImage(3 * OBJ)
+        stats = _import(raw, image, target_is_zero=True)
+        assert image.writes == [(0, OBJ)]
+        assert stats == {"bytes_written": OBJ, "bytes_skipped": 2 * OBJ}
+
+    def test_sparse_skips_the_zero_chunks_of_the_data(self, tmp_path):
+        path = tmp_path / "disk.raw"
+        path.write_bytes(bytes(OBJ) + b"b" * OBJ)
+        allocation = AllocationMap([_extent(0, 2 * OBJ, True)])
+        image = FakeImage(2 * OBJ)
+        stats = _import(
+            (str(path), {"virtual-size": 2 * OBJ}, allocation),
+            image,
+            sparse=True,
+        )
+        assert image.writes == [(OBJ, OBJ)]
+        assert stats == {"bytes_written": OBJ, "bytes_skipped": OBJ}
+
+    def test_short_raw_file_is_padded_with_zeros(self, tmp_path):
+        path = tmp_path / "disk.raw"
+        path.write_bytes(b"c" * 10)
+        allocation = AllocationMap([_extent(0, OBJ, True)])
+        image = FakeImage(OBJ)
+        image.data[:] = b"x" * OBJ
+        _import((str(path), {"virtual-size": OBJ}, allocation), image)
+        assert image.data == b"c" * 10 + bytes(OBJ - 10)
+
+    def test_progress_reaches_the_virtual_size(self, raw):
+        calls = []
+        path, info, allocation = raw
+        AioImporter(
+            progress=lambda done, total: calls.append((done, total))
+        ).import_image(
+            path, "raw", FakeImage(3 * OBJ), info=info, allocation=allocation
+        )
+        assert calls[-1] == (3 * OBJ, 3 * OBJ)
+
+    def test_backing_file_raises(self, raw):
+        path, _, allocation = raw
+        with pytest.raises(RbdImportException, match="backing file"):
+            AioImporter().import_image(
+                path,
+                "qcow2",
+                FakeImage(3 * OBJ),
+                info={"virtual-size": 3 * OBJ, "backing-filename": "base"},
+                allocation=allocation,
+            )
+
+    def test_compressed_data_raises(self, raw):
+        path, info, _ = raw
+        allocation = AllocationMap([{"start": 0, "length": OBJ, "data": True}])
+        with pytest.raises(RbdImportException, match="compressed"):
+            AioImporter().import_image(
+                path, "qcow2", FakeImage(OBJ), info=info, allocation=allocation
+            )
+
+    def test_small_destination_raises(self, raw):
+        with pytest.raises(RbdImportException, match="smaller"):
+            _import(raw, FakeImage(OBJ))
+
+    def test_chunk_size_must_divide_the_object_size(self, raw):
+        path, info, allocation = raw
+        with pytest.raises(ValueError, match="divide"):
+            AioImporter(chunk_size=1000).import_image(
+                path,
+                "raw",
+                FakeImage(3 * OBJ),
+                info=info,
+                allocation=allocation,
+            )
+
+    def test_cancel_raises(self, raw):
+        cancel = threading.Event()
+        cancel.set()
+        with pytest.raises(RbdImportException, match="cancelled"):
+            _import(raw, FakeImage(3 * OBJ), cancel=cancel)
+
+    def test_write_error_raises(self, raw):
+        with pytest.raises(RbdImportException, match="-5"):
+            _import(raw, FakeImage(3 * OBJ, write_error=-5))
+
+    def test_queue_depth_must_be_positive(self):
+        with pytest.raises(ValueError):
+            AioImporter(queue_depth=0)
@@ -0,0 +1,267 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from fake_rbd import FakeImage, FakeRados, FakeRBD
+
+from vm_manager.helpers import rbd_manager
+from vm_manager.helpers.rbd_manager import RbdConnectionPool, RbdManager
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Patch the Ceph classes of rbd_manager and record the images opened."""
+    images = []
+
+    def open_image(ioctx, name, read_only=False, **kwargs):
+        image = FakeImage(name=name, read_only=read_only)
+        images.append(image)
+        return image
+
+    monkeypatch.setattr(FakeRados, "instances", [])
+    monkeypatch.setattr(rbd_manager, "Rados", FakeRados)
+    monkeypatch.setattr(rbd_manager, "RBD", FakeRBD)
+    monkeypatch.setattr(rbd_manager, "Image", open_image)
+    return images
+
+
+@pytest.fixture
+def ceph_conf(tmp_path):
+    path = tmp_path / "ceph.conf"
+    path.write_text("")
+    return str(path)
+
+
+@pytest.fixture
+def rbd(opened, ceph_conf):
+    with RbdManager(ceph_conf, max_open_images=2) as manager:
+        yield manager
+
+
+# ── Image cache ──────────────────────────────────────────────────────
+
+
+class TestImageCache:
+    def test_instances_are_reused(self, rbd, opened):
+        with rbd._image("a") as first:
+            pass
+        with rbd._image("a") as second:
+            assert second is first
+        with rbd._image("a", read_only=True) as read_only:
+            assert read_only is not first
+        assert [(i.name, i.read_only) for i in opened] == [
+            ("a", False),
+            ("a", True),
+        ]
+
+    def test_least_recently_used_is_closed(self, rbd, opened):
+        for name in ("a", "b", "a", "c"):
+            with rbd._image(name):
+                pass
+        a, b, c = opened
+        assert b.closed
+        assert not a.closed and not c.closed
+
+    def test_pinned_instances_are_not_evicted(self, rbd, opened):
+        with rbd._image("a") as a:
+            for name in ("b", "c", "d"):
+                with rbd._image(name):
+                    pass
+            assert not a.closed
+            assert [i.closed for i in opened[1:]] == [True, True, False]
+        with rbd._image("a") as again:
+            assert again is a
+
+    def test_cache_shrinks_once_pins_are_released(self, rbd, opened):
+        with rbd._image("a"), rbd._image("b"), rbd._image("c"):
+            assert not any(i.closed for i in opened)
+        # "c" is released first, while it is the only one not pinned
+        assert [i.closed for i in opened] == [False, False, True]
+
+    def test_drop_pinned_image_closes_it_on_release(self, rbd, opened):
+        with rbd._image("a") as a:
+            rbd._drop_image("a")
+            assert not a.closed
+            with rbd._image("a") as reopened:
+                assert reopened is not a
+        assert a.closed
+        assert not reopened.closed
+
+    def test_drop_unpinned_image(self, rbd, opened):
+        with rbd._image("a") as a:
+            pass
+        rbd._drop_image("a")
+        assert a.closed
+
+    def test_close_images(self, rbd, opened):
+        with rbd._image("a") as a:
+            with rbd._image("b") as b:
+                pass
+            rbd.close_images()
+            assert b.closed
+            assert not a.closed
+        assert a.closed
+
+    def test_close_closes_the_cluster(self, opened, ceph_conf):
+        with RbdManager(ceph_conf) as manager:
+            with manager._image("a") as a:
+                pass
+        assert a.closed
+        assert FakeRados.instances[0].state == "shutdown"
+
+
+# ── Connection pool ──────────────────────────────────────────────────
+
+
+class TestConnectionPool:
+    KEY = ("/etc/ceph/ceph.conf", "rbd", "ns")
+
+    @pytest.fixture
+    def pool(self, opened):
+        return RbdConnectionPool(idle_timeout=300, health_check_interval=30)
+
+    def test_connections_are_shared_and_counted(self, pool):
+        first = pool.acquire(*self.KEY)
+        second = pool.acquire(*self.KEY)
+        other = pool.acquire("/etc/ceph/ceph.conf", "rbd", "other")
+        assert second is first
+        assert other is not first
+        assert first.refcount == 2
+        assert first.ioctx.get_namespace() == "ns"
+        for connection in (first, second, other):
+            pool.release(connection)
+        assert first.refcount == 0
+        assert pool.acquire(*self.KEY) is first
+        assert len(FakeRados.instances) == 2
+
+    def test_idle_connections_are_closed(self, pool):
+        connection = pool.acquire(*self.KEY)
+        pool.release(connection)
+        connection.last_used -= 301
+        assert pool.acquire(*self.KEY) is not connection
+        assert connection.cluster.state == "shutdown"
+        assert connection.ioctx.state == "closed"
+
+    def test_unhealthy_connection_is_replaced(self, pool):
+        connection = pool.acquire(*self.KEY)
+        pool.release(connection)
+        connection.ioctx.state = "closed"
+        assert pool.acquire(*self.KEY) is not connection
+        assert connection.cluster.state == "shutdown"
+
+    def test_idle_connection_is_pinged(self, pool):
+        connection = pool.acquire(*self.KEY)
+        pool.release(connection)
+        connection.cluster.ping_error = OSError("timeout")
+        assert pool.acquire(*self.KEY) is connection
+        assert connection.cluster.pings == 0
+        pool.release(connection)
+        connection.last_used -= 31
+        assert pool.acquire(*self.KEY) is not connection
+        assert connection.cluster.pings == 1
+        assert connection.cluster.state == "shutdown"
+
+    def test_unhealthy_connection_in_use_is_closed_on_release(self, pool):
+        connection = pool.acquire(*self.KEY)
+        connection.cluster.state = "disconnected"
+        replacement = pool.acquire(*self.KEY)
+        assert replacement is not connection
+        assert connection.ioctx.state == "open"
+        pool.release(connection)
+        assert connection.ioctx.state == "closed"
+        assert pool.acquire(*self.KEY) is replacement
+
+    def test_child_forgets_the_parent_connections(self, pool):
+        connection = pool.acquire(*self.KEY)
+        pool._after_fork_in_child()
+        assert pool.acquire(*self.KEY) is not connection
+        assert connection.cluster.state == "connected"
+
+    def test_connect_failure_shuts_down(self, pool, monkeypatch):
+        def fail(self):
+            raise OSError("no monitor")
+
+        monkeypatch.setattr(FakeRados, "connect", fail)
+        with pytest.raises(OSError):
+            pool.acquire(*self.KEY)
+        assert FakeRados.instances[0].state == "shutdown"
+        assert pool._connections == {}
+
+    def test_close_all_keeps_the_connections_in_use(self, pool):
+        used = pool.acquire(*self.KEY)
+        unused = pool.acquire("/etc/ceph/ceph.conf", "rbd", "other")
+        pool.release(unused)
+        pool.close_all()
+        assert unused.cluster.state == "shutdown"
+        assert used.cluster.state == "connected"
+
+    def test_shared_managers(self, pool, ceph_conf, monkeypatch):
+        monkeypatch.setattr(rbd_manager, "connection_pool", pool)
+        with RbdManager(ceph_conf, shared=True) as first:
+            with RbdManager(ceph_conf, shared=True) as second:
+                assert second._ioctx is first._ioctx
+                with pytest.raises(rbd_manager.RbdException):
+                    second.set_namespace("other")
+        (cluster,) = FakeRados.instances
+        assert cluster.state == "connected"
+
+
+# ── import_qcow2 ─────────────────────────────────────────────────────
+
+
+class TestImportQcow2:
+    @pytest.fixture
+    def qemu_img(self, monkeypatch):
+        runs = []
+        monkeypatch.setattr(
+            rbd_manager,
+            "qemu_img_info",
+            lambda src, fmt: {"virtual-size": 1024},
+        )
+        monkeypatch.setattr(
+            rbd_manager,
+            "_run_qemu_img",
+            lambda args, progress, cancel: runs.append(args),
+        )
+        return runs
+
+    def test_without_layout_qemu_img_creates_the_image(self, rbd, qemu_img):
+        rbd.import_qcow2("/tmp/disk.qcow2", "system_vm1")
+        assert qemu_img == [
+            [
+                "/usr/bin/qemu-img",
+                "convert",
+                "-W",
+                "-f",
+                "qcow2",
+                "-O",
+                "raw",
+                "/tmp/disk.qcow2",
+                "rbd:rbd/system_vm1",
+            ]
+        ]
+
+    def test_with_layout_writes_into_a_zeroed_image(
+        self, rbd, qemu_img, monkeypatch
+    ):
+        created = []
+        monkeypatch.setattr(
+            rbd,
+            "create_image",
+            lambda img, size, layout=None: created.append((img, size, layout)),
+        )
+        rbd.import_qcow2("/tmp/disk.qcow2", "system_vm1", layout={"order": 23})
+        assert created == [("system_vm1", 1024, {"order": 23})]
+        args = qemu_img[0]
+        assert args[:4] == [
+            "/usr/bin/qemu-img",
+            "convert",
+            "-n",
+            "--target-is-zero",
+        ]
+        assert args[-2:] == ["/tmp/disk.qcow2", "rbd:rbd/system_vm1"]
+
+    def test_unknown_backend_raises(self, rbd):
+        with pytest.raises(ValueError, match="Unknown import backend"):
+            rbd.import_qcow2("/tmp/disk.qcow2", "vm1", backend="dd")
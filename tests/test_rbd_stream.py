@@ -0,0 +1,186 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+
+import pytest
+
+from fake_rbd import FakeImage
+
+from vm_manager.helpers.rbd_import import RbdImportException
+from vm_manager.helpers.rbd_stream import (
+    RbdImageStream,
+    RbdStreamException,
+    _merge_ranges,
+    iter_allocated_ranges,
+    iter_changed_extents,
+    iter_image_ranges,
+)
+
+
+@pytest.fixture
+def image():
+    img = FakeImage(64)
+    img.data[:] = bytes(range(64))
+    return img
+
+
+# ── RbdImageStream ───────────────────────────────────────────────────
+
+
+class TestRbdImageStream:
+    def test_seek_and_tell(self, image):
+        stream = RbdImageStream(image)
+        assert stream.seek(10) == 10
+        assert stream.seek(5, io.SEEK_CUR) == 15
+        assert stream.seek(-4, io.SEEK_END) == 60
+        assert stream.tell() == 60
+
+    def test_negative_seek_raises(self, image):
+        with pytest.raises(ValueError, match="Negative"):
+            RbdImageStream(image).seek(-1)
+
+    def test_invalid_whence_raises(self, image):
+        with pytest.raises(ValueError, match="whence"):
+            RbdImageStream(image).seek(0, 42)
+
+    def test_readinto_stops_at_the_end(self, image):
+        stream = RbdImageStream(image)
+        stream.seek(60)
+        buf = bytearray(8)
+        assert stream.readinto(buf) == 4
+        assert bytes(buf[:4]) == bytes(range(60, 64))
+        assert stream.readinto(buf) == 0
+
+    def test_read_through_buffered_reader(self, image):
+        stream = io.BufferedReader(RbdImageStream(image))
+        assert stream.read() == bytes(range(64))
+
+    def test_write(self, image):
+        stream = RbdImageStream(image)
+        stream.seek(8)
+        assert stream.write(b"abcd") == 4
+        assert stream.tell() == 12
+        assert image.data[8:12] == b"abcd"
+
+    def test_write_memoryview(self, image):
+        stream = RbdImageStream(image)
+        assert stream.write(memoryview(b"wxyz")[1:3]) == 2
+        assert image.data[:2] == b"xy"
+
+    def test_write_past_the_end_raises(self, image):
+        stream = RbdImageStream(image)
+        stream.seek(62)
+        with pytest.raises(RbdStreamException, match="past the end"):
+            stream.write(b"abcd")
+        assert image.data[62:] == bytes([62, 63])
+
+    def test_async_writes_are_flushed_on_close(self, image):
+        stream = RbdImageStream(image, queue_depth=4)
+        for i in range(8):
+            stream.write(bytes([255]) * 8)
+        stream.close()
+        assert image.data == bytes([255]) * 64
+        assert image.flushes
+
+    def test_async_write_error_is_raised(self):
+        stream = RbdImageStream(FakeImage(64, write_error=-5), queue_depth=2)
+        stream.write(b"a")
+        with pytest.raises(RbdImportException, match="-5"):
+            stream.flush()
+
+    def test_closed_stream_raises(self, image):
+        stream = RbdImageStream(image)
+        stream.close()
+        with pytest.raises(ValueError, match="closed"):
+            stream.write(b"a")
+        assert not image.closed
+
+    def test_iter_chunks(self, image):
+        stream = RbdImageStream(image, chunk_size=16)
+        chunks = list(stream.iter_chunks(start=10, end=40))
+        assert [(offset, len(data)) for offset, data in chunks] == [
+            (10, 6),
+            (16, 16),
+            (32, 8),
+        ]
+        assert b"".join(data for _, data in chunks) == bytes(range(10, 40))
+
+    def test_invalid_arguments_raise(self, image):
+        with pytest.raises(ValueError):
+            RbdImageStream(image, chunk_size=0)
+        with pytest.raises(ValueError):
+            RbdImageStream(image, queue_depth=-1)
+
+
+# ── Range iterators ──────────────────────────────────────────────────
+
+
+class TestIterImageRanges:
+    @pytest.mark.parametrize("queue_depth", [0, 2])
+    def test_ranges_are_read_in_order(self, image, queue_depth):
+        chunks = list(
+            iter_image_ranges(image, [(0, 10), (40, 20)], 16, queue_depth)
+        )
+        assert [(offset, len(data)) for offset, data in chunks] == [
+            (0, 10),
+            (40, 8),
+            (48, 12),
+        ]
+        assert chunks[2][1] == bytes(range(48, 60))
+
+
+class TestChangedExtents:
+    def test_merge_ranges(self):
+        assert list(
+            _merge_ranges(
+                [
+                    (0, 4, True),
+                    (4, 4, True),
+                    (8, 4, False),
+                    (16, 4, False),
+                    (20, 4, False),
+                ]
+            )
+        ) == [(0, 8, True), (8, 4, False), (16, 8, False)]
+
+    def test_merge_nothing(self):
+        assert list(_merge_ranges([])) == []
+
+    @pytest.mark.parametrize("window", [1024, 16, 5])
+    def test_extents_are_merged_across_windows(self, window):
+        image = FakeImage(64)
+        image.changes = [(0, 24, True), (24, 8, True), (40, 8, False)]
+        assert list(iter_changed_extents(image, window=window)) == [
+            (0, 32, True),
+            (40, 8, False),
+        ]
+
+    def test_windows_are_diffed_one_at_a_time(self):
+        calls = []
+        image = FakeImage(64)
+        diff_iterate = image.diff_iterate
+
+        def record(offset, length, from_snapshot, iterate_cb):
+            calls.append((offset, length))
+            diff_iterate(offset, length, from_snapshot, iterate_cb)
+
+        image.diff_iterate = record
+        image.changes = [(0, 4, True), (32, 4, True)]
+        extents = iter_changed_extents(image, window=16)
+        assert next(extents) == (0, 4, True)
+        assert calls == [(0, 16), (16, 16), (32, 16)]
+        assert list(extents) == [(32, 4, True)]
+        assert calls[-1] == (48, 16)
+
+    def test_invalid_window_raises(self, image):
+        with pytest.raises(ValueError):
+            list(iter_changed_extents(image, window=0))
+
+    def test_allocated_ranges_skip_discarded_extents(self):
+        image = FakeImage(64)
+        image.changes = [(0, 8, True), (8, 8, False), (32, 8, True)]
+        assert list(iter_allocated_ranges(image, "snap")) == [
+            (0, 8),
+            (32, 8),
+        ]
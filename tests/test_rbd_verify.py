@@ -0,0 +1,102 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from vm_manager.helpers import rbd_verify
+from vm_manager.helpers.rbd_import import AllocationMap
+from vm_manager.helpers.rbd_verify import (
+    RbdVerifyException,
+    _file_chunk_pieces,
+    digest_chunks,
+    digest_file,
+)
+
+CHUNK = 8
+
+
+def _chunks(data):
+    view = memoryview(data)
+    return [(i, bytes(view[i:][:CHUNK])) for i in range(0, len(data), CHUNK)]
+
+
+def _data(start, length, offset):
+    return {"start": start, "length": length, "data": True, "offset": offset}
+
+
+@pytest.fixture
+def image_file(tmp_path, monkeypatch):
+    """A file whose qemu-img info and map are set by the test."""
+    info = {}
+    extents = []
+    monkeypatch.setattr(rbd_verify, "qemu_img_info", lambda src, fmt: info)
+    monkeypatch.setattr(
+        AllocationMap,
+        "from_image",
+        classmethod(lambda cls, src, fmt: cls(extents)),
+    )
+    path = tmp_path / "disk.qcow2"
+    return str(path), path, info, extents
+
+
+# ── digest_chunks ────────────────────────────────────────────────────
+
+
+class TestDigestChunks:
+    def test_zero_chunks_are_left_out(self):
+        data = [(0, b"a" * CHUNK), (16, b"b" * CHUNK)]
+        with_zeros = [(0, b"a" * CHUNK), (8, bytes(CHUNK)), data[1]]
+        assert digest_chunks(data, 32) == digest_chunks(with_zeros, 32)
+
+    def test_order_does_not_matter(self):
+        data = [(0, b"a" * CHUNK), (16, b"b" * CHUNK)]
+        assert digest_chunks(data, 32, jobs=2) == digest_chunks(
+            reversed(data), 32, jobs=1
+        )
+
+    def test_offset_and_size_matter(self):
+        digest = digest_chunks([(0, b"a" * CHUNK)], 32)
+        assert digest != digest_chunks([(8, b"a" * CHUNK)], 32)
+        assert digest != digest_chunks([(0, b"a" * CHUNK)], 40)
+
+    def test_empty_disk(self):
+        assert digest_chunks([], 32) == digest_chunks([(0, bytes(32))], 32)
+
+
+# ── digest_file ──────────────────────────────────────────────────────
+
+
+class TestDigestFile:
+    def test_matches_the_chunks_it_reads_as(self, image_file):
+        src, path, info, extents = image_file
+        # The guest sees "a" * 12 at 4 and "b" * 4 at 24, stored out of
+        # order in the file.
+        path.write_bytes(b"b" * 4 + b"a" * 12)
+        info["virtual-size"] = 32
+        extents[:] = [_data(4, 12, 4), _data(24, 4, 0)]
+        guest = bytes(4) + b"a" * 12 + bytes(8) + b"b" * 4 + bytes(4)
+        assert digest_file(src, "qcow2", chunk_size=CHUNK) == (
+            digest_chunks(_chunks(guest), 32)
+        )
+
+    def test_backing_file_raises(self, image_file):
+        src, _, info, _ = image_file
+        info.update({"virtual-size": 32, "backing-filename": "base"})
+        with pytest.raises(RbdVerifyException, match="backing file"):
+            digest_file(src, "qcow2")
+
+    def test_compressed_data_raises(self, image_file):
+        src, _, info, extents = image_file
+        info["virtual-size"] = 32
+        extents.append({"start": 0, "length": 8, "data": True})
+        with pytest.raises(RbdVerifyException, match="compressed"):
+            digest_file(src, "qcow2")
+
+
+def test_file_chunk_pieces():
+    extents = [_data(4, 12, 100), _data(16, 4, 0)]
+    assert list(_file_chunk_pieces(extents, CHUNK)) == [
+        (0, [(4, 4, 100)]),
+        (8, [(8, 8, 104)]),
+        (16, [(16, 4, 0)]),
+    ]
@@ -0,0 +1,136 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+import datetime
+
+import pytest
+
+from vm_manager.helpers import retention
+from vm_manager.helpers.retention import RetentionPolicy
+
+NOW = datetime.datetime(2026, 3, 10, 12, 0, 0)
+
+
+def _snap(name, days=0, hours=0):
+    return {
+        "name": name,
+        "timestamp": NOW - datetime.timedelta(days=days, hours=hours),
+    }
+
+
+def _kept(plan):
+    return [entry["name"] for entry in plan if entry["keep"]]
+
+
+class TestRules:
+    def test_keep_last(self):
+        snaps = [_snap("s" + str(i), days=5 - i) for i in range(5)]
+        plan = RetentionPolicy(keep_last=2).select(snaps, NOW)
+        assert _kept(plan) == ["s3", "s4"]
+        assert plan[0]["reasons"] == ["not kept by any rule"]
+
+    def test_keep_daily_keeps_the_last_snapshot_of_each_day(self):
+        snaps = [
+            _snap("d2-early", days=2, hours=5),
+            _snap("d2-late", days=2, hours=1),
+            _snap("d1-early", days=1, hours=5),
+            _snap("d1-late", days=1, hours=1),
+            _snap("d0", hours=1),
+        ]
+        plan = RetentionPolicy(keep_daily=2).select(snaps, NOW)
+        assert _kept(plan) == ["d1-late", "d0"]
+
+    def test_keep_hourly(self):
+        snaps = [
+            _snap("h2", hours=2),
+            _snap("h1-early", hours=1),
+            _snap("h1-late", hours=1),
+        ]
+        snaps[2]["timestamp"] += datetime.timedelta(minutes=20)
+        plan = RetentionPolicy(keep_hourly=5).select(snaps, NOW)
+        assert _kept(plan) == ["h2", "h1-late"]
+
+    def test_keep_weekly(self):
+        snaps = [_snap("w" + str(i), days=7 * (3 - i)) for i in range(4)]
+        plan = RetentionPolicy(keep_weekly=2).select(snaps, NOW)
+        assert _kept(plan) == ["w2", "w3"]
+
+    def test_rules_add_up(self):
+        snaps = [_snap("s" + str(i), days=3 - i) for i in range(4)]
+        plan = RetentionPolicy(keep_last=1, keep_daily=2).select(snaps, NOW)
+        assert _kept(plan) == ["s2", "s3"]
+        assert plan[-1]["reasons"] == ["last", "daily"]
+
+
+class TestExcludeAndUntimed:
+    def test_excluded_snapshots_are_kept(self):
+        snaps = [_snap("backup1", days=3), _snap("s1", days=2)]
+        plan = RetentionPolicy(
+            max_age=datetime.timedelta(days=1), exclude=["backup*"]
+        ).select(snaps, NOW)
+        assert _kept(plan) == ["backup1"]
+        assert plan[0]["reasons"] == ["excluded"]
+
+    def test_snapshots_without_timestamp_are_kept(self):
+        snaps = [{"name": "old", "timestamp": None}, _snap("s1", days=2)]
+        plan = RetentionPolicy(keep_last=1).select(snaps, NOW)
+        assert _kept(plan) == ["old", "s1"]
+        assert plan[0]["reasons"] == ["no timestamp"]
+
+
+class TestMaxAge:
+    def test_max_age_alone(self):
+        snaps = [_snap("old", days=40), _snap("new", days=10)]
+        plan = RetentionPolicy(max_age=datetime.timedelta(days=30)).select(
+            snaps, NOW
+        )
+        assert _kept(plan) == ["new"]
+        assert plan[0]["reasons"] == ["older than max age"]
+
+    def test_max_age_bounds_the_period_rules(self):
+        snaps = [_snap("old", days=40), _snap("new", days=10)]
+        plan = RetentionPolicy(
+            keep_daily=7, max_age=datetime.timedelta(days=30)
+        ).select(snaps, NOW)
+        assert _kept(plan) == ["new"]
+
+    def test_max_age_keeps_the_last_snapshots(self):
+        """A VM whose snapshots stopped does not lose all of them."""
+        snaps = [_snap("s" + str(i), days=50 - i) for i in range(5)]
+        plan = RetentionPolicy(
+            keep_last=3, max_age=datetime.timedelta(days=30)
+        ).select(snaps, NOW)
+        assert _kept(plan) == ["s2", "s3", "s4"]
+
+    def test_now_defaults_to_utc(self, monkeypatch):
+        """Snapshot timestamps are naive UTC, so is the default now."""
+        monkeypatch.setattr(retention, "utcnow", lambda: NOW)
+        snaps = [
+            {"name": "old", "timestamp": NOW - datetime.timedelta(minutes=10)},
+            {"name": "new", "timestamp": NOW - datetime.timedelta(minutes=1)},
+        ]
+        plan = RetentionPolicy(max_age=datetime.timedelta(minutes=5)).select(
+            snaps
+        )
+        assert _kept(plan) == ["new"]
+
+    def test_utcnow_is_naive_utc(self):
+        utc_now = datetime.datetime.now(datetime.timezone.utc)
+        now = retention.utcnow()
+        assert now.tzinfo is None
+        assert abs(now - utc_now.replace(tzinfo=None)).total_seconds() < 60
+
+
+class TestValidation:
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {},
+            {"keep_last": -1},
+            {"keep_daily": 1.5},
+            {"keep_last": 1, "max_age": 30},
+        ],
+    )
+    def test_invalid_policies_raise(self, kwargs):
+        with pytest.raises(ValueError):
+            RetentionPolicy(**kwargs)
@@ -56,6 +56,26 @@ def test_status(client, monkeypatch):
     assert response.get_data(as_text=True) == "guest0 is Running"
 
 
+def test_progress(client, monkeypatch):
+    records = [
+        {"vm": "guest0", "operation": "copy", "target": "system_guest0"},
+        {"vm": "guest1", "operation": "import", "target": "system_guest1"},
+    ]
+    monkeypatch.setattr(
+        vm_manager_api.v,
+        "list_progress",
+        lambda vm_name=None: [
+            r for r in records if vm_name is None or r["vm"] == vm_name
+        ],
+    )
+
+    assert client.get("/progress").get_json() == records
+    response = client.get("/progress/guest1")
+
+    assert response.status_code == 200
+    assert response.get_json() == records[1:]
+
+
 def test_stop(client, monkeypatch):
     monkeypatch.setattr(
         vm_manager_api.v, "stop", lambda guest: f"{guest} stopped"
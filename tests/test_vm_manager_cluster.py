@@ -2,6 +2,7 @@
 # Copyright (C) 2026 Savoir-faire Linux Inc.
 # SPDX-License-Identifier: Apache-2.0
 
+import json
 import os
 import secrets
 import subprocess
@@ -465,6 +466,91 @@ class TestRemove:
 # ── list_all_uuids ──────────────────────────────────────────────────
 
 
+class TestDeferredRemove:
+    def test_remove_and_restore(self, created_vm_with_additional_disks):
+        vm = created_vm_with_additional_disks
+        vmc.create_snapshot(vm, "snap1", per_image=True)
+        vmc.remove(vm, deferred=True)
+        assert vm not in vmc.list_vms()
+        assert {disk["vm"] for disk in vmc.list_trash(vm)} == {vm}
+        disks = vmc.restore_from_trash(vm)
+        assert disks[0] == "system_" + vm
+        assert vm in vmc.list_vms()
+        assert vmc.list_snapshots(vm) == ["snap1"]
+        assert vmc.list_trash(vm) == []
+
+    def test_purge_waits_for_the_undo_window(self, created_vm):
+        vmc.remove(created_vm, deferred=True)
+        assert vmc.purge_trash(created_vm) == []
+        assert vmc.purge_trash(created_vm, force=True) == [
+            "system_" + created_vm
+        ]
+        assert vmc.list_trash(created_vm) == []
+
+    def test_restore_existing_vm_raises(self, created_vm):
+        with pytest.raises(Exception, match="already exists"):
+            vmc.restore_from_trash(created_vm)
+
+
+class TestDiskLayout:
+    def test_create_and_clone_keep_the_layout(
+        self, vm_name, second_vm_name, qcow2_image
+    ):
+        vmc.create(
+            {
+                "name": vm_name,
+                "image": qcow2_image,
+                "base_xml": _read_test_xml(),
+                "disk_layout": {"order": 20},
+            }
+        )
+        layout = {"order": 20, "features": list(vmc.DISK_FEATURES)}
+        assert json.loads(vmc.get_metadata(vm_name, "_disk_layout")) == layout
+        vmc.clone({"name": vm_name, "dst_name": second_vm_name})
+        assert (
+            json.loads(vmc.get_metadata(second_vm_name, "_disk_layout"))
+            == layout
+        )
+
+    def test_invalid_layout_raises(self, vm_name, qcow2_image):
+        with pytest.raises(ValueError, match="order"):
+            vmc.create(
+                {
+                    "name": vm_name,
+                    "image": qcow2_image,
+                    "base_xml": _read_test_xml(),
+                    "disk_layout": {"order": 30},
+                }
+            )
+        assert vm_name not in vmc.list_vms()
+
+
+class TestUpgradeFeatures:
+    def test_created_disks_need_no_upgrade(self, created_vm):
+        (entry,) = vmc.upgrade_features([created_vm], dry_run=True)
+        assert entry["enable"] == []
+        assert not entry["rebuild"]
+
+    def test_upgrade_enables_fast_diff(self, vm_name, qcow2_image):
+        vmc.create(
+            {
+                "name": vm_name,
+                "image": qcow2_image,
+                "base_xml": _read_test_xml(),
+                "disk_layout": {"features": ["layering"]},
+            }
+        )
+        vmc.create_snapshot(vm_name, "snap1", per_image=True)
+        (entry,) = vmc.upgrade_features([vm_name])
+        assert entry["enable"] == ["exclusive-lock", "object-map", "fast-diff"]
+        assert entry["unsupported"] == ["deep-flatten"]
+        assert entry["rebuilt"] == 2
+        (entry,) = vmc.upgrade_features([vm_name], dry_run=True)
+        assert entry["enable"] == []
+        assert not entry["rebuild"]
+        assert vmc.get_usage(vm_name)[0]["disks"][0]["fast_diff"]
+
+
 class TestListAllUuids:
     def test_returns_dict(self):
         result = vmc.list_all_uuids()
@@ -537,6 +623,11 @@ class TestSnapshots:
         vmc.create_snapshot(created_vm, "snap1")
         vmc.rollback_snapshot(created_vm, "snap1")
 
+    def test_rollback_snapshot_keep_resource(self, created_vm):
+        vmc.create_snapshot(created_vm, "snap1")
+        vmc.rollback_snapshot(created_vm, "snap1", keep_resource=True)
+        assert vmc.status(created_vm) == "Started"
+
     def test_rollback_nonexistent_raises(self, created_vm):
         with pytest.raises(Exception, match="does not exist"):
             vmc.rollback_snapshot(created_vm, "nosuchsnap")
@@ -555,6 +646,35 @@ class TestSnapshots:
         snaps = vmc.list_snapshots(created_vm)
         assert len(snaps) == 1
 
+    def test_per_image_snapshot(self, created_vm):
+        vmc.create_snapshot(created_vm, "snap1", per_image=True)
+        assert "snap1" in vmc.list_snapshots(created_vm)
+        vmc.rollback_snapshot(created_vm, "snap1")
+        vmc.remove_snapshot(created_vm, "snap1")
+        assert "snap1" not in vmc.list_snapshots(created_vm)
+
+    def test_group_and_per_image_names_are_exclusive(self, created_vm):
+        vmc.create_snapshot(created_vm, "snap1", per_image=True)
+        with pytest.raises(Exception, match="already exists"):
+            vmc.create_snapshot(created_vm, "snap1")
+
+    def test_purge_by_number_mixed(self, created_vm):
+        vmc.create_snapshot(created_vm, "snap1", per_image=True)
+        vmc.create_snapshot(created_vm, "snap2")
+        vmc.create_snapshot(created_vm, "snap3", per_image=True)
+        vmc.purge_image(created_vm, number=2)
+        assert vmc.list_snapshots(created_vm) == ["snap3"]
+
+    def test_list_snapshots_detailed(self, created_vm):
+        vmc.create_snapshot(created_vm, "snap1", per_image=True)
+        vmc.create_snapshot(created_vm, "snap2")
+        snaps = vmc.list_snapshots(created_vm, detailed=True)
+        assert [snap["name"] for snap in snaps] == ["snap1", "snap2"]
+        assert [snap["group"] for snap in snaps] == [False, True]
+        assert all(snap["exact"] for snap in snaps)
+        # The second call reads the cached deltas
+        assert vmc.list_snapshots(created_vm, detailed=True) == snaps
+
     def test_purge_invalid_args(self):
         with pytest.raises(ValueError, match="not datetime"):
             vmc.purge_image("vm", date="2025-01-01")
@@ -595,6 +715,87 @@ class TestClone:
         )
         assert second_vm_name in vmc.list_vms()
 
+    def test_fast_clone_vm(self, created_vm, second_vm_name):
+        vmc.clone(
+            {
+                "name": created_vm,
+                "dst_name": second_vm_name,
+                "fast": True,
+            }
+        )
+        assert second_vm_name in vmc.list_vms()
+        assert json.loads(
+            vmc.get_metadata(second_vm_name, "_clone_parent")
+        ) == {
+            "image": "system_" + created_vm,
+            "snapshot": "_clone_" + second_vm_name,
+        }
+        # The clone snapshot is not a VM snapshot
+        assert vmc.list_snapshots(created_vm) == []
+
+    def test_fast_clone_parent_cannot_be_removed(
+        self, created_vm, second_vm_name
+    ):
+        vmc.clone(
+            {
+                "name": created_vm,
+                "dst_name": second_vm_name,
+                "fast": True,
+            }
+        )
+        with pytest.raises(Exception, match="fast clones"):
+            vmc.remove(created_vm)
+        vmc.remove(second_vm_name)
+        vmc.remove(created_vm)
+        assert created_vm not in vmc.list_vms()
+
+    def test_flattened_fast_clone_frees_parent(
+        self, created_vm, second_vm_name
+    ):
+        vmc.clone(
+            {
+                "name": created_vm,
+                "dst_name": second_vm_name,
+                "fast": True,
+                "flatten": True,
+            }
+        )
+        status = vmc.flatten_status(second_vm_name)
+        assert status["system_" + second_vm_name]["state"] == "queued"
+        vmc.run_flatten_queue()
+        status = vmc.flatten_status(second_vm_name)
+        assert status["system_" + second_vm_name]["state"] == "done"
+        vmc.remove(created_vm)
+        assert second_vm_name in vmc.list_vms()
+
+    def test_flatten_skips_disks_claimed_by_another_runner(
+        self, created_vm, second_vm_name
+    ):
+        vmc.clone(
+            {
+                "name": created_vm,
+                "dst_name": second_vm_name,
+                "fast": True,
+                "flatten": True,
+            }
+        )
+        disk_name = "system_" + second_vm_name
+        with vmc.RbdManager(
+            vmc.CEPH_CONF, vmc.POOL_NAME, vmc.NAMESPACE
+        ) as rbd:
+            assert rbd.try_lock(
+                vmc.FLATTEN_LOCK_OBJECT, disk_name, "other", 60
+            )
+            try:
+                assert disk_name not in vmc.run_flatten_queue()
+                status = vmc.flatten_status(second_vm_name)
+                assert status[disk_name]["state"] == "queued"
+            finally:
+                rbd.unlock(vmc.FLATTEN_LOCK_OBJECT, disk_name, "other")
+        vmc.run_flatten_queue()
+        status = vmc.flatten_status(second_vm_name)
+        assert status[disk_name]["state"] == "done"
+
     def test_clone_same_name_raises(self):
         with pytest.raises(ValueError, match="same name"):
             vmc.clone({"name": "myvm", "dst_name": "myvm"})
@@ -832,7 +1033,10 @@ class TestAdditionalDisksClone:
     def test_clone_snapshot_preserved(
         self, created_vm_with_additional_disks, second_vm_name
     ):
-        vmc.create_snapshot(created_vm_with_additional_disks, "snap1")
+        # Deep copies keep per-image snapshots, not group snapshots
+        vmc.create_snapshot(
+            created_vm_with_additional_disks, "snap1", per_image=True
+        )
         vmc.clone(
             {
                 "name": created_vm_with_additional_disks,
@@ -842,6 +1046,128 @@ class TestAdditionalDisksClone:
         assert "snap1" in vmc.list_snapshots(second_vm_name)
 
 
+class TestVerify:
+    def test_create_with_verify(self, vm_name, qcow2_image):
+        vmc.create(
+            {
+                "name": vm_name,
+                "image": qcow2_image,
+                "base_xml": _read_test_xml(),
+                "verify": True,
+            }
+        )
+        assert vmc.verify_vm(vm_name, image=qcow2_image) == {
+            "system_" + vm_name: True
+        }
+
+    def test_fast_clone_with_verify(self, created_vm, second_vm_name):
+        vmc.clone(
+            {
+                "name": created_vm,
+                "dst_name": second_vm_name,
+                "fast": True,
+                "verify": True,
+            }
+        )
+        assert all(vmc.verify_vm(second_vm_name, src_vm=created_vm).values())
+
+    def test_verify_without_source_raises(self, created_vm):
+        with pytest.raises(ValueError, match="No source"):
+            vmc.verify_vm(created_vm)
+
+
+class TestUsage:
+    def test_usage_of_a_vm(self, created_vm):
+        vmc.create_snapshot(created_vm, "snap1", per_image=True)
+        (report,) = vmc.get_usage(created_vm)
+        assert report["name"] == created_vm
+        assert report["provisioned"] == 64 * 1024**2
+        assert report["exact"]
+        (disk,) = report["disks"]
+        assert [snap["name"] for snap in disk["snapshots"]] == ["snap1"]
+
+    def test_usage_of_the_pool(self, created_vm):
+        names = [vm["name"] for vm in vmc.get_usage()]
+        assert created_vm in names
+        assert names == sorted(names)
+
+    def test_usage_of_missing_vm_raises(self):
+        with pytest.raises(Exception, match="does not exist"):
+            vmc.get_usage("nosuchvm")
+
+
+class TestRetention:
+    def test_dry_run_removes_nothing(self, created_vm):
+        for name in ("snap1", "snap2", "snap3"):
+            vmc.create_snapshot(created_vm, name)
+        plan = vmc.apply_retention(
+            keep_last=1, vm_names=[created_vm], dry_run=True
+        )
+        assert [entry["keep"] for entry in plan[created_vm]] == [
+            False,
+            False,
+            True,
+        ]
+        assert vmc.list_snapshots(created_vm) == ["snap1", "snap2", "snap3"]
+
+    def test_apply_keeps_last_and_excluded(self, created_vm):
+        for name in ("backup1", "snap1", "snap2", "snap3"):
+            vmc.create_snapshot(created_vm, name, per_image=True)
+        vmc.apply_retention(
+            keep_last=2, exclude=["backup*"], vm_names=[created_vm]
+        )
+        assert vmc.list_snapshots(created_vm) == ["backup1", "snap2", "snap3"]
+
+    def test_policy_without_rule_raises(self, created_vm):
+        with pytest.raises(ValueError, match="at least one rule"):
+            vmc.apply_retention(vm_names=[created_vm])
+
+
+class TestBackup:
+    def test_incremental_backup_and_restore(
+        self, created_vm_with_additional_disks, tmp_path
+    ):
+        vm = created_vm_with_additional_disks
+        full = str(tmp_path / "full.delta")
+        incr = str(tmp_path / "incr.delta")
+        assert vmc.backup_vm(vm, full, snapshot_name="b1") == "b1"
+        vmc.backup_vm(vm, incr, since="b1", snapshot_name="b2")
+        assert os.path.getsize(incr) < os.path.getsize(full)
+        vmc.remove_snapshot(vm, "b2")
+        vmc.restore_vm(vm, [incr])
+        assert "b2" in vmc.list_snapshots(vm)
+
+    def test_backup_since_group_snapshot_raises(self, created_vm, tmp_path):
+        vmc.create_snapshot(created_vm, "snap1")
+        with pytest.raises(Exception, match="per-image snapshots"):
+            vmc.backup_vm(
+                created_vm, str(tmp_path / "vm.delta"), since="snap1"
+            )
+
+    def test_restore_broken_chain_raises(self, created_vm, tmp_path):
+        full = str(tmp_path / "full.delta")
+        incr = str(tmp_path / "incr.delta")
+        vmc.backup_vm(created_vm, full, snapshot_name="b1")
+        vmc.backup_vm(created_vm, incr, since="b1", snapshot_name="b2")
+        with pytest.raises(Exception, match="does not follow"):
+            vmc.restore_vm(created_vm, [incr, full])
+
+
+class TestChunkStoreBackup:
+    def test_backup_and_restore(self, created_vm, tmp_path):
+        store = str(tmp_path / "store")
+        assert vmc.backup_vm_to_store(created_vm, store, "b1") == "b1"
+        assert "b1" not in vmc.list_snapshots(created_vm)
+        vmc.restore_vm_from_store(created_vm, store, "b1")
+
+    def test_identical_backups_share_chunks(self, created_vm, tmp_path):
+        store = tmp_path / "store"
+        vmc.backup_vm_to_store(created_vm, str(store), "b1")
+        chunks = sorted((store / "chunks").rglob("*"))
+        vmc.backup_vm_to_store(created_vm, str(store), "b2")
+        assert sorted((store / "chunks").rglob("*")) == chunks
+
+
 class TestAdditionalDisksCreateXml:
     def test_additional_disks_in_xml(self):
         xml = _read_test_xml()
@@ -18,6 +18,7 @@ Ceph installed.
 
 import argparse
 import datetime
+import json
 import logging
 import sys
 
@@ -39,25 +40,114 @@ API_RESULTS = {
     "add_colocation": None,
     "add_pacemaker_remote": None,
     "add_to_cluster": None,
+    "apply_retention": {
+        "vm1": [
+            {
+                "name": "s1",
+                "timestamp": datetime.datetime(2026, 1, 1, 0, 0, 0),
+                "group": True,
+                "keep": False,
+                "reasons": ["not kept by any rule"],
+            },
+            {
+                "name": "s2",
+                "timestamp": datetime.datetime(2026, 1, 2, 0, 0, 0),
+                "group": False,
+                "keep": True,
+                "reasons": ["last"],
+            },
+        ]
+    },
+    "backup_vm": "backup20260101000000",
+    "backup_vm_to_store": "backup20260101000000",
     "clone": None,
     "console": None,
     "create": None,
     "create_snapshot": None,
     "disable_vm": None,
     "enable_vm": None,
+    "flatten_status": {
+        "system_vm1": {"state": "running", "progress": 42.0},
+        "data_vm1_0": {"state": "failed", "progress": 0.0, "error": "boom"},
+    },
+    "flatten_vm": ["system_vm1"],
     "get_metadata": "some-value",
+    "get_usage": [
+        {
+            "name": "vm1",
+            "provisioned": 2 * 1024**3,
+            "used": 3 * 1024**2,
+            "exact": False,
+            "disks": [
+                {
+                    "name": "system_vm1",
+                    "provisioned": 2 * 1024**3,
+                    "used": 1024**2,
+                    "snapshots": [
+                        {"name": "s1", "group": True, "used": 2 * 1024**2}
+                    ],
+                    "fast_diff": True,
+                    "exact": False,
+                }
+            ],
+        }
+    ],
     "list_metadata": ["key1", "key2"],
+    "list_trash": [
+        {
+            "id": "10f2a3b4c5d6",
+            "name": "system_vm1",
+            "vm": "vm1",
+            "deleted": datetime.datetime(2026, 1, 1, 0, 0, 0),
+            "purgeable": datetime.datetime(2026, 1, 2, 0, 0, 0),
+            "expired": True,
+        }
+    ],
+    "list_progress": [
+        {
+            "vm": "vm1",
+            "operation": "copy",
+            "target": "system_vm1",
+            "state": "running",
+            "done": 1024**3,
+            "total": 4 * 1024**3,
+            "unit": "B",
+            "percent": 25.0,
+            "rate": 64 * 1024**2,
+            "eta": 48.0,
+            "elapsed": 16.0,
+            "started": "2026-01-01T00:00:00",
+            "updated": "2026-01-01T00:00:16",
+        }
+    ],
     "list_snapshots": ["snap1", "snap2"],
     "list_vms": ["vm1", "vm2"],
     "purge_image": None,
+    "purge_trash": ["system_vm1", "data_vm1_0"],
     "remove": None,
     "remove_pacemaker_remote": None,
     "remove_snapshot": None,
+    "restore_from_trash": ["system_vm1"],
+    "restore_vm": None,
+    "restore_vm_from_store": None,
     "rollback_snapshot": None,
+    "run_flatten_queue": {},
     "set_metadata": None,
     "start": None,
     "status": "Running",
     "stop": None,
+    "upgrade_features": [
+        {
+            "vm": "vm1",
+            "disk": "system_vm1",
+            "features": ["layering"],
+            "enable": ["exclusive-lock", "object-map", "fast-diff"],
+            "unsupported": ["deep-flatten"],
+            "rebuild": True,
+            "rebuilt": 0,
+        }
+    ],
+    "verify_vm": {"system_vm1": True},
 }
 
 
@@ -74,19 +164,25 @@ MINIMAL_ARGV = {
         "--remote_address",
         "10.0.0.1",
     ],
+    "backup": ["backup", "-n", "vm1", "-o", "vm1.delta"],
     "clone": ["clone", "-n", "vm1", "--dst_name", "vm2"],
     "console": ["console", "vm1"],
     "create_snapshot": ["create_snapshot", "-n", "vm1", "--snap_name", "s1"],
     "disable": ["disable", "-n", "vm1"],
     "enable": ["enable", "-n", "vm1"],
+    "flatten": ["flatten", "-n", "vm1"],
     "get_metadata": ["get_metadata", "-n", "vm1", "--metadata_name", "k"],
     "list": ["list"],
     "list_metadata": ["list_metadata", "-n", "vm1"],
     "list_snapshots": ["list_snapshots", "-n", "vm1"],
+    "features": ["features", "upgrade", "-n", "vm1"],
+    "progress": ["progress", "-n", "vm1"],
     "purge": ["purge", "-n", "vm1"],
+    "retention": ["retention", "apply", "-n", "vm1", "--keep-last", "1"],
     "remove": ["remove", "-n", "vm1"],
     "remove_pacemaker_remote": ["remove_pacemaker_remote", "-n", "vm1"],
     "remove_snapshot": ["remove_snapshot", "-n", "vm1", "--snap_name", "s1"],
+    "restore": ["restore", "-n", "vm1", "-i", "vm1.delta"],
     "rollback": ["rollback", "-n", "vm1", "--snap_name", "s1"],
     "set_metadata": [
         "set_metadata",
@@ -99,7 +195,10 @@ MINIMAL_ARGV = {
     ],
     "start": ["start", "-n", "vm1"],
     "status": ["status", "-n", "vm1"],
+    "usage": ["usage", "-n", "vm1"],
     "stop": ["stop", "-n", "vm1"],
+    "trash": ["trash", "list", "-n", "vm1"],
+    "verify": ["verify", "-n", "vm1", "--src_name", "vm0"],
 }
 
 
@@ -347,6 +446,10 @@ class TestParserStructure:
         args = parser.parse_args(["add_colocation", "-n", "vm1", "a", "b"])
         assert args.resources == ["a", "b"]
 
+    def test_flatten_run_and_status_are_exclusive(self, parser):
+        with pytest.raises(SystemExit):
+            parser.parse_args(["flatten", "--run", "--status"])
+
     def test_add_colocation_requires_a_resource(self, parser):
         with pytest.raises(SystemExit):
             parser.parse_args(["add_colocation", "-n", "vm1"])
@@ -403,6 +506,35 @@ DISPATCH_CASES = [
     (["stop", "-n", "vm1", "-f"], ("stop", ("vm1",), {"force": True})),
     (["stop", "-n", "vm1", "--force"], ("stop", ("vm1",), {"force": True})),
     (["remove", "-n", "vm1"], ("remove", ("vm1",), {})),
+    (
+        ["remove", "-n", "vm1", "--deferred"],
+        ("remove", ("vm1",), {"deferred": True}),
+    ),
+    (
+        ["remove", "-n", "vm1", "--deferred", "--undo-window", "12h"],
+        ("remove", ("vm1",), {"deferred": True, "undo_window": 43200}),
+    ),
+    (["trash", "list"], ("list_trash", (None,), {})),
+    (
+        ["trash", "restore", "-n", "vm1"],
+        ("restore_from_trash", ("vm1",), {}),
+    ),
+    (
+        ["trash", "purge"],
+        (
+            "purge_trash",
+            (None,),
+            {"force": False, "rate": None, "progress": False},
+        ),
+    ),
+    (
+        ["trash", "purge", "-n", "vm1", "--force", "--rate", "64", "-p"],
+        (
+            "purge_trash",
+            ("vm1",),
+            {"force": True, "rate": 64 * 1024 * 1024, "progress": True},
+        ),
+    ),
     (["status", "-n", "vm1"], ("status", ("vm1",), {})),
     (["disable", "-n", "vm1"], ("disable_vm", ("vm1",), {})),
     (["enable", "-n", "vm1"], ("enable_vm", ("vm1", False), {})),
@@ -414,7 +546,11 @@ DISPATCH_CASES = [
     ),
     (
         ["create_snapshot", "-n", "vm1", "--snap_name", "s1"],
-        ("create_snapshot", ("vm1", "s1"), {}),
+        ("create_snapshot", ("vm1", "s1"), {"per_image": False}),
+    ),
+    (
+        ["create_snapshot", "-n", "vm1", "--snap_name", "s1", "--per-image"],
+        ("create_snapshot", ("vm1", "s1"), {"per_image": True}),
     ),
     (
         ["remove_snapshot", "-n", "vm1", "--snap_name", "s1"],
@@ -423,14 +559,219 @@ DISPATCH_CASES = [
     (["list_snapshots", "-n", "vm1"], ("list_snapshots", ("vm1",), {})),
     (
         ["rollback", "-n", "vm1", "--snap_name", "s1"],
-        ("rollback_snapshot", ("vm1", "s1"), {}),
+        (
+            "rollback_snapshot",
+            ("vm1", "s1"),
+            {"keep_resource": False, "progress": False},
+        ),
+    ),
+    (
+        ["rollback", "-n", "vm1", "--snap_name", "s1", "--keep-resource"],
+        (
+            "rollback_snapshot",
+            ("vm1", "s1"),
+            {"keep_resource": True, "progress": False},
+        ),
+    ),
+    (
+        ["rollback", "-n", "vm1", "--snap_name", "s1", "-p"],
+        (
+            "rollback_snapshot",
+            ("vm1", "s1"),
+            {"keep_resource": False, "progress": True},
+        ),
+    ),
+    (
+        ["retention", "apply", "--keep-last", "3", "--max-age", "30d"],
+        (
+            "apply_retention",
+            (),
+            {
+                "keep_last": 3,
+                "keep_hourly": 0,
+                "keep_daily": 0,
+                "keep_weekly": 0,
+                "max_age": datetime.timedelta(days=30),
+                "exclude": [],
+                "vm_names": None,
+                "dry_run": False,
+                "jobs": 4,
+            },
+        ),
+    ),
+    (
+        [
+            "retention",
+            "apply",
+            "-n",
+            "vm1",
+            "--keep-daily",
+            "7",
+            "--keep-weekly",
+            "4",
+            "--exclude",
+            "backup*",
+            "--dry-run",
+            "--jobs",
+            "8",
+        ],
+        (
+            "apply_retention",
+            (),
+            {
+                "keep_last": 0,
+                "keep_hourly": 0,
+                "keep_daily": 7,
+                "keep_weekly": 4,
+                "max_age": None,
+                "exclude": ["backup*"],
+                "vm_names": ["vm1"],
+                "dry_run": True,
+                "jobs": 8,
+            },
+        ),
+    ),
+    (
+        ["features", "upgrade"],
+        (
+            "upgrade_features",
+            (),
+            {
+                "vm_names": None,
+                "features": None,
+                "jobs": 4,
+                "dry_run": False,
+                "progress": False,
+            },
+        ),
+    ),
+    (
+        [
+            "features",
+            "upgrade",
+            "-n",
+            "vm1",
+            "--features",
+            "exclusive-lock,object-map",
+            "--jobs",
+            "8",
+            "--dry-run",
+            "-p",
+        ],
+        (
+            "upgrade_features",
+            (),
+            {
+                "vm_names": ["vm1"],
+                "features": ["exclusive-lock", "object-map"],
+                "jobs": 8,
+                "dry_run": True,
+                "progress": True,
+            },
+        ),
+    ),
+    (["progress"], ("list_progress", (None,), {})),
+    (["progress", "-n", "vm1"], ("list_progress", ("vm1",), {})),
+    (["usage"], ("get_usage", (None,), {"jobs": 16})),
+    (
+        ["usage", "-n", "vm1", "--jobs", "4"],
+        ("get_usage", ("vm1",), {"jobs": 4}),
+    ),
+    (
+        [
+            "verify",
+            "-n",
+            "vm1",
+            "-i",
+            "sys.qcow2",
+            "--additional-disk",
+            "d0.qcow2",
+            "--jobs",
+            "8",
+        ],
+        (
+            "verify_vm",
+            ("vm1",),
+            {
+                "image": "sys.qcow2",
+                "additional_disks": ["d0.qcow2"],
+                "src_vm": None,
+                "jobs": 8,
+            },
+        ),
+    ),
+    (
+        ["backup", "-n", "vm1", "-o", "vm1.delta"],
+        (
+            "backup_vm",
+            ("vm1", "vm1.delta"),
+            {"since": None, "snapshot_name": None},
+        ),
+    ),
+    (
+        [
+            "backup",
+            "-n",
+            "vm1",
+            "-o",
+            "vm1.delta",
+            "--since",
+            "b1",
+            "--snap_name",
+            "b2",
+        ],
+        (
+            "backup_vm",
+            ("vm1", "vm1.delta"),
+            {"since": "b1", "snapshot_name": "b2"},
+        ),
+    ),
+    (
+        ["backup", "-n", "vm1", "--store", "/backups"],
+        ("backup_vm_to_store", ("vm1", "/backups", None), {"jobs": 4}),
+    ),
+    (
+        [
+            "restore",
+            "-n",
+            "vm1",
+            "--store",
+            "/backups",
+            "--snap_name",
+            "b1",
+            "--jobs",
+            "8",
+        ],
+        ("restore_vm_from_store", ("vm1", "/backups", "b1"), {"jobs": 8}),
+    ),
+    (
+        ["restore", "-n", "vm1", "-i", "full.delta", "incr.delta"],
+        ("restore_vm", ("vm1", ["full.delta", "incr.delta"]), {}),
+    ),
+    (
+        ["purge", "-n", "vm1"],
+        ("purge_image", ("vm1", None, None), {"progress": False}),
     ),
-    (["purge", "-n", "vm1"], ("purge_image", ("vm1", None, None), {})),
     (
         ["purge", "-n", "vm1", "--number", "3"],
-        ("purge_image", ("vm1", None, 3), {}),
+        ("purge_image", ("vm1", None, 3), {"progress": False}),
+    ),
+    (
+        ["purge", "-n", "vm1", "--progress"],
+        ("purge_image", ("vm1", None, None), {"progress": True}),
     ),
     (["list_metadata", "-n", "vm1"], ("list_metadata", ("vm1",), {})),
+    (["flatten", "-n", "vm1"], ("flatten_vm", ("vm1",), {})),
+    (["flatten", "--run"], ("run_flatten_queue", (2,), {})),
+    (
+        ["flatten", "--run", "--max-concurrent", "4"],
+        ("run_flatten_queue", (4,), {}),
+    ),
+    (["flatten", "--status"], ("flatten_status", (None,), {})),
+    (
+        ["flatten", "--status", "-n", "vm1"],
+        ("flatten_status", ("vm1",), {}),
+    ),
     (
         ["get_metadata", "-n", "vm1", "--metadata_name", "k"],
         ("get_metadata", ("vm1", "k"), {}),
@@ -522,6 +863,248 @@ class TestMainDispatch:
         run_cli("get_metadata", "-n", "vm1", "--metadata_name", "k")
         assert capsys.readouterr().out == "some-value\n"
 
+    def test_flatten_status_is_printed(self, run_cli, api, capsys):
+        run_cli("flatten", "--status")
+        assert capsys.readouterr().out == (
+            "data_vm1_0 failed 0.0% boom\nsystem_vm1 running 42.0%\n"
+        )
+
+    def test_detailed_snapshots_are_printed(
+        self, run_cli, capsys, monkeypatch
+    ):
+        calls = []
+
+        def list_snapshots(*args, **kwargs):
+            calls.append((args, kwargs))
+            return [
+                {
+                    "name": "s1",
+                    "timestamp": datetime.datetime(2026, 1, 2, 3, 4, 5),
+                    "group": True,
+                    "size": 2 * 1024**2,
+                    "exact": True,
+                },
+                {
+                    "name": "s2",
+                    "timestamp": datetime.datetime(2026, 1, 3, 3, 4, 5),
+                    "group": False,
+                    "size": 512,
+                    "exact": False,
+                },
+            ]
+
+        monkeypatch.setattr(vm_manager, "list_snapshots", list_snapshots)
+        run_cli("list_snapshots", "-n", "vm1", "--detailed")
+        assert calls == [(("vm1",), {"detailed": True})]
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == ["NAME", "TIMESTAMP", "SIZE"]
+        assert lines[1].split() == [
+            "s1",
+            "(group)",
+            "2026-01-02",
+            "03:04:05",
+            "2.0",
+            "MiB",
+        ]
+        assert lines[2].split() == [
+            "s2",
+            "2026-01-03",
+            "03:04:05",
+            "*512.0",
+            "B",
+        ]
+        assert lines[3].startswith("* ")
+
+    def test_usage_is_printed_as_a_table(self, run_cli, api, capsys):
+        run_cli("usage")
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == ["NAME", "PROVISIONED", "USED"]
+        assert lines[1].split() == ["vm1", "*", "2.0", "GiB", "3.0", "MiB"]
+        assert lines[2].split() == ["system_vm1", "2.0", "GiB", "1.0", "MiB"]
+        assert lines[3].split() == ["@s1", "(group)", "2.0", "MiB"]
+        assert lines[4].startswith("* ")
+
+    def test_usage_is_printed_as_json(self, run_cli, api, capsys):
+        run_cli("usage", "--json")
+        assert json.loads(capsys.readouterr().out) == API_RESULTS["get_usage"]
+
+    def test_retention_plan_is_printed(self, run_cli, api, capsys):
+        run_cli("retention", "apply", "--keep-last", "1", "--dry-run")
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == [
+            "VM",
+            "SNAPSHOT",
+            "TIMESTAMP",
+            "ACTION",
+            "REASONS",
+        ]
+        assert lines[1].split() == [
+            "vm1",
+            "s1",
+            "(group)",
+            "2026-01-01",
+            "00:00:00",
+            "would",
+            "remove",
+            "not",
+            "kept",
+            "by",
+            "any",
+            "rule",
+        ]
+        assert lines[2].split() == [
+            "vm1",
+            "s2",
+            "2026-01-02",
+            "00:00:00",
+            "keep",
+            "last",
+        ]
+
+    @pytest.mark.parametrize("value", ["30", "d", "3m", "-1d", "1.5d"])
+    def test_retention_rejects_invalid_max_age(self, parser, value):
+        with pytest.raises(SystemExit) as excinfo:
+            parser.parse_args(["retention", "apply", "--max-age", value])
+        assert excinfo.value.code == 2
+
+    def test_undo_window_requires_deferred(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("remove", "-n", "vm1", "--undo-window", "1d")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_trash_restore_requires_a_name(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("trash", "restore")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_trash_is_printed_as_a_table(self, run_cli, api, capsys):
+        run_cli("trash", "list")
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == ["NAME", "VM", "DELETED", "PURGEABLE", "ID"]
+        assert lines[1].split() == [
+            "system_vm1",
+            "vm1",
+            "2026-01-01",
+            "00:00:00",
+            "2026-01-02",
+            "00:00:00",
+            "10f2a3b4c5d6",
+        ]
+
+    def test_trash_purge_prints_the_disks_removed(self, run_cli, api, capsys):
+        run_cli("trash", "purge")
+        assert capsys.readouterr().out == "system_vm1\ndata_vm1_0\n"
+
+    def test_features_plan_is_printed(self, run_cli, api, capsys):
+        run_cli("features", "upgrade", "--dry-run")
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == [
+            "DISK",
+            "VM",
+            "ENABLE",
+            "REBUILD",
+            "UNSUPPORTED",
+        ]
+        assert lines[1].split() == [
+            "system_vm1",
+            "vm1",
+            "exclusive-lock,object-map,fast-diff",
+            "yes",
+            "deep-flatten",
+        ]
+
+    def test_features_plan_is_printed_as_json(self, run_cli, api, capsys):
+        run_cli("features", "upgrade", "--json")
+        assert (
+            json.loads(capsys.readouterr().out)
+            == API_RESULTS["upgrade_features"]
+        )
+
+    def test_progress_is_printed(self, run_cli, api, capsys):
+        run_cli("progress")
+        assert capsys.readouterr().out == (
+            "copy system_vm1: 25.0% (1.0 GiB/4.0 GiB, 64.0 MiB/s, "
+            "ETA 0:00:48)\n"
+        )
+
+    def test_progress_is_printed_as_json(self, run_cli, api, capsys):
+        run_cli("progress", "--json")
+        assert (
+            json.loads(capsys.readouterr().out) == API_RESULTS["list_progress"]
+        )
+
+    def test_verify_prints_results(self, run_cli, api, capsys):
+        run_cli("verify", "-n", "vm1", "--src_name", "vm0")
+        assert capsys.readouterr().out == "system_vm1 OK\n"
+
+    def test_verify_fails_on_mismatch(self, run_cli, api, capsys, monkeypatch):
+        monkeypatch.setattr(
+            vm_manager,
+            "verify_vm",
+            lambda *args, **kwargs: {"system_vm1": True, "data_vm1_0": False},
+        )
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("verify", "-n", "vm1", "--src_name", "vm0")
+        assert excinfo.value.code == 1
+        assert capsys.readouterr().out == (
+            "system_vm1 OK\ndata_vm1_0 MISMATCH\n"
+        )
+
+    def test_verify_without_source_is_rejected(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("verify", "-n", "vm1")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_verify_with_files_and_vm_is_rejected(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("verify", "-n", "vm1", "-i", "a.qcow2", "--src_name", "x")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_backup_snapshot_is_printed(self, run_cli, api, capsys):
+        run_cli("backup", "-n", "vm1", "-o", "vm1.delta")
+        assert capsys.readouterr().out == "backup20260101000000\n"
+
+    def test_restore_requires_an_input(self, parser):
+        with pytest.raises(SystemExit) as excinfo:
+            parser.parse_args(["restore", "-n", "vm1"])
+        assert excinfo.value.code == 2
+
+    def test_backup_requires_a_single_target(self, parser):
+        with pytest.raises(SystemExit) as excinfo:
+            parser.parse_args(
+                ["backup", "-n", "vm1", "-o", "f", "--store", "/backups"]
+            )
+        assert excinfo.value.code == 2
+
+    def test_store_backup_rejects_since(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("backup", "-n", "vm1", "--store", "/b", "--since", "b1")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_store_restore_requires_snap_name(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("restore", "-n", "vm1", "--store", "/backups")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_flatten_without_action_is_rejected(self, run_cli, api):
+        with pytest.raises(SystemExit) as excinfo:
+            run_cli("flatten")
+        assert excinfo.value.code == 2
+        assert api.calls == []
+
+    def test_flatten_name_and_run_queues_then_runs(self, run_cli, api):
+        run_cli("flatten", "-n", "vm1", "--run")
+        assert api.calls == [
+            ("flatten_vm", ("vm1",), {}),
+            ("run_flatten_queue", (2,), {}),
+        ]
+
     def test_verbose_enables_debug_logging(self, run_cli, api, monkeypatch):
         levels = []
         monkeypatch.setattr(
@@ -614,6 +1197,86 @@ class TestMainCreate:
         options = self._create(run_cli, api, xml_file, "--pinned-host", "hyp1")
         assert options["pinned_host"] == "hyp1"
 
+    def test_import_backend_is_forwarded(self, run_cli, api, xml_file):
+        options = self._create(
+            run_cli,
+            api,
+            xml_file,
+            "--import-backend",
+            "native",
+            "--import-queue-depth",
+            "32",
+        )
+        assert options["import_backend"] == "native"
+        assert options["import_queue_depth"] == 32
+
+    def test_import_backend_defaults_to_none(self, run_cli, api, xml_file):
+        """None lets create() pick its own default."""
+        options = self._create(run_cli, api, xml_file)
+        assert options["import_backend"] is None
+        assert options["import_queue_depth"] is None
+
+    def test_import_jobs_is_forwarded(self, run_cli, api, xml_file):
+        options = self._create(run_cli, api, xml_file, "--import-jobs", "2")
+        assert options["import_jobs"] == 2
+
+    def test_import_jobs_defaults_to_none(self, run_cli, api, xml_file):
+        options = self._create(run_cli, api, xml_file)
+        assert options["import_jobs"] is None
+
+    def test_sparse_is_forwarded(self, run_cli, api, xml_file):
+        options = self._create(
+            run_cli, api, xml_file, "--import-backend", "native", "--sparse"
+        )
+        assert options["import_sparse"] is True
+
+    def test_sparse_defaults_to_false(self, run_cli, api, xml_file):
+        options = self._create(run_cli, api, xml_file)
+        assert options["import_sparse"] is False
+
+    def test_verify_is_forwarded(self, run_cli, api, xml_file):
+        options = self._create(run_cli, api, xml_file, "--verify")
+        assert options["verify"] is True
+
+    def test_disk_layout_is_forwarded(self, run_cli, api, xml_file):
+        options = self._create(
+            run_cli,
+            api,
+            xml_file,
+            "--object-size",
+            "1M",
+            "--stripe-unit",
+            "64K",
+            "--stripe-count",
+            "8",
+            "--data-pool",
+            "ecpool",
+            "--features",
+            "layering,exclusive-lock",
+        )
+        assert options["disk_layout"] == {
+            "order": 20,
+            "stripe_unit": 65536,
+            "stripe_count": 8,
+            "data_pool": "ecpool",
+            "features": ["layering", "exclusive-lock"],
+        }
+
+    def test_disk_layout_defaults_to_none(self, run_cli, api, xml_file):
+        options = self._create(run_cli, api, xml_file)
+        assert options["disk_layout"] is None
+
+    @pytest.mark.parametrize("value", ["3M", "2K", "64M", "1X", "0"])
+    def test_invalid_object_size_is_rejected(self, parser, value):
+        with pytest.raises(SystemExit) as excinfo:
+            parser.parse_args(BASE_CREATE_ARGS + ["--object-size", value])
+        assert excinfo.value.code == 2
+
+    def test_unknown_import_backend_is_rejected(self, parser):
+        with pytest.raises(SystemExit) as excinfo:
+            parser.parse_args(BASE_CREATE_ARGS + ["--import-backend", "dd"])
+        assert excinfo.value.code == 2
+
     @pytest.mark.xfail(
         strict=True,
         reason="main() guards the assignment with 'if \"enable\" in args', "
@@ -668,6 +1331,46 @@ class TestMainClone:
         _, args, _ = api.only
         assert args[0]["live_migration"] is True
 
+    def test_fast_defaults_to_false(self, run_cli, api):
+        run_cli("clone", "-n", "vm1", "--dst_name", "vm2")
+        _, args, _ = api.only
+        assert args[0]["fast"] is False
+
+    def test_verify_is_forwarded(self, run_cli, api):
+        run_cli("clone", "-n", "vm1", "--dst_name", "vm2", "--verify")
+        _, args, _ = api.only
+        assert args[0]["verify"] is True
+
+    def test_progress_is_forwarded(self, run_cli, api):
+        run_cli("clone", "-n", "vm1", "--dst_name", "vm2", "-p")
+        _, args, _ = api.only
+        assert args[0]["progress"] is True
+
+    def test_disk_layout_is_forwarded(self, run_cli, api):
+        run_cli(
+            "clone", "-n", "vm1", "--dst_name", "vm2", "--object-size", "8M"
+        )
+        _, args, _ = api.only
+        assert args[0]["disk_layout"] == {"order": 23}
+
+    def test_disk_layout_defaults_to_none(self, run_cli, api):
+        """None lets the clone inherit the layouts of the source disks."""
+        run_cli("clone", "-n", "vm1", "--dst_name", "vm2")
+        _, args, _ = api.only
+        assert args[0]["disk_layout"] is None
+
+    def test_fast_is_forwarded(self, run_cli, api):
+        run_cli("clone", "-n", "vm1", "--dst_name", "vm2", "--fast")
+        _, args, _ = api.only
+        assert args[0]["fast"] is True
+
+    def test_flatten_is_forwarded(self, run_cli, api):
+        run_cli(
+            "clone", "-n", "vm1", "--dst_name", "vm2", "--fast", "--flatten"
+        )
+        _, args, _ = api.only
+        assert args[0]["flatten"] is True
+
     @pytest.mark.xfail(
         strict=True,
         reason="the clone branch of main() never sets args.enable, and "
@@ -705,3 +1408,8 @@ class TestMainAddToCluster:
         run_cli("add-to-cluster", "-n", "vm1", "--new-name", "vm2")
         _, args, _ = api.only
         assert args[0]["new_name"] == "vm2"
+
+    def test_disk_layout_is_forwarded(self, run_cli, api):
+        run_cli("add-to-cluster", "-n", "vm1", "--data-pool", "ecpool")
+        _, args, _ = api.only
+        assert args[0]["disk_layout"] == {"data_pool": "ecpool"}
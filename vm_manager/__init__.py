@@ -1,7 +1,8 @@
 # Copyright (C) 2021, RTE (http://www.rte-france.com)
 # SPDX-License-Identifier: Apache-2.0
 
-from .exceptions import UuidConflictError  # noqa: F401
+from .exceptions import UuidConflictError, VerifyError  # noqa: F401
+from .helpers.progress import list_progress  # noqa: F401
 
 try:
     from .helpers.rbd_manager import RbdManager
@@ -21,6 +22,9 @@ if cluster_mode:
         clone,
         console,
         remove,
+        list_trash,
+        restore_from_trash,
+        purge_trash,
         enable_vm,
         disable_vm,
         is_enabled,
@@ -30,6 +34,14 @@ if cluster_mode:
         list_snapshots,
         purge_image,
         rollback_snapshot,
+        apply_retention,
+        upgrade_features,
+        backup_vm,
+        restore_vm,
+        backup_vm_to_store,
+        restore_vm_from_store,
+        verify_vm,
+        get_usage,
         list_metadata,
         get_metadata,
         set_metadata,
@@ -37,6 +49,9 @@ if cluster_mode:
         remove_pacemaker_remote,
         add_pacemaker_remote,
         add_to_cluster,
+        flatten_vm,
+        flatten_status,
+        run_flatten_queue,
     )
 else:
     from .vm_manager_libvirt import (
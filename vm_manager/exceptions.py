@@ -8,3 +8,7 @@ class VmManagerException(Exception):
 
 class UuidConflictError(VmManagerException):
     """Raised when a VM UUID conflicts with an existing VM."""
+
+
+class VerifyError(VmManagerException):
+    """Raised when a disk does not have the content of its source."""
@@ -0,0 +1,191 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to store VM backups in a local content-addressed directory.
+
+Images are backed up as fixed-size chunks named after their SHA-256, so
+a chunk shared by several disks or backups is stored once. Each backup
+is described by a JSON manifest listing the chunks of its disks:
+
+    <path>/chunks/<2 first hex digits>/<sha256>
+    <path>/manifests/<vm>/<backup>.json
+
+Chunks that only hold zeros are not stored, the manifest leaves them
+out.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkStoreException(Exception):
+    """
+    To be used to raise exceptions from this module.
+    """
+
+
+class ChunkStore:
+    """
+    A content-addressed chunk store in a local directory. Its methods may
+    be called from several threads at once.
+    """
+
+    def __init__(self, path, create=False):
+        """
+        Class constructor.
+
+        :param path: the directory of the store
+        :param create: create the store if it does not exist
+        """
+        self._path = path
+        self._chunks = os.path.join(path, "chunks")
+        self._manifests = os.path.join(path, "manifests")
+        if create:
+            os.makedirs(self._chunks, exist_ok=True)
+            os.makedirs(self._manifests, exist_ok=True)
+        elif not os.path.isdir(self._chunks):
+            raise ChunkStoreException(path + " is not a chunk store")
+
+    @property
+    def path(self):
+        return self._path
+
+    @staticmethod
+    def digest(data):
+        """
+        Return the name of the chunk holding data.
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    def _chunk_path(self, digest):
+        return os.path.join(self._chunks, digest[:2], digest)
+
+    def has_chunk(self, digest):
+        """
+        Check if a chunk is in the store.
+        """
+        return os.path.exists(self._chunk_path(digest))
+
+    def put_chunk(self, data):
+        """
+        Store data as a chunk unless it is already there and return its
+        digest and whether it was written.
+        """
+        digest = self.digest(data)
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_atomic(path, data)
+        return digest, True
+
+    def get_chunk(self, digest):
+        """
+        Return the data of a chunk, checked against its digest.
+        """
+        try:
+            with open(self._chunk_path(digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise ChunkStoreException("Chunk " + digest + " is missing")
+        if self.digest(data) != digest:
+            raise ChunkStoreException("Chunk " + digest + " is corrupted")
+        return data
+
+    def _manifest_path(self, vm_name, backup):
+        return os.path.join(self._manifests, vm_name, backup + ".json")
+
+    def save_manifest(self, vm_name, backup, manifest):
+        """
+        Save the manifest of a backup, once all its chunks are stored.
+        """
+        path = self._manifest_path(vm_name, backup)
+        if os.path.exists(path):
+            raise ChunkStoreException(
+                "Backup " + backup + " of VM " + vm_name + " already exists"
+            )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_atomic(path, json.dumps(manifest).encode())
+
+    def load_manifest(self, vm_name, backup):
+        """
+        Return the manifest of a backup.
+        """
+        try:
+            with open(self._manifest_path(vm_name, backup)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ChunkStoreException(
+                "Backup " + backup + " of VM " + vm_name + " does not exist"
+            )
+
+    def backup_exists(self, vm_name, backup):
+        """
+        Check if a backup is in the store.
+        """
+        return os.path.exists(self._manifest_path(vm_name, backup))
+
+    def list_backups(self, vm_name):
+        """
+        Return the names of the backups of a VM.
+        """
+        try:
+            names = os.listdir(os.path.join(self._manifests, vm_name))
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-5] for n in names if n.endswith(".json"))
+
+    def remove_backup(self, vm_name, backup):
+        """
+        Remove the manifest of a backup. Its chunks are only removed by
+        gc(), they may be used by other backups.
+        """
+        try:
+            os.remove(self._manifest_path(vm_name, backup))
+        except FileNotFoundError:
+            raise ChunkStoreException(
+                "Backup " + backup + " of VM " + vm_name + " does not exist"
+            )
+
+    def gc(self):
+        """
+        Remove the chunks no manifest uses anymore and return their
+        number. Must not run while a backup is being written.
+        """
+        used = set()
+        for vm_name in os.listdir(self._manifests):
+            for backup in self.list_backups(vm_name):
+                for disk in self.load_manifest(vm_name, backup)["disks"]:
+                    used.update(digest for _, digest in disk["chunks"])
+        removed = 0
+        for prefix in os.listdir(self._chunks):
+            directory = os.path.join(self._chunks, prefix)
+            for digest in os.listdir(directory):
+                if digest not in used:
+                    os.remove(os.path.join(directory, digest))
+                    removed += 1
+        logger.info(
+            "Removed " + str(removed) + " unused chunks from " + self._path
+        )
+        return removed
+
+    @staticmethod
+    def _write_atomic(path, data):
+        """
+        Write data to path through a temporary file, so that a partial
+        file is never seen under its final name.
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -0,0 +1,423 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to report the progress of long operations.
+
+An operation reports the amount done and the total amount, in bytes or
+in any other unit, to a ProgressTracker. The tracker turns these updates
+into progress records and passes them to its consumers: a record is a
+dictionary holding, besides the amounts, the percentage done, the rate
+and the estimated time left. The consumers of this module print the
+records on a terminal, log them, or save them as JSON files that other
+processes, like the REST API, read back with list_progress():
+
+    <directory>/<operation>-<target>.json
+
+Times are ISO 8601 strings of the local time with its UTC offset.
+"""
+
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_DIR = "/run/vm_manager/progress"
+# Time after which list_progress() reports a running operation whose
+# record is not updated anymore as stale, its process was likely killed,
+# in seconds
+PROGRESS_STALE_TIMEOUT = 300
+
+
+class ProgressTracker:
+    """
+    Track the progress of an operation on a target, a disk for instance.
+
+    A tracker is itself a (done, total) callable returning 0, so it can
+    be given wherever a progress callback is expected, including as the
+    on_progress callback of librbd. Consumers are called with a copy of
+    the progress record at most every interval seconds, and always for
+    the first update, the last one and the end of the operation. A
+    consumer failing is logged and does not interrupt the operation.
+
+    Used as a context manager, the operation is marked as done, or as
+    failed if an exception is raised.
+    """
+
+    def __init__(
+        self,
+        operation,
+        target,
+        total=None,
+        unit="B",
+        consumers=(),
+        vm=None,
+        interval=1.0,
+        clock=time.monotonic,
+    ):
+        """
+        Class constructor.
+
+        :param operation: the name of the operation, like "import"
+        :param target: what the operation works on, like a disk name
+        :param total: the total amount, if already known
+        :param unit: the unit of the amounts, "B" for bytes
+        :param consumers: the callables the records are passed to
+        :param vm: the VM the operation works on, if any
+        :param interval: the minimum time between two records passed to
+                         the consumers, in seconds
+        :param clock: the clock used to compute the rate
+        """
+        self._consumers = list(consumers)
+        self._interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._start = clock()
+        self._last = None
+        self._record = {
+            "vm": vm,
+            "operation": operation,
+            "target": target,
+            "state": "running",
+            "done": 0,
+            "total": total,
+            "unit": unit,
+            "percent": 0.0,
+            "rate": None,
+            "eta": None,
+            "elapsed": 0.0,
+            "started": _now(),
+            "updated": None,
+        }
+
+    def __call__(self, done, total=None):
+        self.update(done, total)
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is None:
+            self.finish()
+        else:
+            self.fail(exc_value)
+
+    @property
+    def record(self):
+        """
+        A copy of the current progress record.
+        """
+        with self._lock:
+            return dict(self._record)
+
+    def update(self, done, total=None):
+        """
+        Record that done out of total, or out of the total already
+        known, has been done.
+        """
+        with self._lock:
+            if total is not None:
+                self._record["total"] = total
+            self._record["done"] = done
+            total = self._record["total"]
+            now = self._clock()
+            last = total is not None and done >= total
+            if (
+                not last
+                and self._last is not None
+                and now - self._last < self._interval
+            ):
+                return
+            self._last = now
+            self._dispatch(now)
+
+    def finish(self):
+        """
+        Mark the operation as done.
+        """
+        with self._lock:
+            if self._record["total"] is not None:
+                self._record["done"] = self._record["total"]
+            self._record["state"] = "done"
+            self._dispatch(self._clock())
+
+    def fail(self, err):
+        """
+        Mark the operation as failed with error err.
+        """
+        with self._lock:
+            self._record["state"] = "failed"
+            self._record["error"] = str(err)
+            self._dispatch(self._clock())
+
+    def _dispatch(self, now):
+        """
+        Refresh the record and pass it to the consumers. Must be called
+        with the lock held, so that consumers see the records in order.
+        """
+        record = self._record
+        done = record["done"]
+        total = record["total"]
+        elapsed = now - self._start
+        record["elapsed"] = elapsed
+        record["rate"] = done / elapsed if elapsed > 0 and done else None
+        record["eta"] = None
+        if record["rate"] and total is not None:
+            record["eta"] = max(0, total - done) / record["rate"]
+        if total:
+            record["percent"] = min(100.0, 100.0 * done / total)
+        elif record["state"] == "done":
+            record["percent"] = 100.0
+        record["updated"] = _now()
+        for consumer in self._consumers:
+            try:
+                consumer(dict(record))
+            except Exception as err:
+                logger.warning(
+                    "Progress consumer "
+                    + repr(consumer)
+                    + " failed: "
+                    + str(err)
+                )
+
+
+class ProgressPrinter:
+    """
+    Print progress records on a terminal. By default a single line is
+    redrawn, like qemu-img convert -p does. With step, a line is printed
+    each time an operation goes step percent further instead, which
+    keeps the output readable when several operations share the printer.
+    """
+
+    def __init__(self, stream=None, step=None):
+        """
+        Class constructor.
+
+        :param stream: the stream to print to (default sys.stdout)
+        :param step: print a line every step percent instead of redrawing
+                     a single one
+        """
+        self._stream = stream
+        self._step = step
+        self._steps = {}
+
+    def __call__(self, record):
+        stream = self._stream or sys.stdout
+        line = format_progress(record)
+        if self._step:
+            key = (record["operation"], record["target"])
+            step = int(record["percent"] // self._step)
+            if record["state"] == "running":
+                if step <= self._steps.get(key, -1):
+                    return
+                self._steps[key] = step
+            stream.write(line + "\n")
+        else:
+            stream.write("\r" + line + "\033[K")
+            if record["state"] != "running":
+                stream.write("\n")
+        stream.flush()
+
+
+class ProgressLogger:
+    """
+    Log progress records at the info level every step percent, and when
+    the operation ends.
+    """
+
+    def __init__(self, log=None, step=10):
+        """
+        Class constructor.
+
+        :param log: the logger to use (default the logger of this module)
+        :param step: log every step percent
+        """
+        self._log = log or logger
+        self._step = step
+        self._steps = {}
+
+    def __call__(self, record):
+        key = (record["operation"], record["target"])
+        if record["state"] == "failed":
+            self._log.warning(format_progress(record))
+            return
+        if record["state"] == "running":
+            step = int(record["percent"] // self._step)
+            if step <= self._steps.get(key, -1):
+                return
+            self._steps[key] = step
+        self._log.info(format_progress(record))
+
+
+class ProgressFile:
+    """
+    Save progress records as JSON files in a directory, for other
+    processes to read them with list_progress(). The file of an
+    operation is replaced by the next operation of the same name on the
+    same target.
+    """
+
+    def __init__(self, directory=PROGRESS_DIR):
+        """
+        Class constructor.
+
+        :param directory: the directory of the files
+        """
+        self._directory = directory
+
+    def __call__(self, record):
+        os.makedirs(self._directory, exist_ok=True)
+        name = urllib.parse.quote(
+            record["operation"] + "-" + record["target"], safe=""
+        )
+        path = os.path.join(self._directory, name + ".json")
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def progress_dir_writable(directory=PROGRESS_DIR):
+    """
+    Check that ProgressFile can save records in directory, creating it
+    if needed. It usually cannot for the users other than root.
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(directory, os.W_OK | os.X_OK)
+
+
+def list_progress(
+    vm_name=None,
+    directory=PROGRESS_DIR,
+    stale_timeout=PROGRESS_STALE_TIMEOUT,
+):
+    """
+    Return the progress records saved by ProgressFile in directory, of
+    the operations on VM vm_name or of all operations, oldest first.
+    The state of the running operations whose record was not updated
+    for stale_timeout seconds is reported as "stale".
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    records = []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                record = json.load(f)
+        except (OSError, ValueError) as err:
+            # The file may have been replaced while listing
+            logger.debug("Skip progress file " + name + ": " + str(err))
+            continue
+        if vm_name is None or record.get("vm") == vm_name:
+            if (
+                record["state"] == "running"
+                and record["updated"] is not None
+                and _age(record["updated"]) > stale_timeout
+            ):
+                record["state"] = "stale"
+            records.append(record)
+    return sorted(records, key=lambda record: _parse_time(record["started"]))
+
+
+def format_size(size):
+    """
+    Return a size in bytes as a human readable string.
+    """
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} TiB".format(size)
+
+
+def format_progress(record):
+    """
+    Return a progress record as a line of text, like
+    "import system_vm1: 42.0% (4.2 GiB/10.0 GiB, 120.0 MiB/s, ETA 0:00:52)".
+    """
+    done = record["done"]
+    total = record["total"]
+    rate = record["rate"]
+    if record["unit"] == "B":
+        amounts = format_size(done)
+        if total is not None:
+            amounts += "/" + format_size(total)
+        speed = format_size(rate) + "/s" if rate else None
+    else:
+        amounts = str(done)
+        if total is not None:
+            amounts += "/" + str(total)
+        amounts += " " + record["unit"]
+        speed = "{:.1f} {}/s".format(rate, record["unit"]) if rate else None
+    details = [amounts]
+    if record["state"] == "running":
+        if speed:
+            details.append(speed)
+        if record["eta"] is not None:
+            details.append("ETA " + _format_duration(record["eta"]))
+    elif record["state"] == "stale":
+        details.append("stale, last updated " + record["updated"])
+    else:
+        details.append(
+            record["state"] + " in " + _format_duration(record["elapsed"])
+        )
+    line = "{} {}: {:.1f}% ({})".format(
+        record["operation"],
+        record["target"],
+        record["percent"],
+        ", ".join(details),
+    )
+    if record["state"] == "failed":
+        line += ": " + record.get("error", "")
+    return line
+
+
+def _format_duration(seconds):
+    """
+    Return a duration in seconds as H:MM:SS.
+    """
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def _now():
+    """
+    Return the current local time, with its UTC offset, as an ISO 8601
+    string.
+    """
+    return datetime.datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+def _parse_time(timestamp):
+    """
+    Return a _now() timestamp as an aware datetime. Timestamps without
+    UTC offset are taken as local times.
+    """
+    return datetime.datetime.fromisoformat(timestamp).astimezone()
+
+
+def _age(timestamp):
+    """
+    Return the number of seconds elapsed since a _now() timestamp.
+    """
+    return (
+        datetime.datetime.now(datetime.timezone.utc) - _parse_time(timestamp)
+    ).total_seconds()
@@ -0,0 +1,237 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to read and write VM backup delta files.
+
+A delta file holds the extents of the disks of a VM that changed between
+two snapshots, or all the allocated extents for a full backup. It is made
+of a header, the data of the extents one after the other, a JSON index
+and a trailer:
+
+    header:  MAGIC, format version (uint32)
+    data:    the data extents
+    index:   JSON document, see below
+    trailer: index offset (uint64), index length (uint64), MAGIC
+
+The index describes the backup ("vm", "snapshot", "since", "created"),
+the SHA-256 of the data section ("sha256") and the "disks", each with
+its "role" ("system" or the index of an additional disk), its "name" and
+"size" at backup time and its "extents", lists of [offset, length,
+data offset]. A null data offset marks a range that reads as zeros.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VMMDELTA"
+VERSION = 1
+_HEADER = struct.Struct("<8sI")
+_TRAILER = struct.Struct("<QQ8s")
+_READ_SIZE = 4 * 1024 * 1024
+
+
+class RbdDeltaException(Exception):
+    """
+    To be used to raise exceptions from this module.
+    """
+
+
+class DeltaWriter:
+    """
+    Write a delta file. Disks are added one after the other with
+    add_disk(), followed by their extents. The file is only complete once
+    the writer is closed; if the context exits on an exception the
+    partial file is removed.
+    """
+
+    def __init__(self, path, vm_name, snapshot, since=None):
+        """
+        Class constructor.
+
+        :param path: the path of the delta file to create
+        :param vm_name: the VM backed up
+        :param snapshot: the snapshot the delta leads to
+        :param since: the snapshot the delta starts from, None for a full
+                      backup
+        """
+        self._path = path
+        self._index = {
+            "vm": vm_name,
+            "snapshot": snapshot,
+            "since": since,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "disks": [],
+        }
+        self._sha256 = hashlib.sha256()
+        self._fd = open(path, "wb")
+        self._fd.write(_HEADER.pack(MAGIC, VERSION))
+        self._offset = _HEADER.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fd.close()
+            os.remove(self._path)
+
+    def add_disk(self, role, name, size):
+        """
+        Start the extents of a disk.
+        """
+        self._index["disks"].append(
+            {"role": role, "name": name, "size": size, "extents": []}
+        )
+
+    def add_extent(self, offset, length, data=None):
+        """
+        Add an extent to the current disk: its data, or None if the range
+        reads as zeros.
+        """
+        if not self._index["disks"]:
+            raise RbdDeltaException("No disk to add the extent to")
+        data_offset = None
+        if data is not None:
+            if len(data) != length:
+                raise ValueError("Extent data does not match its length")
+            data_offset = self._offset
+            self._fd.write(data)
+            self._sha256.update(data)
+            self._offset += length
+        self._index["disks"][-1]["extents"].append(
+            [offset, length, data_offset]
+        )
+
+    @property
+    def data_size(self):
+        """
+        The number of bytes of extent data written so far.
+        """
+        return self._offset - _HEADER.size
+
+    def close(self):
+        """
+        Write the index and the trailer and close the file.
+        """
+        if self._fd.closed:
+            return
+        self._index["sha256"] = self._sha256.hexdigest()
+        index = json.dumps(self._index).encode()
+        self._fd.write(index)
+        self._fd.write(_TRAILER.pack(self._offset, len(index), MAGIC))
+        self._fd.close()
+        logger.info(
+            "Delta "
+            + self._path
+            + " written with "
+            + str(self.data_size)
+            + " bytes of data"
+        )
+
+
+class DeltaReader:
+    """
+    Read a delta file written by DeltaWriter.
+    """
+
+    def __init__(self, path):
+        """
+        Class constructor, reads and checks the header and the index.
+        """
+        self._path = path
+        self._fd = open(path, "rb")
+        try:
+            magic, version = _HEADER.unpack(self._fd.read(_HEADER.size))
+            if magic != MAGIC:
+                raise RbdDeltaException(path + " is not a delta file")
+            if version != VERSION:
+                raise RbdDeltaException(
+                    path + " has unsupported version " + str(version)
+                )
+            self._fd.seek(-_TRAILER.size, os.SEEK_END)
+            index_offset, index_length, magic = _TRAILER.unpack(
+                self._fd.read(_TRAILER.size)
+            )
+            if magic != MAGIC:
+                raise RbdDeltaException(path + " is truncated")
+            self._fd.seek(index_offset)
+            self.index = json.loads(self._fd.read(index_length))
+            self._data_end = index_offset
+        except (struct.error, ValueError) as err:
+            self._fd.close()
+            raise RbdDeltaException(path + " is corrupted: " + str(err))
+        except Exception:
+            self._fd.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self._fd.close()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def vm(self):
+        return self.index["vm"]
+
+    @property
+    def snapshot(self):
+        return self.index["snapshot"]
+
+    @property
+    def since(self):
+        return self.index["since"]
+
+    @property
+    def disks(self):
+        return self.index["disks"]
+
+    def verify(self):
+        """
+        Raise an RbdDeltaException if the data section does not match the
+        checksum of the index.
+        """
+        sha256 = hashlib.sha256()
+        self._fd.seek(_HEADER.size)
+        remaining = self._data_end - _HEADER.size
+        while remaining:
+            data = self._fd.read(min(_READ_SIZE, remaining))
+            if not data:
+                raise RbdDeltaException(self._path + " is truncated")
+            sha256.update(data)
+            remaining -= len(data)
+        if sha256.hexdigest() != self.index["sha256"]:
+            raise RbdDeltaException(self._path + " checksum mismatch")
+
+    def iter_extents(self, disk):
+        """
+        Yield the (offset, length, data) extents of a disk of the index,
+        data being None for the ranges that read as zeros.
+        """
+        for offset, length, data_offset in disk["extents"]:
+            data = None
+            if data_offset is not None:
+                self._fd.seek(data_offset)
+                data = self._fd.read(length)
+                if len(data) != length:
+                    raise RbdDeltaException(self._path + " is truncated")
+            yield offset, length, data
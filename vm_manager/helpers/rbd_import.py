@@ -0,0 +1,339 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to import disk images into RBD with parallel asynchronous
+writes, as an alternative to qemu-img convert.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+QEMU_IMG = "/usr/bin/qemu-img"
+
+
+class RbdImportException(Exception):
+    """
+    To be used to raise exceptions from this module.
+    """
+
+
+def qemu_img_info(src, fmt):
+    """
+    Return the qemu-img info of src as a dictionary.
+    """
+    output = subprocess.run(
+        [QEMU_IMG, "info", "--output=json", "-f", fmt, src],
+        check=True,
+        capture_output=True,
+    ).stdout
+    return json.loads(output)
+
+
+def qemu_img_map(src, fmt):
+    """
+    Return the qemu-img map of src: a list of extents, each a dictionary
+    with the start and length of the guest range, whether it holds data
+    or reads as zeros and, for data extents, the offset of the data in
+    the src file.
+    """
+    output = subprocess.run(
+        [QEMU_IMG, "map", "--output=json", "-f", fmt, src],
+        check=True,
+        capture_output=True,
+    ).stdout
+    return json.loads(output)
+
+
+class AllocationMap:
+    """
+    Allocation state of the guest-visible content of a disk image, built
+    from its qemu-img map. Each extent is either DATA, ZERO (known to read
+    as zeros) or UNALLOCATED (not allocated in the image, reads as
+    zeros).
+    """
+
+    DATA = "data"
+    ZERO = "zero"
+    UNALLOCATED = "unallocated"
+
+    def __init__(self, extents):
+        """
+        Class constructor.
+
+        :param extents: the extents returned by qemu_img_map()
+        """
+        self.extents = extents
+
+    @classmethod
+    def from_image(cls, src, fmt):
+        """
+        Build the allocation map of src by running qemu-img map.
+        """
+        return cls(qemu_img_map(src, fmt))
+
+    @classmethod
+    def state(cls, extent):
+        """
+        Return the allocation state of an extent.
+        """
+        if extent["data"]:
+            return cls.DATA
+        # Older qemu-img versions do not report "present"
+        if extent.get("present", True):
+            return cls.ZERO
+        return cls.UNALLOCATED
+
+    def bytes_in(self, state):
+        """
+        Return the number of bytes of the image in the given state.
+        """
+        return sum(
+            extent["length"]
+            for extent in self.extents
+            if self.state(extent) == state
+        )
+
+    def data_extents(self):
+        """
+        Return the extents holding data.
+        """
+        return [e for e in self.extents if self.state(e) == self.DATA]
+
+
+class AioImporter:
+    """
+    Copy the guest-visible content of a qcow2 or raw file into an RBD
+    image.
+
+    The source is read directly from the file using its qemu-img map, so
+    only standalone images with uncompressed and unencrypted data are
+    supported; use qemu-img convert for the others. Writes are cut at
+    chunk_size boundaries, the RBD object size by default, so that each
+    write lands in a single object, and up to queue_depth of them are in
+    flight at once.
+
+    The extents of the source that read as zeros are skipped when the
+    destination is known to read as zeros, a newly created image for
+    instance; otherwise zeros are written over them. In sparse mode, the
+    chunks of the data extents that only hold zeros are skipped too, so
+    the destination must read as zeros.
+    """
+
+    def __init__(
+        self,
+        queue_depth=16,
+        chunk_size=None,
+        progress=None,
+        sparse=False,
+        cancel=None,
+    ):
+        """
+        Class constructor.
+
+        :param queue_depth: the maximum number of writes in flight
+        :param chunk_size: the size of the writes, must divide the object
+                           size of the destination image (default: the
+                           object size)
+        :param progress: optional callable called with the number of
+                         bytes done and the total number of bytes
+        :param sparse: only write the data of src (default False)
+        :param cancel: optional threading.Event, the import stops with an
+                       RbdImportException once it is set
+        """
+        if queue_depth < 1:
+            raise ValueError("queue_depth must be at least 1")
+        self._queue_depth = queue_depth
+        self._chunk_size = chunk_size
+        self._progress = progress
+        self._sparse = sparse
+        self._cancel = cancel
+
+    def import_image(
+        self,
+        src,
+        fmt,
+        img_inst,
+        info=None,
+        allocation=None,
+        target_is_zero=False,
+    ):
+        """
+        Copy src into img_inst, an open RBD image at least as large as
+        the virtual size of src.
+
+        :param src: the path of the source image file
+        :param fmt: the format of src, qcow2 or raw
+        :param img_inst: the destination rbd.Image
+        :param info: the qemu_img_info() of src if already known
+        :param allocation: the AllocationMap of src if already known
+        :param target_is_zero: img_inst reads as zeros, so the extents of
+                               src that read as zeros are not written
+                               (default False, always True in sparse mode)
+        :return: a dictionary with the number of bytes written and the
+                 number of bytes skipped
+        """
+        if info is None:
+            info = qemu_img_info(src, fmt)
+        if info.get("backing-filename"):
+            raise RbdImportException(
+                "Image " + src + " has a backing file, which is not supported"
+            )
+        if allocation is None:
+            allocation = AllocationMap.from_image(src, fmt)
+        for extent in allocation.data_extents():
+            if "offset" not in extent:
+                raise RbdImportException(
+                    "Image "
+                    + src
+                    + " has compressed or encrypted data, which is not"
+                    + " supported"
+                )
+
+        obj_size = img_inst.stat()["obj_size"]
+        chunk_size = self._chunk_size or obj_size
+        if chunk_size <= 0 or obj_size % chunk_size:
+            raise ValueError(
+                "Chunk size must divide the object size " + str(obj_size)
+            )
+        total = info["virtual-size"]
+        if img_inst.size() < total:
+            raise RbdImportException(
+                "Destination image is smaller than " + str(total) + " bytes"
+            )
+
+        writer = AioWriter(img_inst, self._queue_depth)
+        zeros = bytes(chunk_size)
+        # Compared to the chunks without copying a slice for each one
+        zeros_view = memoryview(zeros)
+        skip_zeros = self._sparse or target_is_zero
+        stats = {"bytes_written": 0, "bytes_skipped": 0}
+        with open(src, "rb") as fd:
+            try:
+                for extent in allocation.extents:
+                    is_data = allocation.state(extent) == AllocationMap.DATA
+                    if skip_zeros and not is_data:
+                        stats["bytes_skipped"] += extent["length"]
+                        self._report(stats, total)
+                        continue
+                    for offset, length in split_range(
+                        extent["start"], extent["length"], chunk_size
+                    ):
+                        if self._cancel is not None and self._cancel.is_set():
+                            raise RbdImportException(
+                                "Import of " + src + " cancelled"
+                            )
+                        if is_data:
+                            data = os.pread(
+                                fd.fileno(),
+                                length,
+                                extent["offset"] + offset - extent["start"],
+                            )
+                            # A raw file may be shorter than its image
+                            data += bytes(length - len(data))
+                        else:
+                            data = zeros[:length]
+                        if self._sparse and data == zeros_view[:length]:
+                            stats["bytes_skipped"] += length
+                        else:
+                            writer.write(data, offset)
+                            stats["bytes_written"] += length
+                        self._report(stats, total)
+            finally:
+                writer.wait()
+
+        img_inst.flush()
+        logger.info(
+            "Imported "
+            + src
+            + ": "
+            + str(stats["bytes_written"])
+            + " bytes written, "
+            + str(stats["bytes_skipped"])
+            + " bytes skipped"
+        )
+        return stats
+
+    def _report(self, stats, total):
+        """
+        Call the progress callback, if any.
+        """
+        if self._progress:
+            self._progress(
+                stats["bytes_written"] + stats["bytes_skipped"], total
+            )
+
+
+class AioWriter:
+    """
+    Submit aio writes to an image, keeping at most queue_depth of them in
+    flight.
+    """
+
+    def __init__(self, img_inst, queue_depth):
+        """
+        Class constructor.
+        """
+        self._img_inst = img_inst
+        self._slots = threading.Semaphore(queue_depth)
+        self._queue_depth = queue_depth
+        self._errors = []
+
+    def write(self, data, offset):
+        """
+        Submit a write of data at offset, blocking while the queue is
+        full. Raises the first error reported by a completed write.
+        """
+        self._raise_error()
+        self._slots.acquire()
+        try:
+            self._img_inst.aio_write(data, offset, self._complete)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def wait(self):
+        """
+        Wait for all the submitted writes to complete and raise the first
+        error they reported.
+        """
+        for _ in range(self._queue_depth):
+            self._slots.acquire()
+        for _ in range(self._queue_depth):
+            self._slots.release()
+        self._raise_error()
+
+    def _complete(self, completion):
+        """
+        Completion callback, called from a librbd thread.
+        """
+        ret = completion.get_return_value()
+        if ret < 0:
+            self._errors.append(ret)
+        self._slots.release()
+
+    def _raise_error(self):
+        """
+        Raise an exception if a write failed.
+        """
+        if self._errors:
+            raise RbdImportException(
+                "Write to RBD failed with error " + str(self._errors[0])
+            )
+
+
+def split_range(start, length, chunk_size):
+    """
+    Cut the range [start, start + length) at the multiples of chunk_size
+    and yield the (offset, length) of the pieces.
+    """
+    end = start + length
+    while start < end:
+        piece_end = min(end, (start // chunk_size + 1) * chunk_size)
+        yield start, piece_end - start
+        start = piece_end
@@ -5,16 +5,96 @@
 Helper module to manipulate RBD.
 """
 
+import atexit
+import contextlib
+import datetime
+import os
 import os.path
 import logging
+import re
 import subprocess
+import sys
+import threading
+import time
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from errno import ENOENT
-from rados import Rados
-from rbd import RBD, Group, Image
+from rados import ObjectBusy, ObjectExists, Rados
+from rbd import (
+    RBD,
+    RBD_FEATURE_DEEP_FLATTEN,
+    RBD_FEATURE_EXCLUSIVE_LOCK,
+    RBD_FEATURE_FAST_DIFF,
+    RBD_FEATURE_JOURNALING,
+    RBD_FEATURE_LAYERING,
+    RBD_FEATURE_OBJECT_MAP,
+    RBD_FEATURE_STRIPINGV2,
+    RBD_FLAG_FAST_DIFF_INVALID,
+    RBD_FLAG_OBJECT_MAP_INVALID,
+    RBD_SNAP_NAMESPACE_TYPE_GROUP,
+    RBD_SNAP_NAMESPACE_TYPE_USER,
+    Group,
+    Image,
+)
+
+from .rbd_import import AioImporter, AllocationMap, qemu_img_info
+from .rbd_stream import (
+    DEFAULT_CHUNK_SIZE,
+    RbdImageStream,
+    iter_allocated_ranges,
+    iter_changed_extents,
+    iter_image_ranges,
+)
+from .rbd_verify import RbdVerifyException, digest_chunks, digest_file
 
 logger = logging.getLogger(__name__)
 
+# Metadata keys caching the bytes changed between two snapshots
+SNAPSHOT_DELTA_PREFIX = "_snap_delta_"
+
+# The image features a layout can enable, by their rbd CLI names
+IMAGE_FEATURES = {
+    "layering": RBD_FEATURE_LAYERING,
+    "striping": RBD_FEATURE_STRIPINGV2,
+    "exclusive-lock": RBD_FEATURE_EXCLUSIVE_LOCK,
+    "object-map": RBD_FEATURE_OBJECT_MAP,
+    "fast-diff": RBD_FEATURE_FAST_DIFF,
+    "deep-flatten": RBD_FEATURE_DEEP_FLATTEN,
+    "journaling": RBD_FEATURE_JOURNALING,
+}
+
+# The features librbd can enable on an existing image, in the order they
+# depend on each other
+DYNAMIC_IMAGE_FEATURES = (
+    "exclusive-lock",
+    "object-map",
+    "fast-diff",
+    "journaling",
+)
+
+# The features of the images created without explicit features: object-map
+# and fast-diff make diffs, usage reports and snapshot removals fast
+DEFAULT_IMAGE_FEATURES = (
+    "layering",
+    "exclusive-lock",
+    "object-map",
+    "fast-diff",
+    "deep-flatten",
+)
+
+# LIBRADOS_LOCK_FLAG_MAY_RENEW, which the rados bindings do not export
+_LOCK_FLAG_MAY_RENEW = 1
+
+# The options of an image layout, see check_image_layout()
+IMAGE_LAYOUT_KEYS = (
+    "order",
+    "stripe_unit",
+    "stripe_count",
+    "data_pool",
+    "features",
+)
+
 
 class RbdException(Exception):
     """
@@ -22,27 +102,233 @@ class RbdException(Exception):
     """
 
 
+class _CachedImage:
+    """
+    An image instance of the cache of an RbdManager, with the number of
+    users it is pinned by and whether it was removed from the cache.
+    """
+
+    def __init__(self, img_inst):
+        self.img_inst = img_inst
+        self.pins = 0
+        self.dropped = False
+
+
+class _PooledConnection:
+    """
+    A Rados cluster connection and its I/O context, shared by the
+    RbdManager instances created with shared=True.
+    """
+
+    def __init__(self, ceph_conf, pool, namespace):
+        """
+        Connect to the cluster and open the I/O context on the namespace,
+        creating the namespace if needed.
+        """
+        self.key = (ceph_conf, pool, namespace)
+        self.refcount = 0
+        self.last_used = time.monotonic()
+        self.cluster = Rados(conffile=ceph_conf)
+        try:
+            self.cluster.connect()
+            self.ioctx = self.cluster.open_ioctx(pool)
+            rbd_inst = RBD()
+            if namespace and not rbd_inst.namespace_exists(
+                self.ioctx, namespace
+            ):
+                rbd_inst.namespace_create(self.ioctx, namespace)
+            self.ioctx.set_namespace(namespace)
+        except Exception:
+            self.cluster.shutdown()
+            raise
+
+    def is_healthy(self, ping=False):
+        """
+        Check that the connection is still usable. The local state is
+        always checked, ping adds a round trip to the monitors.
+        """
+        if self.cluster.state != "connected" or self.ioctx.state != "open":
+            return False
+        if ping:
+            try:
+                self.cluster.get_cluster_stats()
+            except Exception:
+                return False
+        return True
+
+    def shutdown(self):
+        """
+        Close the I/O context and disconnect from the cluster.
+        """
+        try:
+            self.ioctx.close()
+        finally:
+            self.cluster.shutdown()
+
+
+class RbdConnectionPool:
+    """
+    Process-wide pool of Rados connections keyed by (ceph_conf, pool,
+    namespace), so that successive RbdManager instances do not each pay
+    for a monitor handshake.
+
+    Connections are reference counted. A connection nobody uses is kept
+    for idle_timeout seconds, and is pinged before being handed out again
+    if it has been idle for more than health_check_interval seconds. A
+    forked child starts with an empty pool: librados connections cannot
+    be used across fork.
+    """
+
+    def __init__(self, idle_timeout=300, health_check_interval=30):
+        """
+        Class constructor.
+        """
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, ceph_conf, pool, namespace):
+        """
+        Return a connection for (ceph_conf, pool, namespace), opening one
+        if there is no healthy connection for that key in the pool.
+        Every acquire() must be paired with a release().
+        """
+        key = (ceph_conf, pool, namespace)
+        with self._lock:
+            self._close_idle()
+            connection = self._connections.get(key)
+            if connection is not None:
+                idle = time.monotonic() - connection.last_used
+                ping = (
+                    connection.refcount == 0
+                    and idle > self.health_check_interval
+                )
+                if not connection.is_healthy(ping=ping):
+                    logger.info("Drop unhealthy connection to " + pool)
+                    del self._connections[key]
+                    if connection.refcount == 0:
+                        connection.shutdown()
+                    connection = None
+            if connection is None:
+                connection = _PooledConnection(ceph_conf, pool, namespace)
+                self._connections[key] = connection
+            connection.refcount += 1
+            connection.last_used = time.monotonic()
+            return connection
+
+    def release(self, connection):
+        """
+        Give back a connection obtained from acquire().
+        """
+        with self._lock:
+            connection.refcount -= 1
+            connection.last_used = time.monotonic()
+            if (
+                connection.refcount == 0
+                and self._connections.get(connection.key) is not connection
+            ):
+                # Dropped from the pool while in use
+                connection.shutdown()
+            self._close_idle()
+
+    def close_all(self):
+        """
+        Shut down all the connections nobody uses.
+        """
+        with self._lock:
+            for key, connection in list(self._connections.items()):
+                if connection.refcount == 0:
+                    del self._connections[key]
+                    connection.shutdown()
+
+    def _close_idle(self):
+        """
+        Shut down the connections unused for more than idle_timeout.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        for key, connection in list(self._connections.items()):
+            if (
+                connection.refcount == 0
+                and now - connection.last_used > self.idle_timeout
+            ):
+                del self._connections[key]
+                connection.shutdown()
+
+    def _after_fork_in_child(self):
+        """
+        Forget the connections inherited from the parent process without
+        shutting them down, they still belong to the parent.
+        """
+        self._lock = threading.Lock()
+        self._connections = {}
+
+
+connection_pool = RbdConnectionPool()
+atexit.register(connection_pool.close_all)
+os.register_at_fork(after_in_child=connection_pool._after_fork_in_child)
+
+
 class RbdManager:
     """
     Helper class to manipulate RBD.
     """
 
     def __init__(
-        self, ceph_conf="/etc/ceph/ceph.conf", pool="rbd", namespace=""
+        self,
+        ceph_conf="/etc/ceph/ceph.conf",
+        pool="rbd",
+        namespace="",
+        max_open_images=16,
+        shared=False,
     ):
         """
         Class constructor.
+
+        With shared set to True, the cluster connection is borrowed from
+        the process-wide connection_pool instead of being opened for this
+        instance, and given back by close(). The namespace of a shared
+        instance cannot be changed.
+
+        Image instances opened by the methods of this class are kept in a
+        least recently used cache of at most max_open_images entries, so
+        that successive operations on the same image share a single open.
+        Metadata queries use read-only instances, which do not contend
+        with the exclusive lock of a running VM; the other operations use
+        read-write ones.
+
+        The names of the images and groups of the namespace are loaded on
+        first use and then kept up to date by the methods of this class.
+        Call refresh() to see changes made by other clients.
         """
 
         if not os.path.isfile(ceph_conf):
             raise IOError(ENOENT, "Could not find file", ceph_conf)
 
-        self._cluster = Rados(conffile=ceph_conf)
         self._rbd_inst = RBD()
 
         self._namespace = namespace
         self._pool = pool
+        self._shared = shared
+
+        self._max_open_images = max_open_images
+        self._open_images = OrderedDict()
+        self._open_images_lock = threading.RLock()
 
+        self._image_names = None
+        self._group_names = None
+        self._names_lock = threading.Lock()
+
+        if shared:
+            self._connection = connection_pool.acquire(
+                ceph_conf, pool, namespace
+            )
+            self._cluster = self._connection.cluster
+            self._ioctx = self._connection.ioctx
+            return
+
+        self._cluster = Rados(conffile=ceph_conf)
         try:
             self._cluster.connect()
             self._ioctx = self._cluster.open_ioctx(self._pool)
@@ -66,10 +352,23 @@ class RbdManager:
 
     def close(self):
         """
-        Close I/O context.
+        Close cached images and I/O context.
+        """
+        self.close_images()
+        if self._shared:
+            connection_pool.release(self._connection)
+        else:
+            self._ioctx.close()
+            self._cluster.shutdown()
+
+    def refresh(self):
+        """
+        Forget the cached image and group names, they will be listed
+        again from the cluster on next use.
         """
-        self._ioctx.close()
-        self._cluster.shutdown()
+        with self._names_lock:
+            self._image_names = None
+            self._group_names = None
 
     # Namespace methods
     def list_namespaces(self):
@@ -103,10 +402,16 @@ class RbdManager:
         """
         Set namespace ns for the I/O context.
         """
+        if self._shared and ns != self._namespace:
+            raise RbdException(
+                "Could not change the namespace of a shared connection"
+            )
         # Create if not exists, otherwise it cannot be used
         if not self.namespace_exists(ns):
             self.create_namespace(ns)
+        self.close_images()
         self._ioctx.set_namespace(ns)
+        self.refresh()
 
     def get_namespace(self):
         """
@@ -119,27 +424,129 @@ class RbdManager:
         """
         Return a list of all the images from the context.
         """
-        return self._rbd_inst.list(self._ioctx)
+        images = self._rbd_inst.list(self._ioctx)
+        with self._names_lock:
+            self._image_names = set(images)
+        return images
 
     def image_exists(self, img):
         """
         Check if an image exists.
         """
-        return img in self.list_images()
+        with self._names_lock:
+            image_names = self._image_names
+        if image_names is None:
+            image_names = set(self.list_images())
+        return img in image_names
 
-    def _get_image(self, img):
+    def _add_image_name(self, img):
         """
-        Return an image instance for a given img name.
+        Record img in the cached image names if they are loaded.
         """
-        img_inst = Image(self._ioctx, img)
-        if img_inst is None:
-            raise RbdException("Could not find image " + img)
-        else:
-            return img_inst
+        with self._names_lock:
+            if self._image_names is not None:
+                self._image_names.add(img)
+
+    def _discard_image_name(self, img):
+        """
+        Remove img from the cached image names if they are loaded.
+        """
+        with self._names_lock:
+            if self._image_names is not None:
+                self._image_names.discard(img)
+
+    @contextlib.contextmanager
+    def _image(self, img, read_only=False):
+        """
+        Context manager yielding an image instance for a given img name.
+        The instance is owned by the image cache: callers must not close
+        it. It is pinned until the with block exits, so that the cache
+        does not close it under the caller, even to make room for other
+        images opened meanwhile by other threads.
+
+        Read-only instances do not take part in exclusive locking nor
+        watch the image header, so they do not disturb the client
+        running the VM. They must only be used for requests that read
+        the header on each call, such as metadata queries: their cached
+        state, like the snapshot list, is not kept up to date.
+        """
+        key = (img, read_only)
+        with self._open_images_lock:
+            entry = self._open_images.get(key)
+            if entry is not None:
+                self._open_images.move_to_end(key)
+            else:
+                entry = _CachedImage(
+                    Image(self._ioctx, img, read_only=read_only)
+                )
+                self._open_images[key] = entry
+            entry.pins += 1
+            self._evict_images()
+        try:
+            yield entry.img_inst
+        finally:
+            with self._open_images_lock:
+                entry.pins -= 1
+                if entry.dropped:
+                    if not entry.pins:
+                        entry.img_inst.close()
+                else:
+                    self._evict_images()
+
+    def _evict_images(self):
+        """
+        Close the least recently used instances that are not pinned until
+        at most max_open_images instances are cached. Must be called with
+        the cache lock held.
+        """
+        excess = len(self._open_images) - self._max_open_images
+        for key, entry in list(self._open_images.items()):
+            if excess <= 0:
+                break
+            if not entry.pins:
+                del self._open_images[key]
+                entry.img_inst.close()
+                excess -= 1
+
+    def _drop_image(self, img):
+        """
+        Close the cached instances of img if there are some. Pinned ones
+        are closed when they are released.
+        """
+        with self._open_images_lock:
+            for read_only in (False, True):
+                entry = self._open_images.pop((img, read_only), None)
+                if entry is not None:
+                    self._release_entry(entry)
+
+    def close_images(self):
+        """
+        Close all cached image instances, the pinned ones when they are
+        released. An open instance prevents other clients from removing
+        the image, so this must be called before handing an image over to
+        another RbdManager for removal.
+        """
+        with self._open_images_lock:
+            entries = list(self._open_images.values())
+            self._open_images.clear()
+            for entry in entries:
+                self._release_entry(entry)
+
+    @staticmethod
+    def _release_entry(entry):
+        """
+        Close the instance of a cache entry removed from the cache, or
+        mark it to be closed when its last user releases it.
+        """
+        entry.dropped = True
+        if not entry.pins:
+            entry.img_inst.close()
 
-    def create_image(self, img, size, overwrite=True):
+    def create_image(self, img, size, overwrite=True, layout=None):
         """
-        Create a given size image on the Ceph cluster.
+        Create a given size image on the Ceph cluster, with the object
+        size, striping, data pool and features of layout (see
+        check_image_layout()) or those of the pool.
         """
         # Convert size if units specified
         if not isinstance(size, int):
@@ -153,25 +560,40 @@ class RbdManager:
             else:
                 raise RbdException("Image " + img + " already exists")
 
-        self._rbd_inst.create(self._ioctx, img, size)
+        kwargs = _layout_kwargs(check_image_layout(layout or {}))
+        self._rbd_inst.create(self._ioctx, img, size, **kwargs)
+        self._add_image_name(img)
         logger.info("Created image " + img + " of size " + str(size))
 
-    def remove_image(self, img):
+    def remove_image(self, img, on_progress=None):
         """
-        Remove img from Ceph.
+        Remove img from Ceph. on_progress, if given, is called by librbd
+        with the number of objects removed and the total number of
+        objects.
         """
-        img_inst = self._get_image(img)
-        try:
-            self.purge_image(img, force=True)
-            img_inst.close()
+        self.purge_image(img, force=True)
+        self._drop_image(img)
+        if on_progress is not None:
+            self._rbd_inst.remove(self._ioctx, img, on_progress=on_progress)
+        else:
             self._rbd_inst.remove(self._ioctx, img)
-            logger.info("Removed image " + img)
-        finally:
-            img_inst.close()
+        self._discard_image_name(img)
+        logger.info("Removed image " + img)
 
-    def clone_image(self, src_img, dst_img, snap, overwrite=True):
+    def rename_image(self, src_img, dst_img):
         """
-        Clone image src_img to dst_img from a snapshot snap.
+        Rename image src_img to dst_img.
+        """
+        self._drop_image(src_img)
+        self._rbd_inst.rename(self._ioctx, src_img, dst_img)
+        self._discard_image_name(src_img)
+        self._add_image_name(dst_img)
+        logger.info("Image " + src_img + " renamed to " + dst_img)
+
+    def clone_image(self, src_img, dst_img, snap, overwrite=True, layout=None):
+        """
+        Clone image src_img to dst_img from a snapshot snap. layout, if
+        given, is the layout of dst_img, as for create_image().
         """
         if src_img == dst_img:
             raise ValueError(
@@ -193,21 +615,55 @@ class RbdManager:
                     "Destination image " + dst_img + " already exists"
                 )
 
-        img_inst = self._get_image(src_img)
-        try:
+        with self._image(src_img) as img_inst:
             img_inst.protect_snap(snap)
+            kwargs = _layout_kwargs(check_image_layout(layout or {}))
             self._rbd_inst.clone(
-                self._ioctx, src_img, snap, self._ioctx, dst_img
+                self._ioctx, src_img, snap, self._ioctx, dst_img, **kwargs
             )
+            self._add_image_name(dst_img)
             logger.info(
                 "Image " + src_img + " has been cloned into " + dst_img
             )
-        finally:
-            img_inst.close()
 
-    def copy_image(self, src_img, dst_img, overwrite=True, deep=True):
+    def list_image_snapshot_children(self, img, snap):
+        """
+        Return the names of the images cloned from snapshot snap of img.
+        """
+        with Image(
+            self._ioctx, img, snapshot=snap, read_only=True
+        ) as img_inst:
+            return [child["image"] for child in img_inst.list_children2()]
+
+    def flatten_image(self, img, on_progress=None):
+        """
+        Copy the data img shares with its parent snapshot into img, which
+        is then no longer a clone. on_progress, if given, is called with
+        the offset reached and the size of the image and must return 0.
+        """
+        # A handle of its own, the cache could evict it during the copy
+        with Image(self._ioctx, img) as img_inst:
+            img_inst.flatten(on_progress=on_progress)
+        logger.info("Image " + img + " flattened")
+
+    def copy_image(
+        self,
+        src_img,
+        dst_img,
+        overwrite=True,
+        deep=True,
+        on_progress=None,
+        layout=None,
+    ):
         """
-        Create an RBD image copy from src_img named dst_img.
+        Create an RBD image copy from src_img named dst_img. layout, if
+        given, is the layout of dst_img, as for create_image(); the
+        options it leaves out are those of src_img.
+
+        on_progress, if given, is called with the bytes copied and the
+        size of the image. The rbd bindings do not report the progress of
+        a copy, so it is only called when the copy starts and when it
+        ends.
         """
         logger.info("copy " + src_img + " into " + dst_img)
         if src_img == dst_img:
@@ -225,68 +681,251 @@ class RbdManager:
                 raise RbdException(
                     "Destination image " + dst_img + " already exists"
                 )
-        img_inst = self._get_image(src_img)
-        try:
+        kwargs = _layout_kwargs(check_image_layout(layout or {}))
+        with self._image(src_img) as img_inst:
+            size = img_inst.size()
+            if on_progress is not None:
+                on_progress(0, size)
             if deep:
-                img_inst.deep_copy(self._ioctx, dst_img)
+                img_inst.deep_copy(self._ioctx, dst_img, **kwargs)
+                self._add_image_name(dst_img)
                 logger.info(
                     "Image " + src_img + " has been copied into " + dst_img
                 )
             else:
-                img_inst.copy(self._ioctx, dst_img)
+                img_inst.copy(self._ioctx, dst_img, **kwargs)
+                self._add_image_name(dst_img)
                 logger.info(
                     "Image "
                     + src_img
                     + " has been deep-copied into "
                     + dst_img
                 )
+            if on_progress is not None:
+                on_progress(size, size)
 
-        finally:
-            img_inst.close()
-
-    def rollback_image(self, img, snap):
+    def rollback_image(self, img, snap, on_progress=None):
         """
         Rollback image to snapshot.
+
+        Like for copy_image(), on_progress, if given, is only called with
+        the bytes rolled back and the size of the image when the rollback
+        starts and when it ends.
         """
         try:
-            img_inst = self._get_image(img)
-            img_inst.rollback_to_snap(snap)
+            with self._image(img) as img_inst:
+                size = img_inst.size()
+                if on_progress is not None:
+                    on_progress(0, size)
+                img_inst.rollback_to_snap(snap)
+                if on_progress is not None:
+                    on_progress(size, size)
         finally:
-            img_inst.close()
+            # Do not keep serving the pre-rollback instance
+            self._drop_image(img)
 
-    def purge_image(self, img, force=False):
+    def purge_image(self, img, force=False, on_progress=None):
         """
-        Remove all unprotected snapshots from an image.
+        Remove all unprotected snapshots from an image. on_progress, if
+        given, is called with the number of snapshots handled and the
+        number of snapshots of the image.
         """
-        img_inst = self._get_image(img)
-        try:
-            for snapshot in img_inst.list_snaps():
-                snap = snapshot["name"]
+        with self._image(img) as img_inst:
+            snaps = self.list_image_snapshots(img)
+            for i, snap in enumerate(snaps):
+                if on_progress is not None:
+                    on_progress(i, len(snaps))
                 if not img_inst.is_protected_snap(snap):
                     img_inst.remove_snap(snap)
                 elif force:  # Force protected images removal
                     img_inst.unprotect_snap(snap)
                     img_inst.remove_snap(snap)
+            if on_progress is not None:
+                on_progress(len(snaps), len(snaps))
             logger.info("Image " + img + " has been purged")
-        finally:
-            img_inst.close()
 
     # Snapshots related methods
     def list_image_snapshots(self, img, flat=True):
         """
-        Return a list of all snapshots from an image.
+        Return a list of all snapshots from an image. The snapshots taken
+        as part of a group snapshot are not included.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
+            snaps = [
+                x
+                for x in img_inst.list_snaps()
+                if x.get("namespace", RBD_SNAP_NAMESPACE_TYPE_USER)
+                == RBD_SNAP_NAMESPACE_TYPE_USER
+            ]
             if flat:
-                return [x["name"] for x in img_inst.list_snaps()]
+                return [x["name"] for x in snaps]
             else:
-                return [
-                    {"name": x["name"], "id": x["id"]}
-                    for x in img_inst.list_snaps()
-                ]
-        finally:
-            img_inst.close()
+                return [{"name": x["name"], "id": x["id"]} for x in snaps]
+
+    def list_image_snapshots_detailed(self, img):
+        """
+        Return the snapshots of an image, without the ones taken as part
+        of a group snapshot, as dictionaries with their name, id, size,
+        protection state and timestamp, oldest first.
+        """
+        with self._image(img) as img_inst:
+            return [
+                {
+                    "name": x["name"],
+                    "id": x["id"],
+                    "size": x["size"],
+                    "protected": img_inst.is_protected_snap(x["name"]),
+                    "timestamp": img_inst.get_snap_timestamp(x["id"]),
+                }
+                for x in img_inst.list_snaps()
+                if x.get("namespace", RBD_SNAP_NAMESPACE_TYPE_USER)
+                == RBD_SNAP_NAMESPACE_TYPE_USER
+            ]
+
+    def get_group_snapshot_timestamps(self, img):
+        """
+        Return a dictionary of the timestamps of the group snapshots that
+        include img, by group snapshot name.
+        """
+        with self._image(img) as img_inst:
+            return {
+                x["group"]["snap_name"]: img_inst.get_snap_timestamp(x["id"])
+                for x in img_inst.list_snaps()
+                if x.get("namespace") == RBD_SNAP_NAMESPACE_TYPE_GROUP
+            }
+
+    def get_image_usage(self, img):
+        """
+        Return the space used by img and its snapshots, as rbd du computes
+        it: each snapshot uses the bytes of the objects that changed since
+        the previous snapshot (see list_image_snapshot_deltas()), and the
+        image head the ones that changed since the last snapshot. The
+        diffs are computed from the object map when the fast-diff feature
+        is enabled and valid.
+
+        :return: a dictionary with the "provisioned" size, the bytes
+                 "used" by the head, the "snapshots" as
+                 list_image_snapshot_deltas() returns them, and whether
+                 "fast_diff" was usable and the result is "exact"
+        """
+        # Handles of its own, usage may be computed from several threads
+        with Image(self._ioctx, img, read_only=True) as img_inst:
+            fast_diff = bool(
+                img_inst.features() & RBD_FEATURE_FAST_DIFF
+            ) and not (img_inst.flags() & RBD_FLAG_FAST_DIFF_INVALID)
+            snaps, from_snap, exact = self._snapshot_deltas(img, img_inst)
+            return {
+                "provisioned": img_inst.size(),
+                "used": _used_bytes(img_inst, from_snap, img_inst.size()),
+                "snapshots": snaps,
+                "fast_diff": fast_diff,
+                "exact": exact and all(snap["exact"] for snap in snaps),
+            }
+
+    def list_image_snapshot_deltas(self, img):
+        """
+        Return all the snapshots of img, group snapshots included, oldest
+        first, with the bytes of the objects that changed since the
+        previous snapshot, which the snapshot pins. The data shared with
+        the parent of a clone is not counted.
+
+        librbd can only diff from snapshots of the user namespace: a
+        snapshot following a group snapshot is diffed from the previous
+        user snapshot instead, which over-counts, and is reported as not
+        "exact".
+
+        The deltas between two snapshots never change: they are cached
+        in the image metadata, keyed by the image and snapshot ids, and
+        only computed once. They are only cached while no client owns
+        the exclusive lock of the image, so they are computed again on
+        each call while its VM runs.
+
+        :return: a list of dictionaries with the snapshot "name", "id",
+                 whether it is a "group" snapshot, the bytes it "used"
+                 and whether this figure is "exact"
+        """
+        with Image(self._ioctx, img, read_only=True) as img_inst:
+            return self._snapshot_deltas(img, img_inst)[0]
+
+    def _snapshot_deltas(self, img, img_inst):
+        """
+        Return the list_image_snapshot_deltas() of img_inst, a read-only
+        handle on img, the name of the user snapshot its head must be
+        diffed from and whether it is the last snapshot.
+        """
+        cache = {
+            key: int(value)
+            for key, value in img_inst.metadata_list()
+            if key.startswith(SNAPSHOT_DELTA_PREFIX)
+        }
+        keys = set()
+        computed = {}
+        deltas = []
+        from_snap = None
+        from_id = "none"
+        exact = True
+        # Snapshot ids are only unique within an image, and copies of the
+        # image get the metadata
+        prefix = SNAPSHOT_DELTA_PREFIX + img_inst.id() + "_"
+        for snap in sorted(img_inst.list_snaps(), key=lambda x: x["id"]):
+            key = prefix + str(from_id) + "_" + str(snap["id"])
+            keys.add(key)
+            if key in cache:
+                used = cache[key]
+            else:
+                with Image(self._ioctx, img, read_only=True) as snap_inst:
+                    snap_inst.set_snap_by_id(snap["id"])
+                    used = _used_bytes(snap_inst, from_snap, snap["size"])
+                computed[key] = str(used)
+            namespace = snap.get("namespace", RBD_SNAP_NAMESPACE_TYPE_USER)
+            group = namespace == RBD_SNAP_NAMESPACE_TYPE_GROUP
+            deltas.append(
+                {
+                    "name": (
+                        snap["group"]["snap_name"] if group else snap["name"]
+                    ),
+                    "id": snap["id"],
+                    "group": group,
+                    "used": used,
+                    "exact": exact,
+                }
+            )
+            exact = namespace == RBD_SNAP_NAMESPACE_TYPE_USER
+            if exact:
+                from_snap = snap["name"]
+                from_id = snap["id"]
+
+        stale = [key for key in cache if key not in keys]
+        if computed or stale:
+            self._cache_snapshot_deltas(img, img_inst, computed, stale)
+        return deltas, from_snap, exact
+
+    def _cache_snapshot_deltas(self, img, img_inst, computed, stale):
+        """
+        Store the computed deltas of img in its metadata and remove the
+        stale ones, with a short-lived read-write handle, unless a client
+        such as the one running the VM owns the exclusive lock of img:
+        a report must not make it give the lock away.
+        """
+        # The cache is best effort, it must not make reports fail
+        try:
+            if img_inst.lock_get_owners():
+                logger.debug(
+                    "Image " + img + " is locked, snapshot deltas not cached"
+                )
+                return
+            with Image(self._ioctx, img) as rw_inst:
+                for key, value in computed.items():
+                    rw_inst.metadata_set(key, value)
+                for key in stale:
+                    rw_inst.metadata_remove(key)
+        except Exception as err:
+            logger.warning(
+                "Could not cache the snapshot deltas of "
+                + img
+                + ": "
+                + str(err)
+            )
 
     def image_snapshot_exists(self, img, snap):
         """
@@ -298,32 +937,25 @@ class RbdManager:
         """
         Create snapshot snap from an image img.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             img_inst.create_snap(snap)
             logger.info("Image " + img + " snapshot " + snap + " created")
-        finally:
-            img_inst.close()
 
     def remove_image_snapshot(self, img, snap):
         """
         Remove all snapshots for a given image
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             if img_inst.is_protected_snap(snap):
                 img_inst.unprotect_snap(snap)
             img_inst.remove_snap(snap)
             logger.info("Snapshot " + snap + " removed from " + img)
-        finally:
-            img_inst.close()
 
     def get_image_snapshot_timestamp(self, img, snap):
         """
         Returns timestamp for a given image snapshot.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             if isinstance(snap, int):
                 return img_inst.get_snap_timestamp(snap)
             else:
@@ -331,15 +963,12 @@ class RbdManager:
                     if s["name"] == snap:
                         return img_inst.get_snap_timestamp(s["id"])
             raise RbdException("Snapshot " + snap + " not found")
-        finally:
-            img_inst.close()
 
     def set_image_snapshot_protected(self, img, snap, protect):
         """
         Set protected state for an image snapshot.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             if protect != img_inst.is_protected_snap(snap):
                 if protect:
                     img_inst.protect_snap(snap)
@@ -353,97 +982,328 @@ class RbdManager:
                 + str(img_inst.is_protected_snap(snap))
             )
 
-        finally:
-            img_inst.close()
-
     def is_image_snapshot_protected(self, img, snap):
         """
         Check if an image snapshot is protected.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             return img_inst.is_protected_snap(snap)
-        finally:
-            img_inst.close()
 
     # I/O methods
     def write_to_image(self, img, data, pos):
         """
         Write bytearray data to image starting from a given position.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             return img_inst.write(data, pos)
-        finally:
-            img_inst.close()
 
     def read_from_image(self, img, start, end):
         """
         Read bytedata from image within a given range.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             return img_inst.read(start, end)
-        finally:
-            img_inst.close()
+
+    @contextlib.contextmanager
+    def open_image_stream(
+        self, img, chunk_size=DEFAULT_CHUNK_SIZE, queue_depth=0
+    ):
+        """
+        Context manager yielding an RbdImageStream on img, to read and
+        write it in chunks. The stream uses the cached handle of this
+        manager, pinned until the stream is closed at the end of the with
+        block.
+        """
+        with self._image(img) as img_inst:
+            with RbdImageStream(
+                img_inst, chunk_size=chunk_size, queue_depth=queue_depth
+            ) as stream:
+                yield stream
+
+    def iter_image_chunks(
+        self,
+        img,
+        start=0,
+        end=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        queue_depth=0,
+    ):
+        """
+        Yield the (offset, data) chunks of img from start to end, the end
+        of the image by default, reading ahead with up to queue_depth
+        asynchronous reads.
+        """
+        with self.open_image_stream(img, chunk_size, queue_depth) as stream:
+            yield from stream.iter_chunks(start=start, end=end)
+
+    def get_image_size(self, img):
+        """
+        Return the size of img in bytes.
+        """
+        with self._image(img) as img_inst:
+            return img_inst.size()
+
+    def resize_image(self, img, size):
+        """
+        Grow or shrink img to size bytes.
+        """
+        with self._image(img) as img_inst:
+            img_inst.resize(size)
+        logger.info("Image " + img + " resized to " + str(size))
+
+    def discard_image(self, img, offset, length):
+        """
+        Discard a range of img to release its space. librbd may skip the
+        parts of the range that do not cover whole objects, which then
+        keep their data: use zero_image() for a range that must read as
+        zeros.
+        """
+        with self._image(img) as img_inst:
+            return img_inst.discard(offset, length)
+
+    def zero_image(self, img, offset, length):
+        """
+        Make a range of img read as zeros, deallocating the objects it
+        covers whole.
+        """
+        with self._image(img) as img_inst:
+            return img_inst.write_zeroes(offset, length)
+
+    def iter_image_changes(
+        self,
+        img,
+        snap=None,
+        since=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        queue_depth=0,
+    ):
+        """
+        Yield the (offset, length, data) extents of img at snapshot snap,
+        the head by default, that changed since snapshot since, or that
+        hold data without it. data is None for the extents that read as
+        zeros. Extents with data are cut in chunks of at most chunk_size.
+        """
+        # A handle of its own, opened at the snapshot
+        with Image(
+            self._ioctx, img, snapshot=snap, read_only=snap is not None
+        ) as img_inst:
+            for offset, length, exists in iter_changed_extents(
+                img_inst, since
+            ):
+                if not exists:
+                    yield offset, length, None
+                    continue
+                for chunk_offset, data in iter_image_ranges(
+                    img_inst, [(offset, length)], chunk_size, queue_depth
+                ):
+                    yield chunk_offset, len(data), data
+
+    def iter_image_allocated_chunks(
+        self, img, snap=None, chunk_size=DEFAULT_CHUNK_SIZE, queue_depth=0
+    ):
+        """
+        Yield the (offset, data) chunks of img at snapshot snap, the head
+        by default, that hold data. Chunks are aligned on multiples of
+        chunk_size and read whole, but the last one of the image.
+        """
+        with Image(
+            self._ioctx, img, snapshot=snap, read_only=snap is not None
+        ) as img_inst:
+            size = img_inst.size()
+            ranges = []
+            for offset, length in iter_allocated_ranges(img_inst):
+                start = offset // chunk_size * chunk_size
+                end = min(
+                    size, -(-(offset + length) // chunk_size) * chunk_size
+                )
+                if ranges and ranges[-1][1] >= start:
+                    ranges[-1][1] = max(ranges[-1][1], end)
+                else:
+                    ranges.append([start, end])
+            yield from iter_image_ranges(
+                img_inst,
+                [(start, end - start) for start, end in ranges],
+                chunk_size,
+                queue_depth,
+            )
+
+    def digest_image(
+        self, img, snap=None, chunk_size=DEFAULT_CHUNK_SIZE, jobs=4
+    ):
+        """
+        Return the content digest of img at snapshot snap, the head by
+        default, reading and hashing up to jobs chunks at once (see
+        rbd_verify).
+        """
+        with Image(
+            self._ioctx, img, snapshot=snap, read_only=snap is not None
+        ) as img_inst:
+            size = img_inst.size()
+        return digest_chunks(
+            self.iter_image_allocated_chunks(
+                img, snap, chunk_size, queue_depth=jobs
+            ),
+            size,
+            jobs,
+        )
+
+    def compare_images(
+        self, img, other_img, snap=None, other_snap=None, jobs=4
+    ):
+        """
+        Check if img at snapshot snap and other_img at snapshot other_snap,
+        their heads by default, have the same content.
+        """
+        return self.digest_image(img, snap, jobs=jobs) == self.digest_image(
+            other_img, other_snap, jobs=jobs
+        )
+
+    def compare_image_with_file(self, img, src, fmt="qcow2", jobs=4):
+        """
+        Check if img has the same guest-visible content as the qcow2 or
+        raw file src. The file and the image are hashed at the same time;
+        files that cannot be read directly are compared with qemu-img
+        compare instead.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            file_digest = executor.submit(digest_file, src, fmt, jobs=jobs)
+            img_digest = self.digest_image(img, jobs=jobs)
+            try:
+                return file_digest.result() == img_digest
+            except RbdVerifyException as err:
+                logger.info(str(err) + ", comparing with qemu-img")
+
+        info = qemu_img_info(src, fmt)
+        if info["virtual-size"] != self.get_image_size(img):
+            return False
+        # format:  rbd:{pool-name}/{image-name}[@snapshot-name]
+        ret = subprocess.run(
+            [
+                "/usr/bin/qemu-img",
+                "compare",
+                "-q",
+                "-f",
+                fmt,
+                "-F",
+                "raw",
+                src,
+                "rbd:" + self._pool + "/" + img,
+            ]
+        ).returncode
+        if ret > 1:
+            raise RbdException(
+                "qemu-img compare of " + src + " and " + img + " failed"
+            )
+        return ret == 0
 
     # Image metadata access methods
     def list_image_metadata(self, img):
         """
         List all metadata from image.
         """
-        img_inst = self._get_image(img)
-        try:
-            return list(dict(img_inst.metadata_list()).keys())
-        finally:
-            img_inst.close()
+        return list(self.get_all_image_metadata(img).keys())
+
+    def get_all_image_metadata(self, img):
+        """
+        Return all metadata from image as a dictionary, read in a single
+        pass.
+        """
+        with self._image(img, read_only=True) as img_inst:
+            return dict(img_inst.metadata_list())
+
+    def get_image_metadata_many(self, img, keys):
+        """
+        Return a dictionary with the given metadata keys from image. Keys
+        the image does not have are left out of the result.
+        """
+        metadata = self.get_all_image_metadata(img)
+        return {key: metadata[key] for key in keys if key in metadata}
 
     def set_image_metadata(self, img, key, value):
         """
         Add metadata (key, value) to image img. Use check to ensure 'key'
         is not reserved or contains special charactes.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             img_inst.metadata_set(key, value)
             logger.info(
                 "Metadata " + key + ":" + value + " set to image " + img
             )
-        finally:
-            img_inst.close()
+
+    def set_image_metadata_many(self, img, metadata):
+        """
+        Add all the (key, value) pairs of the metadata dictionary to image
+        img, over a single image instance.
+
+        The update is not atomic: librbd has no multi-key transaction.
+        Keys are written in the dictionary order and the first failure is
+        raised as is, keys written before it keep their new value and the
+        following ones are left untouched.
+        """
+        with self._image(img) as img_inst:
+            for key, value in metadata.items():
+                img_inst.metadata_set(key, value)
+            logger.info(
+                "Metadata " + ", ".join(metadata) + " set to image " + img
+            )
 
     def get_image_metadata(self, img, key):
         """
         Return a dictionary with the metadata from image.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img, read_only=True) as img_inst:
             return img_inst.metadata_get(key)
-        finally:
-            img_inst.close()
 
     def remove_image_metadata(self, img, key):
         """
         Remove metadata.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             img_inst.metadata_remove(key)
-        finally:
-            img_inst.close()
+
+    def remove_image_metadata_many(self, img, keys):
+        """
+        Remove the given metadata keys from image img, over a single image
+        instance. Keys the image does not have are skipped.
+
+        Like set_image_metadata_many(), this is not atomic: the first
+        failure other than a missing key is raised and the keys removed
+        before it stay removed.
+
+        :return: the list of the keys actually removed
+        """
+        with self._image(img) as img_inst:
+            removed = []
+            for key in keys:
+                try:
+                    img_inst.metadata_remove(key)
+                except KeyError:
+                    continue
+                removed.append(key)
+            logger.info(
+                "Metadata " + ", ".join(removed) + " removed from image " + img
+            )
+            return removed
 
     # Group methods
     def list_groups(self):
         """
         Lists all rbd groups.
         """
-        return self._rbd_inst.group_list(self._ioctx)
+        groups = self._rbd_inst.group_list(self._ioctx)
+        with self._names_lock:
+            self._group_names = set(groups)
+        return groups
 
     def group_exists(self, group):
         """
         Check if group exists.
         """
-        return group in self.list_groups()
+        with self._names_lock:
+            group_names = self._group_names
+        if group_names is None:
+            group_names = set(self.list_groups())
+        return group in group_names
 
     def _get_group(self, group):
         """
@@ -463,6 +1323,9 @@ class RbdManager:
             raise RbdException("Group already exists")
 
         self._rbd_inst.group_create(self._ioctx, group)
+        with self._names_lock:
+            if self._group_names is not None:
+                self._group_names.add(group)
         logger.info("Created group " + group)
         return Group(self._ioctx, group)
 
@@ -472,12 +1335,17 @@ class RbdManager:
         """
         logger.info("Remove group " + group)
         self._rbd_inst.group_remove(self._ioctx, group)
+        with self._names_lock:
+            if self._group_names is not None:
+                self._group_names.discard(group)
 
     def rollback_group(self, group, snap):
         """
         Rollback group to state snapshot.
         """
         group_inst = self._get_group(group)
+        for img in self.list_group_images(group):
+            self._drop_image(img)
         group_inst.rollback_to_snap(snap)
         logger.info("Group " + group + " rollbacked to snap " + snap)
 
@@ -532,11 +1400,8 @@ class RbdManager:
         """
         Returns image group.
         """
-        img_inst = self._get_image(img)
-        try:
+        with self._image(img) as img_inst:
             return img_inst.group()["name"]
-        finally:
-            img_inst.close()
 
     def is_image_in_group(self, img, group):
         """
@@ -548,16 +1413,12 @@ class RbdManager:
         """
         Add image to group. Group creation can be forced if not exists.
         """
-        img_inst = self._get_image(img)
-        try:
-            if self.group_exists(group):
-                group_inst = self._get_group(group)
-                group_inst.add_image(self._ioctx, img)
-                logger.info("Image " + img + " added to group " + group)
-            else:
-                raise RbdException("Group does not exist")
-        finally:
-            img_inst.close()
+        if self.group_exists(group):
+            group_inst = self._get_group(group)
+            group_inst.add_image(self._ioctx, img)
+            logger.info("Image " + img + " added to group " + group)
+        else:
+            raise RbdException("Group does not exist")
 
     def remove_image_from_group(self, img, group):
         """
@@ -569,13 +1430,283 @@ class RbdManager:
         else:
             raise RbdException("Image " + img + " is not in group " + group)
 
+    # Feature methods
+    def get_image_features(self, img):
+        """
+        Return the names of the features enabled on img, in the order of
+        IMAGE_FEATURES.
+        """
+        with Image(self._ioctx, img, read_only=True) as img_inst:
+            features = img_inst.features()
+        return [name for name, bit in IMAGE_FEATURES.items() if features & bit]
+
+    def enable_image_features(self, img, features):
+        """
+        Enable the features of img among features that are not enabled
+        yet, and return their names. Only the DYNAMIC_IMAGE_FEATURES can
+        be enabled on an existing image. Enabling object-map leaves the
+        object maps of img and of its snapshots invalid until they are
+        rebuilt with rebuild_image_object_maps().
+        """
+        static = set(features) - set(DYNAMIC_IMAGE_FEATURES)
+        if static:
+            raise ValueError(
+                "Features "
+                + ", ".join(sorted(static))
+                + " cannot be enabled on an existing image"
+            )
+        enabled = []
+        # A handle of its own, the cache could evict it meanwhile
+        with Image(self._ioctx, img) as img_inst:
+            current = img_inst.features()
+            for name in DYNAMIC_IMAGE_FEATURES:
+                if name in features and not current & IMAGE_FEATURES[name]:
+                    img_inst.update_features(IMAGE_FEATURES[name], True)
+                    enabled.append(name)
+        if enabled:
+            logger.info(
+                "Features " + ", ".join(enabled) + " enabled on image " + img
+            )
+        return enabled
+
+    def list_invalid_object_maps(self, img):
+        """
+        Return the object maps of img flagged invalid: None stands for
+        the one of the image head, and dictionaries with the snapshot
+        "id" and "name" for the ones of its snapshots, group snapshots
+        included. Return an empty list if the object-map feature is not
+        enabled.
+        """
+        invalid = []
+        with Image(self._ioctx, img, read_only=True) as img_inst:
+            if not img_inst.features() & IMAGE_FEATURES["object-map"]:
+                return invalid
+            if img_inst.flags() & RBD_FLAG_OBJECT_MAP_INVALID:
+                invalid.append(None)
+            # Group snapshots cannot be opened by name
+            for snap in list(img_inst.list_snaps()):
+                img_inst.set_snap_by_id(snap["id"])
+                if img_inst.flags() & RBD_FLAG_OBJECT_MAP_INVALID:
+                    invalid.append({"id": snap["id"], "name": snap["name"]})
+        return invalid
+
+    def rebuild_image_object_maps(self, img, snaps=None, on_progress=None):
+        """
+        Rebuild the object maps of img listed in snaps, as returned by
+        list_invalid_object_maps(), or the invalid ones by default, and
+        return the number rebuilt. on_progress, if given, is called with
+        the number of object maps rebuilt and the number to rebuild: the
+        rbd bindings do not report the progress of a single rebuild.
+        """
+        if snaps is None:
+            snaps = self.list_invalid_object_maps(img)
+        for i, snap in enumerate(snaps):
+            if on_progress is not None:
+                on_progress(i, len(snaps))
+            with Image(self._ioctx, img) as img_inst:
+                if snap is not None:
+                    img_inst.set_snap_by_id(snap["id"])
+                img_inst.rebuild_object_map()
+            logger.info(
+                "Object map of "
+                + img
+                + ("@" + snap["name"] if snap is not None else "")
+                + " rebuilt"
+            )
+        if on_progress is not None:
+            on_progress(len(snaps), len(snaps))
+        return len(snaps)
+
+    # Trash methods
+    def trash_image(self, img, delay=0):
+        """
+        Move img to the RBD trash, where it can be restored from until it
+        is removed. Before delay seconds, it can only be removed by
+        forcing it. Its snapshots are left as they are: moving an image
+        to the trash only renames it, which is immediate whatever its
+        size.
+        """
+        self._drop_image(img)
+        self._rbd_inst.trash_move(self._ioctx, img, delay)
+        self._discard_image_name(img)
+        logger.info("Image " + img + " moved to the trash")
+
+    def list_trash(self):
+        """
+        Return the images in the trash as dictionaries with their "id",
+        their "name", their "deletion_time", their "deferment_end_time",
+        before which they can only be removed by forcing it, and whether
+        it has passed as "expired".
+        """
+        now = utcnow()
+        images = list(self._rbd_inst.trash_list(self._ioctx))
+        for image in images:
+            image["expired"] = image["deferment_end_time"] <= now
+        return images
+
+    def restore_trash_image(self, image_id, img):
+        """
+        Move the image image_id back from the trash as img.
+        """
+        self._rbd_inst.trash_restore(self._ioctx, image_id, img)
+        self._add_image_name(img)
+        logger.info("Image " + img + " restored from the trash")
+
+    def get_trash_image_metadata(self, image_id):
+        """
+        Return the metadata of the image image_id of the trash as a
+        dictionary.
+        """
+        img_inst = Image(self._ioctx, image_id=image_id, read_only=True)
+        try:
+            return dict(img_inst.metadata_list())
+        finally:
+            img_inst.close()
+
+    def remove_trash_image(
+        self, image_id, force=False, on_progress=None, rate=None
+    ):
+        """
+        Remove the image image_id from the trash with its snapshots. With
+        force, the image is removed even before its deferment end.
+
+        librbd reports the removal by object: on_progress, if given, is
+        called with the bytes of the objects removed and the bytes of all
+        the objects of the image. With rate, the removal is slowed down
+        in these callbacks so that it does not go faster than rate bytes
+        per second, to spare the cluster.
+        """
+        if not force:
+            image = self._rbd_inst.trash_get(self._ioctx, image_id)
+            if image["deferment_end_time"] > utcnow():
+                raise RbdException(
+                    "Image "
+                    + image["name"]
+                    + " cannot be removed from the trash before "
+                    + str(image["deferment_end_time"])
+                    + " UTC"
+                )
+        img_inst = Image(self._ioctx, image_id=image_id)
+        try:
+            obj_size = img_inst.stat()["obj_size"]
+            for snap in img_inst.list_snaps():
+                if (
+                    snap.get("namespace", RBD_SNAP_NAMESPACE_TYPE_USER)
+                    != RBD_SNAP_NAMESPACE_TYPE_USER
+                ):
+                    continue
+                if img_inst.is_protected_snap(snap["name"]):
+                    img_inst.unprotect_snap(snap["name"])
+                img_inst.remove_snap(snap["name"])
+        finally:
+            img_inst.close()
+
+        start = time.monotonic()
+
+        def report(offset, total):
+            if rate:
+                delay = offset * obj_size / rate - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if on_progress is not None:
+                on_progress(offset * obj_size, total * obj_size)
+            return 0
+
+        self._rbd_inst.trash_remove(
+            self._ioctx, image_id, force=force, on_progress=report
+        )
+        logger.info("Image " + image_id + " removed from the trash")
+
+    # Lock methods
+    def try_lock(self, obj, name, cookie, duration):
+        """
+        Take or renew the exclusive lock name on the RADOS object obj of
+        the namespace, created if needed, for duration seconds. cookie
+        identifies the holder. The lock is atomic across the clients of
+        the cluster and expires unless renewed, so that the locks of a
+        dead holder are released.
+
+        :return: True if the lock is held by cookie, False if another
+                 holder has it
+        """
+        try:
+            self._ioctx.lock_exclusive(
+                obj,
+                name,
+                cookie,
+                duration=duration,
+                flags=_LOCK_FLAG_MAY_RENEW,
+            )
+        except (ObjectBusy, ObjectExists):
+            return False
+        return True
+
+    def unlock(self, obj, name, cookie):
+        """
+        Release the lock name on the RADOS object obj held by cookie.
+        """
+        self._ioctx.unlock(obj, name, cookie)
+
     # Image import methods
-    def import_qcow2(self, src, dest, progress=False):
+    def import_qcow2(
+        self,
+        src,
+        dest,
+        progress=False,
+        backend="qemu-img",
+        queue_depth=16,
+        sparse=False,
+        cancel=None,
+        layout=None,
+    ):
         """
         Import image src to qcow2 format (dest).
-        """
+
+        The backend is either "qemu-img", to run qemu-img convert, or
+        "native", to write the data from this process with queue_depth
+        parallel aio writes (see AioImporter). The native backend only
+        writes the data extents of src into the new image, and with
+        sparse also skips the chunks of them that only hold zeros;
+        qemu-img convert already skips zeroed areas by itself.
+
+        progress is either a boolean, to print a progress bar, or a
+        callable called with the bytes done and the virtual size of src,
+        a ProgressTracker for instance. With qemu-img, the bytes done are
+        computed from the percentage printed by qemu-img -p. If
+        cancel, a threading.Event, gets set the import is interrupted and
+        an RbdException is raised; dest may then be left partially
+        written.
+
+        layout, if given, is the layout of dest, as for create_image().
+        dest is then created with it before the data is written, which
+        qemu-img convert does not do by itself.
+
+        :return: with the native backend, the "bytes_written" and
+                 "bytes_skipped" by AioImporter.import_image(); None with
+                 qemu-img, which does not report them
+        """
+        if backend == "native":
+            return self._import_native(
+                src,
+                dest,
+                "qcow2",
+                progress,
+                queue_depth,
+                sparse,
+                cancel,
+                layout,
+            )
+        if backend != "qemu-img":
+            raise ValueError("Unknown import backend " + backend)
+        if layout:
+            self.create_image(
+                dest,
+                qemu_img_info(src, "qcow2")["virtual-size"],
+                layout=layout,
+            )
+
         # format:  rbd:{pool-name}/{image-name}[@snapshot-name]
-        dest = "rbd:" + self._pool + "/" + dest
+        rbd_dest = "rbd:" + self._pool + "/" + dest
         args = [
             "/usr/bin/qemu-img",
             "convert",
@@ -585,8 +1716,234 @@ class RbdManager:
             "-O",
             "raw",
             src,
-            dest,
+            rbd_dest,
         ]
+        if layout:
+            # Write into the image created above, which reads as zeros:
+            # qemu-img can skip the zeroed areas as when it creates dest
+            args[2:2] = ["-n", "--target-is-zero"]
         if progress:
             args.append("-p")
-        subprocess.run(args, check=True)
+        if callable(progress):
+            progress = _percent_to_bytes(
+                progress, qemu_img_info(src, "qcow2")["virtual-size"]
+            )
+        try:
+            _run_qemu_img(args, progress, cancel)
+        finally:
+            # qemu-img may have created dest even if it failed
+            self._add_image_name(dest)
+        if cancel is not None and cancel.is_set():
+            raise RbdException("Import of " + src + " cancelled")
+
+    def _import_native(
+        self, src, dest, fmt, progress, queue_depth, sparse, cancel, layout
+    ):
+        """
+        Create dest with the virtual size of src and layout, copy src
+        into it with an AioImporter and return its statistics.
+        """
+        info = qemu_img_info(src, fmt)
+        allocation = AllocationMap.from_image(src, fmt)
+        logger.info(
+            src
+            + ": "
+            + str(allocation.bytes_in(AllocationMap.DATA))
+            + " bytes of data, "
+            + str(allocation.bytes_in(AllocationMap.ZERO))
+            + " bytes of zeros, "
+            + str(allocation.bytes_in(AllocationMap.UNALLOCATED))
+            + " bytes unallocated"
+        )
+        self.create_image(dest, info["virtual-size"], layout=layout)
+        if callable(progress):
+            progress_cb = progress
+        else:
+            progress_cb = _print_progress if progress else None
+        importer = AioImporter(
+            queue_depth=queue_depth,
+            progress=progress_cb,
+            sparse=sparse,
+            cancel=cancel,
+        )
+        # Pinned for the whole import, writes are in flight on it
+        with self._image(dest) as img_inst:
+            # Just created, dest reads as zeros
+            return importer.import_image(
+                src,
+                fmt,
+                img_inst,
+                info=info,
+                allocation=allocation,
+                target_is_zero=True,
+            )
+
+
+def check_image_layout(layout):
+    """
+    Check an image layout and return a copy of it, without duplicate
+    features. A layout is a dictionary with any of these keys:
+
+        - **order**: the object size as a power of two, from 12 (4 KiB)
+          to 25 (32 MiB)
+        - **stripe_unit**: the bytes written to an object before moving
+          to the next one, a divisor of the object size
+        - **stripe_count**: the number of objects striped over, given
+          along with stripe_unit
+        - **data_pool**: the pool storing the data of the image, its
+          metadata staying in the pool of the image
+        - **features**: the names of the features to enable, from
+          IMAGE_FEATURES
+
+    The keys left out take the default value of the pool.
+    """
+    unknown = set(layout) - set(IMAGE_LAYOUT_KEYS)
+    if unknown:
+        raise ValueError(
+            "Unknown image layout options: " + ", ".join(sorted(unknown))
+        )
+    checked = dict(layout)
+    for key in ("order", "stripe_unit", "stripe_count"):
+        if key in checked and (
+            not isinstance(checked[key], int)
+            or isinstance(checked[key], bool)
+            or checked[key] <= 0
+        ):
+            raise ValueError(key + " must be a positive integer")
+    if "order" in checked and not 12 <= checked["order"] <= 25:
+        raise ValueError("order must be between 12 and 25")
+    if ("stripe_unit" in checked) != ("stripe_count" in checked):
+        raise ValueError("stripe_unit and stripe_count go together")
+    if (
+        "stripe_unit" in checked
+        and (1 << checked.get("order", 22)) % checked["stripe_unit"]
+    ):
+        raise ValueError("stripe_unit must divide the object size")
+    if "data_pool" in checked and (
+        not isinstance(checked["data_pool"], str) or not checked["data_pool"]
+    ):
+        raise ValueError("data_pool must be a pool name")
+    if "features" in checked:
+        if isinstance(checked["features"], str):
+            raise ValueError("features must be a list of feature names")
+        for feature in checked["features"]:
+            if feature not in IMAGE_FEATURES:
+                raise ValueError("Unknown image feature " + str(feature))
+        checked["features"] = list(dict.fromkeys(checked["features"]))
+    return checked
+
+
+def _layout_kwargs(layout):
+    """
+    Return the keyword arguments of the rbd bindings creating an image
+    with layout, a layout checked by check_image_layout().
+    """
+    if not layout:
+        return {}
+    kwargs = {key: value for key, value in layout.items() if key != "features"}
+    if "features" in layout:
+        features = 0
+        for feature in layout["features"]:
+            features |= IMAGE_FEATURES[feature]
+        # librbd refuses a striping different from the default without it
+        if "stripe_unit" in layout:
+            features |= RBD_FEATURE_STRIPINGV2
+        kwargs["features"] = features
+    return kwargs
+
+
+def utcnow():
+    """
+    Return the current time as a naive UTC datetime, the way the rbd
+    bindings return the times of the trash and of the snapshots.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _used_bytes(img_inst, from_snap, size):
+    """
+    Return the bytes of the objects of an open image that changed since
+    snapshot from_snap, or that hold data without it, not counting the
+    parent of a clone.
+    """
+    used = [0]
+
+    def count(offset, length, exists):
+        if exists:
+            used[0] += length
+        return 0
+
+    img_inst.diff_iterate(
+        0, size, from_snap, count, include_parent=False, whole_object=True
+    )
+    return used[0]
+
+
+def _run_qemu_img(args, progress, cancel):
+    """
+    Run a qemu-img command, terminating it if cancel gets set. If progress
+    is a callable, the progress printed by qemu-img -p is passed to it as
+    a percentage instead of being printed.
+    """
+    parse = callable(progress)
+    proc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE if parse else None,
+        universal_newlines=parse,
+    )
+    reader = None
+    if parse:
+        reader = threading.Thread(
+            target=_read_qemu_img_progress, args=(proc.stdout, progress)
+        )
+        reader.start()
+    try:
+        while True:
+            try:
+                proc.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    proc.terminate()
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            proc.wait()
+        if reader is not None:
+            reader.join()
+    if proc.returncode and not (cancel is not None and cancel.is_set()):
+        raise subprocess.CalledProcessError(proc.returncode, args)
+
+
+def _read_qemu_img_progress(stream, progress):
+    """
+    Parse the "(12.34/100%)" updates written by qemu-img -p, which are
+    separated by carriage returns, and pass them to progress.
+    """
+    for line in stream:
+        match = re.search(r"\((\d+(?:\.\d+)?)/100%\)", line)
+        if match:
+            progress(float(match.group(1)), 100.0)
+
+
+def _percent_to_bytes(progress, size):
+    """
+    Return a callback passing the percentages of qemu-img -p to progress
+    as bytes out of size.
+    """
+
+    def report(percent, total):
+        progress(int(size * percent / total), size)
+
+    return report
+
+
+def _print_progress(done, total):
+    """
+    Print an import progress line the way qemu-img convert -p does.
+    """
+    percent = 100.0 * done / total if total else 100.0
+    sys.stdout.write("\r    ({:.2f}/100%)".format(percent))
+    if done >= total:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
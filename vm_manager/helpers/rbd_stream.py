@@ -0,0 +1,308 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to stream the content of RBD images in chunks, with a
+constant memory footprint.
+"""
+
+import collections
+import io
+import itertools
+import logging
+import threading
+
+from .rbd_import import AioWriter, split_range
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# Size of the ranges diffed at once by iter_changed_extents()
+DIFF_WINDOW_SIZE = 1024 * 1024 * 1024
+
+
+class RbdStreamException(Exception):
+    """
+    To be used to raise exceptions from this module.
+    """
+
+
+class RbdImageStream(io.RawIOBase):
+    """
+    File-like object reading and writing an open RBD image.
+
+    The stream does not own the image: closing it flushes the pending
+    writes but leaves the image open. With a queue_depth, writes are
+    asynchronous with at most queue_depth of them in flight, and
+    iter_chunks() reads ahead with as many asynchronous reads. A write
+    error may then only be raised by a later write, flush() or close().
+    """
+
+    def __init__(self, img_inst, chunk_size=DEFAULT_CHUNK_SIZE, queue_depth=0):
+        """
+        Class constructor.
+
+        :param img_inst: the open rbd.Image to stream
+        :param chunk_size: the default size of the chunks of iter_chunks()
+        :param queue_depth: the number of asynchronous I/Os in flight, 0 for
+                            synchronous I/Os (default)
+        """
+        super().__init__()
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        if queue_depth < 0:
+            raise ValueError("queue_depth must not be negative")
+        self._img_inst = img_inst
+        self._size = img_inst.size()
+        self._pos = 0
+        self._chunk_size = chunk_size
+        self._queue_depth = queue_depth
+        self._writer = None
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    @property
+    def size(self):
+        """
+        The size of the image.
+        """
+        return self._size
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence " + str(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position " + str(pos))
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        """
+        Read up to len(b) bytes at the current position into b and return
+        the number of bytes read, 0 at the end of the image.
+        """
+        self._check_closed()
+        length = min(len(b), max(0, self._size - self._pos))
+        if not length:
+            return 0
+        # Reads must see the data written before them
+        self._wait_writes()
+        data = self._img_inst.read(self._pos, length)
+        memoryview(b)[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def write(self, b):
+        """
+        Write b, any bytes-like object, at the current position and return
+        its length. Images cannot grow: writing past the end of the image
+        raises an RbdStreamException.
+
+        The rbd bindings only take bytes: bytes objects are written as
+        they are, other buffers such as memoryviews are copied once.
+        """
+        self._check_closed()
+        data = b if isinstance(b, bytes) else bytes(b)
+        if self._pos + len(data) > self._size:
+            raise RbdStreamException(
+                "Write of "
+                + str(len(data))
+                + " bytes at "
+                + str(self._pos)
+                + " goes past the end of the image"
+            )
+        if self._queue_depth:
+            if self._writer is None:
+                self._writer = AioWriter(self._img_inst, self._queue_depth)
+            self._writer.write(data, self._pos)
+        else:
+            self._img_inst.write(data, self._pos)
+        self._pos += len(data)
+        return len(data)
+
+    def flush(self):
+        """
+        Wait for the pending writes and flush the image.
+        """
+        if self.closed:
+            return
+        self._wait_writes()
+        self._img_inst.flush()
+
+    def close(self):
+        """
+        Flush the stream. The image itself is left open.
+        """
+        if not self.closed:
+            try:
+                self.flush()
+            finally:
+                super().close()
+
+    def iter_chunks(self, chunk_size=None, start=0, end=None):
+        """
+        Yield the (offset, data) chunks of the range [start, end) of the
+        image, the whole image by default. Chunks are cut at multiples of
+        chunk_size. The stream position is not changed.
+        """
+        self._check_closed()
+        self._wait_writes()
+        if end is None or end > self._size:
+            end = self._size
+        if start >= end:
+            return
+        yield from iter_image_ranges(
+            self._img_inst,
+            [(start, end - start)],
+            chunk_size or self._chunk_size,
+            self._queue_depth,
+        )
+
+    def _wait_writes(self):
+        """
+        Wait for the asynchronous writes in flight, if any.
+        """
+        if self._writer is not None:
+            self._writer.wait()
+
+    def _check_closed(self):
+        """
+        Raise a ValueError if the stream is closed.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+
+
+def iter_image_ranges(img_inst, ranges, chunk_size, queue_depth=0):
+    """
+    Yield the (offset, data) chunks of the (offset, length) ranges of an
+    open RBD image, cut at multiples of chunk_size, in order. With a
+    queue_depth, up to queue_depth asynchronous reads are in flight.
+    """
+    pieces = (
+        piece
+        for offset, length in ranges
+        for piece in split_range(offset, length, chunk_size)
+    )
+    if not queue_depth:
+        for offset, length in pieces:
+            yield offset, img_inst.read(offset, length)
+        return
+
+    pending = collections.deque()
+
+    def submit(offset, length):
+        slot = {"done": threading.Event()}
+
+        def complete(completion, data):
+            slot["ret"] = completion.get_return_value()
+            slot["data"] = data
+            slot["done"].set()
+
+        img_inst.aio_read(offset, length, complete)
+        pending.append((offset, slot))
+
+    try:
+        for piece in itertools.islice(pieces, queue_depth):
+            submit(*piece)
+        while pending:
+            offset, slot = pending.popleft()
+            slot["done"].wait()
+            if slot["ret"] < 0:
+                raise RbdStreamException(
+                    "Read at "
+                    + str(offset)
+                    + " failed with error "
+                    + str(slot["ret"])
+                )
+            piece = next(pieces, None)
+            if piece is not None:
+                submit(*piece)
+            yield offset, slot["data"]
+    finally:
+        # Do not leave reads running on an image that may get closed
+        for _, slot in pending:
+            slot["done"].wait()
+
+
+def iter_allocated_ranges(img_inst, from_snapshot=None):
+    """
+    Yield the (offset, length) ranges of an open RBD image that hold data,
+    or with from_snapshot that changed since that snapshot. Ranges that
+    were discarded since from_snapshot are not included.
+    """
+    for offset, length, exists in iter_changed_extents(
+        img_inst, from_snapshot
+    ):
+        if exists:
+            yield offset, length
+
+
+def iter_changed_extents(
+    img_inst, from_snapshot=None, window=DIFF_WINDOW_SIZE
+):
+    """
+    Yield the (offset, length, exists) extents of an open RBD image that
+    changed since from_snapshot, or that hold data without it. exists is
+    False for the extents discarded since from_snapshot, which read as
+    zeros. Adjacent extents of the same kind are merged.
+
+    librbd reports the extents through a callback: the image is diffed
+    window bytes at a time, so that only the extents of one window are
+    held in memory before they are yielded.
+    """
+    if window < 1:
+        raise ValueError("window must be positive")
+
+    def iter_extents():
+        size = img_inst.size()
+        for start in range(0, size, window):
+            extents = []
+
+            def record(offset, length, exists):
+                extents.append((offset, length, bool(exists)))
+                return 0
+
+            img_inst.diff_iterate(
+                start, min(window, size - start), from_snapshot, record
+            )
+            yield from extents
+
+    yield from _merge_ranges(iter_extents())
+
+
+def _merge_ranges(extents):
+    """
+    Merge the adjacent extents of the same kind of a sorted iterable of
+    (offset, length, exists) extents.
+    """
+    current = None
+    for offset, length, exists in extents:
+        if (
+            current is not None
+            and current[0] + current[1] == offset
+            and current[2] == exists
+        ):
+            current = (current[0], current[1] + length, exists)
+            continue
+        if current is not None:
+            yield current
+        current = (offset, length, exists)
+    if current is not None:
+        yield current
@@ -0,0 +1,177 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to compute digests of the guest-visible content of disks.
+
+A content digest does not depend on how a disk is allocated: the disk is
+cut in chunks aligned on multiples of chunk_size, the chunks that only
+hold zeros, or that are not allocated at all, are left out and the
+SHA-256 of the others are combined with their offset and the size of the
+disk. An RBD image and the qcow2 file it was imported from, or two
+copies of an image, have the same digest if and only if they read the
+same. Holes are never read, and the chunks are read and hashed by
+several threads with a bounded number of them in memory.
+"""
+
+import hashlib
+import logging
+import os
+import struct
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .rbd_import import AllocationMap, qemu_img_info, split_range
+from .rbd_stream import DEFAULT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+_OFFSET = struct.Struct(">Q")
+
+
+class RbdVerifyException(Exception):
+    """
+    To be used to raise exceptions from this module.
+    """
+
+
+class _ChunkHasher:
+    """
+    Hash chunks in a thread pool and combine their digests, keeping at
+    most twice as many chunks pending as there are threads.
+    """
+
+    def __init__(self, size, jobs):
+        self._size = size
+        self._jobs = max(1, jobs)
+        self._executor = ThreadPoolExecutor(max_workers=self._jobs)
+        self._pending = {}
+        self._digests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, offset, fn, *args):
+        """
+        Hash the chunk at offset returned by fn(*args), waiting for a
+        pending chunk first if there are too many of them.
+        """
+        while len(self._pending) >= 2 * self._jobs:
+            self._collect(FIRST_COMPLETED)
+        future = self._executor.submit(_hash_chunk, fn, *args)
+        self._pending[future] = offset
+
+    def hexdigest(self):
+        """
+        Wait for the pending chunks and return the content digest.
+        """
+        while self._pending:
+            self._collect(FIRST_COMPLETED)
+        digest = hashlib.sha256(_OFFSET.pack(self._size))
+        for offset, chunk_digest in sorted(self._digests):
+            digest.update(_OFFSET.pack(offset))
+            digest.update(chunk_digest)
+        return digest.hexdigest()
+
+    def _collect(self, return_when):
+        done, _ = wait(self._pending, return_when=return_when)
+        for future in done:
+            offset = self._pending.pop(future)
+            chunk_digest = future.result()
+            if chunk_digest is not None:
+                self._digests.append((offset, chunk_digest))
+
+
+def _hash_chunk(fn, *args):
+    """
+    Return the SHA-256 of the chunk returned by fn(*args), None if it only
+    holds zeros.
+    """
+    data = fn(*args)
+    if data.count(0) == len(data):
+        return None
+    return hashlib.sha256(data).digest()
+
+
+def digest_chunks(chunks, size, jobs=4):
+    """
+    Return the content digest of a disk of the given size from its
+    (offset, data) chunks, which must be aligned on multiples of the
+    chunk size and cover at least all its data.
+    """
+    with _ChunkHasher(size, jobs) as hasher:
+        for offset, data in chunks:
+            hasher.submit(offset, bytes, data)
+        return hasher.hexdigest()
+
+
+def digest_file(src, fmt, chunk_size=DEFAULT_CHUNK_SIZE, jobs=4):
+    """
+    Return the content digest of the guest-visible content of a qcow2 or
+    raw file. The file is read directly using its qemu-img map, so like
+    for AioImporter only standalone images with uncompressed and
+    unencrypted data are supported; an RbdVerifyException is raised for
+    the others.
+    """
+    info = qemu_img_info(src, fmt)
+    if info.get("backing-filename"):
+        raise RbdVerifyException(
+            "Image " + src + " has a backing file, which is not supported"
+        )
+    size = info["virtual-size"]
+    extents = AllocationMap.from_image(src, fmt).data_extents()
+    if any("offset" not in extent for extent in extents):
+        raise RbdVerifyException(
+            "Image "
+            + src
+            + " has compressed or encrypted data, which is not supported"
+        )
+
+    with open(src, "rb") as fd, _ChunkHasher(size, jobs) as hasher:
+        for start, pieces in _file_chunk_pieces(extents, chunk_size):
+            length = min(chunk_size, size - start)
+            hasher.submit(
+                start, _read_file_chunk, fd.fileno(), start, length, pieces
+            )
+        return hasher.hexdigest()
+
+
+def _file_chunk_pieces(extents, chunk_size):
+    """
+    Group the data extents of a file by chunk and yield, for each chunk
+    holding data, its offset and the (offset, length, file offset) pieces
+    of data in it.
+    """
+    current = None
+    for extent in extents:
+        for offset, length in split_range(
+            extent["start"], extent["length"], chunk_size
+        ):
+            start = offset // chunk_size * chunk_size
+            if current is None or current[0] != start:
+                if current is not None:
+                    yield current
+                current = (start, [])
+            current[1].append(
+                (offset, length, extent["offset"] + offset - extent["start"])
+            )
+    if current is not None:
+        yield current
+
+
+def _read_file_chunk(fileno, start, length, pieces):
+    """
+    Return the chunk of a file of the given length at offset start from
+    its pieces of data, zeros elsewhere.
+    """
+    chunk = bytearray(length)
+    for offset, piece_length, file_offset in pieces:
+        data = os.pread(fileno, piece_length, file_offset)
+        pos = offset - start
+        end = pos + len(data)
+        chunk[pos:end] = data
+    return chunk
@@ -0,0 +1,131 @@
+# Copyright (C) 2026, RTE (http://www.rte-france.com)
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Helper module to select the snapshots a retention policy keeps.
+
+A policy combines keep rules and a maximum age. keep_last keeps the
+most recent snapshots; keep_hourly, keep_daily and keep_weekly keep the
+most recent snapshot of each of the last hours, days or ISO weeks that
+have snapshots. A snapshot is kept if any keep rule selects it, or if
+there are no keep rules at all, but not if it is older than max_age,
+unless keep_last selects it: a VM whose snapshots stopped keeps its
+last ones whatever their age. Snapshots whose name matches an exclude
+pattern, and snapshots without timestamp, are always kept.
+
+Snapshot timestamps are naive UTC datetimes, as the rbd bindings return
+them, and so are the times this module compares them with.
+"""
+
+import datetime
+import fnmatch
+
+from .rbd_manager import utcnow
+
+# The keep rules, with the key of the period of a snapshot timestamp
+_PERIODS = (
+    ("hourly", lambda ts: (ts.date(), ts.hour)),
+    ("daily", lambda ts: ts.date()),
+    ("weekly", lambda ts: ts.isocalendar()[:2]),
+)
+
+
+class RetentionPolicy:
+    """
+    A snapshot retention policy.
+    """
+
+    def __init__(
+        self,
+        keep_last=0,
+        keep_hourly=0,
+        keep_daily=0,
+        keep_weekly=0,
+        max_age=None,
+        exclude=(),
+    ):
+        """
+        Class constructor.
+
+        :param keep_last: the number of most recent snapshots to keep
+        :param keep_hourly: the number of hours to keep a snapshot of
+        :param keep_daily: the number of days to keep a snapshot of
+        :param keep_weekly: the number of weeks to keep a snapshot of
+        :param max_age: a datetime.timedelta, the snapshots older than it
+                        are removed
+        :param exclude: fnmatch patterns of snapshot names to keep
+        """
+        self.keep = {
+            "last": keep_last,
+            "hourly": keep_hourly,
+            "daily": keep_daily,
+            "weekly": keep_weekly,
+        }
+        for rule, count in self.keep.items():
+            if not isinstance(count, int) or count < 0:
+                raise ValueError(
+                    "keep_" + rule + " must be a non-negative integer"
+                )
+        if max_age is not None and not isinstance(max_age, datetime.timedelta):
+            raise ValueError("max_age must be a timedelta")
+        if not any(self.keep.values()) and max_age is None:
+            raise ValueError("A retention policy needs at least one rule")
+        self.max_age = max_age
+        self.exclude = list(exclude)
+
+    def select(self, snapshots, now=None):
+        """
+        Decide which snapshots to keep.
+
+        :param snapshots: dictionaries with the snapshot "name" and its
+                          "timestamp", a datetime or None
+        :param now: the current time, a naive UTC datetime (default the
+                    time of the call)
+        :return: copies of the snapshot dictionaries, in the same order,
+                 with "keep" set to whether the snapshot is kept and
+                 "reasons" listing why
+        """
+        if now is None:
+            now = utcnow()
+        plan = [dict(snap, keep=False, reasons=[]) for snap in snapshots]
+        dated = sorted(
+            (entry for entry in plan if entry["timestamp"] is not None),
+            key=lambda entry: entry["timestamp"],
+            reverse=True,
+        )
+        for entry in dated[: self.keep["last"]]:
+            entry["reasons"].append("last")
+        for rule, period in _PERIODS:
+            seen = set()
+            for entry in dated:
+                if len(seen) >= self.keep[rule]:
+                    break
+                key = period(entry["timestamp"])
+                if key not in seen:
+                    seen.add(key)
+                    entry["reasons"].append(rule)
+
+        keep_all = not any(self.keep.values())
+        for entry in plan:
+            if any(
+                fnmatch.fnmatchcase(entry["name"], p) for p in self.exclude
+            ):
+                entry["keep"] = True
+                entry["reasons"] = ["excluded"]
+            elif entry["timestamp"] is None:
+                entry["keep"] = True
+                entry["reasons"] = ["no timestamp"]
+            elif (
+                self.max_age is not None
+                and now - entry["timestamp"] > self.max_age
+                and "last" not in entry["reasons"]
+            ):
+                entry["reasons"] = ["older than max age"]
+            elif keep_all:
+                entry["keep"] = True
+                entry["reasons"] = ["younger than max age"]
+            elif entry["reasons"]:
+                entry["keep"] = True
+            else:
+                entry["reasons"] = ["not kept by any rule"]
+        return plan
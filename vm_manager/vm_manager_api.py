@@ -31,6 +31,16 @@ def status_vm(guest):
     return v.status(guest)
 
 
+@app.route("/progress")
+def list_progress():
+    return v.list_progress()
+
+
+@app.route("/progress/<guest>")
+def progress_vm(guest):
+    return v.list_progress(guest)
+
+
 @app.route("/stop/<guest>")
 def stop_vm(guest):
     out = execfunc(v.stop, guest)
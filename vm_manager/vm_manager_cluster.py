@@ -13,11 +13,38 @@ import xml.etree.ElementTree as ElementTree
 import configparser
 import subprocess
 import json
-
-from .helpers.rbd_manager import RbdManager
+import threading
+import uuid
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+
+from .helpers.chunk_store import ChunkStore
+from .helpers.progress import (
+    PROGRESS_DIR,
+    ProgressFile,
+    ProgressLogger,
+    ProgressPrinter,
+    ProgressTracker,
+    progress_dir_writable,
+)
+from .helpers.rbd_delta import DeltaReader, DeltaWriter
+from .helpers.retention import RetentionPolicy
+from .helpers.rbd_manager import (
+    DEFAULT_IMAGE_FEATURES,
+    DYNAMIC_IMAGE_FEATURES,
+    RbdManager,
+    check_image_layout,
+    utcnow,
+)
 from .helpers.pacemaker import Pacemaker
 from .helpers.libvirt import LibVirtManager
 from .xml_utils import prepare_xml_base, check_uuid_conflict
+from .exceptions import VerifyError
 
 XML_PACEMAKER_PATH = "/etc/pacemaker"
 
@@ -28,6 +55,21 @@ NAMESPACE = ""
 RESERVED_NAMES = ["xml"]
 OS_DISK_PREFIX = "system_"
 DATA_DISK_PREFIX = "data_"
+# Snapshots taken by fast clones, _check_name() keeps users from using it
+CLONE_SNAPSHOT_PREFIX = "_clone_"
+# Flatten queue timings, in seconds
+FLATTEN_HEARTBEAT = 5
+FLATTEN_STALE_TIMEOUT = 300
+# RADOS object holding the locks by which flatten queue runners claim disks
+FLATTEN_LOCK_OBJECT = "vm_manager_flatten"
+# Size of the chunks of the backups in a chunk store, in bytes
+CHUNK_STORE_CHUNK_SIZE = 4 * 1024 * 1024
+# Time during which the disks of a VM removed with deferred=True can be
+# restored, in seconds
+TRASH_UNDO_WINDOW = 24 * 3600
+# Features of the disks imported by create() when their layout gives none,
+# and the ones upgrade_features() enables by default
+DISK_FEATURES = DEFAULT_IMAGE_FEATURES
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +89,7 @@ def list_all_uuids():
     metadata from each VM's system disk in the RBD cluster.
     """
     uuids = {}
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         for vm_name in rbd.list_groups():
             disk_name = OS_DISK_PREFIX + vm_name
             try:
@@ -84,12 +126,14 @@ def _create_vm_group(vm_name, force=False):
     Create vm_name group and check its creation. Group can be
     overwritten if force is set to True.
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
 
         # Check if VM already exists and overwrite it if force is enabled
         if rbd.group_exists(vm_name):
             if force:
                 remove(vm_name)
+                # remove() worked through its own RbdManager
+                rbd.refresh()
             else:
                 raise Exception("VM " + vm_name + " already exists")
 
@@ -224,7 +268,7 @@ def _configure_vm(vm_options):
     )
 
     # Add to group and set initial metadata
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         disk_name = OS_DISK_PREFIX + vm_options["name"]
         rbd.add_image_to_group(disk_name, vm_options["name"])
         logger.info(
@@ -238,79 +282,56 @@ def _configure_vm(vm_options):
                 "Image " + ceph_name + " added to group " + vm_options["name"]
             )
 
-        rbd.set_image_metadata(disk_name, "vm_name", vm_options["name"])
-        rbd.set_image_metadata(disk_name, "xml", xml)
-        rbd.set_image_metadata(disk_name, "_base_xml", vm_options["base_xml"])
+        metadata = {
+            "vm_name": vm_options["name"],
+            "xml": xml,
+            "_base_xml": vm_options["base_xml"],
+        }
         if vm_options.get("live_migration"):
-            rbd.set_image_metadata(disk_name, "_live_migration", "true")
-        if "migration_user" in vm_options:
-            rbd.set_image_metadata(
-                disk_name, "_migration_user", vm_options["migration_user"]
-            )
-        if "stop_timeout" in vm_options:
-            rbd.set_image_metadata(
-                disk_name, "_stop_timeout", vm_options["stop_timeout"]
-            )
-        if "migrate_to_timeout" in vm_options:
-            rbd.set_image_metadata(
-                disk_name,
-                "_migrate_to_timeout",
-                vm_options["migrate_to_timeout"],
-            )
-        if "migration_downtime" in vm_options:
-            rbd.set_image_metadata(
-                disk_name,
-                "_migration_downtime",
-                vm_options["migration_downtime"],
-            )
+            metadata["_live_migration"] = "true"
+        for option in (
+            "migration_user",
+            "stop_timeout",
+            "migrate_to_timeout",
+            "migration_downtime",
+        ):
+            if option in vm_options:
+                metadata[f"_{option}"] = vm_options[option]
         if "pinned_host" in vm_options:
-            rbd.set_image_metadata(
-                disk_name, "_pinned_host", vm_options["pinned_host"]
-            )
+            metadata["_pinned_host"] = vm_options["pinned_host"]
         elif "preferred_host" in vm_options:
-            rbd.set_image_metadata(
-                disk_name, "_preferred_host", vm_options["preferred_host"]
-            )
+            metadata["_preferred_host"] = vm_options["preferred_host"]
         if "crm_config_cmd" in vm_options:
             vm_options["crm_config_cmd_multiline"] = """{}""".format(
                 "\n".join(vm_options["crm_config_cmd"])
             )
-            rbd.set_image_metadata(
-                disk_name,
-                "_crm_config_cmd",
-                vm_options["crm_config_cmd_multiline"],
-            )
+            metadata["_crm_config_cmd"] = vm_options[
+                "crm_config_cmd_multiline"
+            ]
         if "priority" in vm_options:
-            rbd.set_image_metadata(
-                disk_name, "_priority", vm_options["priority"]
-            )
+            metadata["_priority"] = vm_options["priority"]
         if "metadata" in vm_options:
-            for name, data in vm_options["metadata"].items():
-                rbd.set_image_metadata(disk_name, name, data)
+            metadata.update(vm_options["metadata"])
         if "disk_bus" in vm_options:
-            rbd.set_image_metadata(
-                disk_name, "_disk_bus", vm_options["disk_bus"]
-            )
+            metadata["_disk_bus"] = vm_options["disk_bus"]
         for pacemaker_arg in (
             "pacemaker_meta",
             "pacemaker_params",
             "pacemaker_utilization",
         ):
             if pacemaker_arg in vm_options:
-                rbd.set_image_metadata(
-                    disk_name,
-                    f"_{pacemaker_arg}",
-                    json.dumps(vm_options[pacemaker_arg]),
+                metadata[f"_{pacemaker_arg}"] = json.dumps(
+                    vm_options[pacemaker_arg]
                 )
 
         # Store additional disk count as metadata on the system disk
         if additional_ceph_disks:
-            rbd.set_image_metadata(
-                disk_name,
-                "_additional_disks",
-                json.dumps(len(additional_ceph_disks)),
+            metadata["_additional_disks"] = json.dumps(
+                len(additional_ceph_disks)
             )
 
+        rbd.set_image_metadata_many(disk_name, metadata)
+
     logger.info("Image " + disk_name + " initial metadata set")
 
     # Define libvirt xml configuration
@@ -367,7 +388,7 @@ def list_vms(enabled=False):
     if enabled:
         return Pacemaker.list_resources()
     else:
-        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
             return rbd.list_groups()
 
 
@@ -376,6 +397,13 @@ def create(vm_options_with_nones):
     Create a new VM
 
     The VM will never switch to another host
+
+    The disk_layout option, a layout as for RbdManager.create_image(),
+    sets the object size, striping, data pool and features of all the
+    disks; additional_disk_layouts, a list, overrides it for each
+    additional disk in turn. The disks without features in their layout
+    get the DISK_FEATURES. The layouts are kept in the _disk_layout
+    metadata of the disks, for clones to inherit them.
     """
     # Validate parameters and required files
     vm_options = {
@@ -401,6 +429,12 @@ def create(vm_options_with_nones):
                         f"{pacemaker_arg} parameter must be a dictionary"
                     )
 
+    layouts = _disk_layouts(
+        vm_options, 1 + len(vm_options.get("additional_disks", []))
+    )
+    for layout in layouts:
+        layout.setdefault("features", list(DISK_FEATURES))
+
     files_to_check = [CEPH_CONF, vm_options["image"]]
     files_to_check.extend(vm_options.get("additional_disks", []))
     for f in files_to_check:
@@ -422,6 +456,11 @@ def create(vm_options_with_nones):
         progress = vm_options["progress"]
     except KeyError:
         progress = False
+    import_args = {
+        "backend": vm_options.get("import_backend", "qemu-img"),
+        "queue_depth": vm_options.get("import_queue_depth", 16),
+        "sparse": vm_options.get("import_sparse", False),
+    }
 
     # Check for UUID collision before importing the disk
     xml = _create_xml(
@@ -436,35 +475,40 @@ def create(vm_options_with_nones):
         vm_options["force"] = False
     _create_vm_group(vm_options["name"], vm_options["force"])
 
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    disk_name = OS_DISK_PREFIX + vm_options["name"]
+    disks = [(vm_options["image"], disk_name)]
+    for i, filepath in enumerate(vm_options.get("additional_disks", [])):
+        disks.append((filepath, _additional_disk_name(i, vm_options["name"])))
 
-        try:
-            # Overwrite image if necessary
-            disk_name = OS_DISK_PREFIX + vm_options["name"]
-            if rbd.image_exists(disk_name):
-                rbd.remove_image(disk_name)
-
-            # Import qcow2 system disk
-            logger.info("Import qcow2 disk")
-            rbd.import_qcow2(vm_options["image"], disk_name, progress)
-            if not rbd.image_exists(disk_name):
-                raise RuntimeError(
-                    "Could not import qcow2: " + vm_options["image"]
-                )
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
 
-            # Import additional disks
-            for i, filepath in enumerate(
-                vm_options.get("additional_disks", [])
-            ):
-                add_disk_name = _additional_disk_name(i, vm_options["name"])
-                if rbd.image_exists(add_disk_name):
-                    rbd.remove_image(add_disk_name)
+        try:
+            # Import the system disk and the additional disks
+            stats = _import_disks(
+                rbd,
+                vm_options["name"],
+                disks,
+                progress,
+                vm_options.get("import_jobs", 4),
+                import_args,
+                layouts,
+            )
+            if stats:
                 logger.info(
-                    "Import additional disk %s as %s", filepath, add_disk_name
+                    "Disks of VM "
+                    + vm_options["name"]
+                    + " imported: "
+                    + str(sum(x["bytes_written"] for x in stats.values()))
+                    + " bytes written, "
+                    + str(sum(x["bytes_skipped"] for x in stats.values()))
+                    + " bytes skipped"
+                )
+            if vm_options.get("verify", False):
+                _verify_disks(
+                    rbd,
+                    [(name, path) for path, name in disks],
+                    lambda name, path: rbd.compare_image_with_file(name, path),
                 )
-                rbd.import_qcow2(filepath, add_disk_name, progress)
-                if not rbd.image_exists(add_disk_name):
-                    raise RuntimeError("Could not import qcow2: " + filepath)
             # Configure VM
             vm_options["disk_name"] = disk_name
             if "disk_bus" not in vm_options:
@@ -472,12 +516,152 @@ def create(vm_options_with_nones):
             _configure_vm(vm_options)
 
         except Exception as err:
+            rbd.close_images()
             remove(vm_options["name"])
+            # Additional disks only join the VM group in _configure_vm(),
+            # so remove() misses them if the import failed
+            rbd.refresh()
+            for _, name in disks[1:]:
+                if rbd.image_exists(name):
+                    rbd.remove_image(name)
             raise err
 
     logger.info("VM " + vm_options["name"] + " created successfully")
 
 
+def _verify_disks(rbd, pairs, compare):
+    """
+    Check the (disk, source) pairs with compare(disk, source) and raise a
+    VerifyError naming the disks that differ from their source.
+    """
+    mismatches = []
+    for disk_name, source in pairs:
+        logger.info("Verify disk " + disk_name + " against " + source)
+        if not compare(disk_name, source):
+            mismatches.append(disk_name)
+    if mismatches:
+        raise VerifyError(
+            "Disks " + ", ".join(mismatches) + " differ from their source"
+        )
+
+
+def _import_disks(
+    rbd, vm_name, disks, progress, jobs, import_args, layouts=None
+):
+    """
+    Import disks, a list of (qcow2 path, image name) pairs, replacing the
+    existing images, with at most jobs imports running at once. progress
+    is as for _progress_tracker(). layouts, if given, are the layouts of
+    the images, in the order of disks; they are saved in their
+    _disk_layout metadata.
+
+    The first failure cancels the imports not started yet and interrupts
+    the running ones; it is raised once they have all stopped.
+
+    :return: the statistics returned by import_qcow2() for each image
+             name, if the import backend reports them
+    """
+    jobs = max(1, min(jobs, len(disks)))
+    cancel = threading.Event()
+    if progress is True:
+        # Concurrent progress bars would overwrite each other
+        progress = ProgressPrinter(step=10 if jobs > 1 else None)
+
+    def import_disk(filepath, name, layout):
+        if rbd.image_exists(name):
+            rbd.remove_image(name)
+        logger.info("Import qcow2 disk " + filepath + " as " + name)
+        with _progress_tracker("import", name, vm_name, progress) as tracker:
+            stats = rbd.import_qcow2(
+                filepath,
+                name,
+                tracker,
+                cancel=cancel,
+                layout=layout,
+                **import_args,
+            )
+        # The name cache already holds name, check the cluster
+        rbd.refresh()
+        if not rbd.image_exists(name):
+            raise RuntimeError("Could not import qcow2: " + filepath)
+        if layout:
+            rbd.set_image_metadata(name, "_disk_layout", json.dumps(layout))
+        logger.info("Disk " + name + " imported")
+        return stats
+
+    if layouts is None:
+        layouts = [None] * len(disks)
+    stats = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(import_disk, filepath, name, layout): name
+            for (filepath, name), layout in zip(disks, layouts)
+        }
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    stats[futures[future]] = result
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            cancel.set()
+            raise
+    return stats
+
+
+def _disk_layouts(vm_options, count, inherited=None):
+    """
+    Return the layouts of the count disks of a VM, the system disk first,
+    as checked by check_image_layout(). The disk_layout option applies to
+    all the disks, and the additional_disk_layouts option, a list, to each
+    additional disk in turn. They override the options of inherited, the
+    layouts of the source disks of a clone, if given.
+    """
+    common = vm_options.get("disk_layout", {})
+    if not isinstance(common, dict):
+        raise ValueError("disk_layout parameter must be a dictionary")
+    additional = vm_options.get("additional_disk_layouts", [])
+    if not isinstance(additional, list) or len(additional) >= count:
+        raise ValueError(
+            "additional_disk_layouts parameter must be a list of at most "
+            + str(count - 1)
+            + " layouts"
+        )
+    layouts = []
+    for i in range(count):
+        layout = dict(inherited[i]) if inherited else {}
+        layout.update(common)
+        if 0 < i <= len(additional) and additional[i - 1] is not None:
+            if not isinstance(additional[i - 1], dict):
+                raise ValueError(
+                    "additional_disk_layouts must hold dictionaries"
+                )
+            layout.update(additional[i - 1])
+        layouts.append(check_image_layout(layout))
+    return layouts
+
+
+def _progress_tracker(operation, target, vm_name, progress, unit="B"):
+    """
+    Return a ProgressTracker for an operation on target, VM vm_name or
+    one of its disks, logging the progress and saving it in PROGRESS_DIR
+    for list_progress() if this process can write there. progress is
+    either a boolean, to also print it, or a consumer the progress
+    records are also passed to.
+    """
+    consumers = [ProgressLogger(logger)]
+    if progress_dir_writable(PROGRESS_DIR):
+        consumers.append(ProgressFile(PROGRESS_DIR))
+    if callable(progress):
+        consumers.append(progress)
+    elif progress:
+        consumers.append(ProgressPrinter())
+    return ProgressTracker(
+        operation, target, unit=unit, consumers=consumers, vm=vm_name
+    )
+
+
 def add_to_cluster(vm_options_with_nones):
     """
     Add an existing libvirt VM to the cluster.
@@ -552,13 +736,35 @@ def add_to_cluster(vm_options_with_nones):
     logger.info("VM " + src_name + " imported as " + target_name)
 
 
-def remove(vm_name):
+def remove(vm_name, deferred=False, undo_window=TRASH_UNDO_WINDOW):
     """
     Remove a VM from cluster
 
+    Removing a disk removes all its objects and snapshots first, which
+    takes a while for large disks. With deferred, the disks are moved to
+    the RBD trash instead, which is immediate, and actually removed later
+    by purge_trash(), which must be scheduled to run periodically. Until
+    then the VM can be brought back with restore_from_trash(), but its
+    group snapshots are lost.
+
     :param vm_name: the VM name to be removed
+    :param deferred: move the disks to the RBD trash (default False)
+    :param undo_window: with deferred, the time in seconds during which
+                        purge_trash() leaves the disks in the trash
+                        unless forced (default TRASH_UNDO_WINDOW)
     """
 
+    # The fast clones of the VM depend on its disks
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        clones = _list_fast_clones(rbd, vm_name)
+    if clones:
+        raise Exception(
+            "VM "
+            + vm_name
+            + " has fast clones, flatten or remove them first: "
+            + ", ".join(clones)
+        )
+
     # Disable from Pacemaker
     disable_vm(vm_name)
 
@@ -568,7 +774,7 @@ def remove(vm_name):
             lvm.undefine(vm_name)
 
     # Remove group and all images from RBD cluster
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
 
         disk_name = OS_DISK_PREFIX + vm_name
 
@@ -584,9 +790,16 @@ def remove(vm_name):
 
         # Remove all images
         for img in all_images:
-            if rbd.image_exists(img):
-                rbd.remove_image(img)
+            if not rbd.image_exists(img):
+                continue
+            if deferred:
+                # The parent of a fast clone is released by purge_trash()
+                rbd.trash_image(img, delay=int(undo_window))
+            else:
+                _remove_disk(rbd, img)
 
+        # The name caches were updated by the removals, check the cluster
+        rbd.refresh()
         if rbd.group_exists(vm_name):
             raise Exception("Could not remove group " + vm_name)
 
@@ -597,6 +810,134 @@ def remove(vm_name):
     logger.info("VM " + vm_name + " removed")
 
 
+def list_trash(vm_name=None):
+    """
+    List the disks of the VMs removed with deferred=True that are still
+    in the RBD trash, oldest removal first.
+
+    :param vm_name: the VM whose disks are listed (default all the VMs)
+    :return: dictionaries with the trash "id" of the disk, its "name",
+             its "vm", when it was "deleted", the end of its undo window
+             as "purgeable", both naive UTC datetimes, and whether the
+             undo window has passed as "expired"
+    """
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        return _list_vm_trash(rbd, vm_name)
+
+
+def _list_vm_trash(rbd, vm_name=None):
+    """
+    Return the disks of VMs in the RBD trash as list_trash() does.
+    """
+    disks = []
+    for image in rbd.list_trash():
+        owner = _disk_owner(image["name"])
+        if owner is None or vm_name not in (None, owner):
+            continue
+        disks.append(
+            {
+                "id": image["id"],
+                "name": image["name"],
+                "vm": owner,
+                "deleted": image["deletion_time"],
+                "purgeable": image["deferment_end_time"],
+                "expired": image["expired"],
+            }
+        )
+    disks.sort(key=lambda disk: disk["deleted"])
+    return disks
+
+
+def _disk_owner(disk_name):
+    """
+    Return the VM a disk belongs to according to its name, None if it is
+    not named like a VM disk.
+    """
+    if disk_name.startswith(OS_DISK_PREFIX):
+        return disk_name.replace(OS_DISK_PREFIX, "", 1) or None
+    if disk_name.startswith(DATA_DISK_PREFIX):
+        vm_name, _, index = disk_name.replace(
+            DATA_DISK_PREFIX, "", 1
+        ).rpartition("_")
+        if vm_name and index.isdigit():
+            return vm_name
+    return None
+
+
+def restore_from_trash(vm_name):
+    """
+    Bring back a VM removed with deferred=True: move its disks back from
+    the RBD trash and recreate its group. If the VM was removed several
+    times, its last removal is undone. The VM is left disabled, enable it
+    to start it again.
+
+    :param vm_name: the VM to restore
+    :return: the names of the disks restored
+    """
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        # The last removal wins
+        latest = {disk["name"]: disk for disk in _list_vm_trash(rbd, vm_name)}
+        disk_name = OS_DISK_PREFIX + vm_name
+        if rbd.group_exists(vm_name) or rbd.image_exists(disk_name):
+            raise Exception("VM " + vm_name + " already exists")
+        if disk_name not in latest:
+            raise Exception("VM " + vm_name + " is not in the trash")
+
+        metadata = rbd.get_trash_image_metadata(latest[disk_name]["id"])
+        disk_names = [disk_name]
+        for i in range(json.loads(metadata.get("_additional_disks", "0"))):
+            name = _additional_disk_name(i, vm_name)
+            if name not in latest:
+                raise Exception("Disk " + name + " is not in the trash")
+            if rbd.image_exists(name):
+                raise Exception("Disk " + name + " already exists")
+            disk_names.append(name)
+
+        for name in disk_names:
+            rbd.restore_trash_image(latest[name]["id"], name)
+        rbd.create_group(vm_name)
+        for name in disk_names:
+            rbd.add_image_to_group(name, vm_name)
+
+    logger.info("VM " + vm_name + " restored from the trash")
+    return disk_names
+
+
+def purge_trash(vm_name=None, force=False, rate=None, progress=False):
+    """
+    Remove from the RBD trash the disks of the VMs removed with
+    deferred=True whose undo window has passed, one at a time. Nothing
+    calls it automatically: it must run periodically in the background,
+    from a systemd timer for instance (see the overview documentation).
+
+    :param vm_name: the VM whose disks are purged (default all the VMs)
+    :param force: also remove the disks whose undo window has not passed
+    :param rate: the maximum bytes per second removed (default no limit)
+    :param progress: print the progress of the purge, or a callable the
+                     progress records are passed to (default False)
+    :return: the names of the disks removed
+    """
+    removed = []
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        for disk in _list_vm_trash(rbd, vm_name):
+            if not (force or disk["expired"]):
+                continue
+            parent = rbd.get_trash_image_metadata(disk["id"]).get(
+                "_clone_parent"
+            )
+            with _progress_tracker(
+                "trash purge", disk["name"], disk["vm"], progress
+            ) as tracker:
+                rbd.remove_trash_image(
+                    disk["id"], force=force, on_progress=tracker, rate=rate
+                )
+            if parent is not None:
+                _release_clone_parent(rbd, json.loads(parent))
+            removed.append(disk["name"])
+    logger.info(str(len(removed)) + " disks purged from the trash")
+    return removed
+
+
 def enable_vm(vm_name, nostart=False):
     """
     Enable a VM in Pacemaker
@@ -626,112 +967,50 @@ def enable_vm(vm_name, nostart=False):
             custom_params = {}
             custom_utilization = {}
 
-            with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-                try:
-                    preferred_host = rbd.get_image_metadata(
-                        disk_name, "_preferred_host"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    pinned_host = rbd.get_image_metadata(
-                        disk_name, "_pinned_host"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    live_migration_str = rbd.get_image_metadata(
-                        disk_name, "_live_migration"
-                    )
-                    if live_migration_str == "true":
-                        live_migration = "true"
-                except KeyError:
-                    pass
-                try:
-                    migration_user = rbd.get_image_metadata(
-                        disk_name, "_migration_user"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    stop_timeout = rbd.get_image_metadata(
-                        disk_name, "_stop_timeout"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    migrate_to_timeout = rbd.get_image_metadata(
-                        disk_name, "_migrate_to_timeout"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    migration_downtime = rbd.get_image_metadata(
-                        disk_name, "_migration_downtime"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    crm_config_cmd_multi = rbd.get_image_metadata(
-                        disk_name, "_crm_config_cmd"
-                    )
-                    crm_config_cmd = crm_config_cmd_multi.split("\n")
-                except KeyError:
-                    pass
-                try:
-                    priority = rbd.get_image_metadata(disk_name, "_priority")
-                except KeyError:
-                    pass
-                try:
-                    remote_node = rbd.get_image_metadata(
-                        disk_name, "_remote_node"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    remote_node_address = rbd.get_image_metadata(
-                        disk_name, "_remote_node_address"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    remote_node_port = rbd.get_image_metadata(
-                        disk_name, "_remote_node_port"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    remote_node_timeout = rbd.get_image_metadata(
-                        disk_name, "_remote_node_timeout"
-                    )
-                except KeyError:
-                    pass
-                try:
-                    custom_meta = json.loads(
-                        rbd.get_image_metadata(disk_name, "_pacemaker_meta")
-                    )
-                except KeyError:
-                    pass
-                if type(custom_meta) is not dict:
-                    raise ValueError("Custom metadata must be a dictionary")
-                try:
-                    custom_params = json.loads(
-                        rbd.get_image_metadata(disk_name, "_pacemaker_params")
-                    )
-                except KeyError:
-                    pass
-                if type(custom_params) is not dict:
-                    raise ValueError("Custom params must be a dictionary")
-                try:
-                    custom_utilization = json.loads(
-                        rbd.get_image_metadata(
-                            disk_name, "_pacemaker_utilization"
-                        )
-                    )
-                except KeyError:
-                    pass
-                if type(custom_utilization) is not dict:
-                    raise ValueError("Custom utilization must be a dictionary")
+            with RbdManager(
+                CEPH_CONF, POOL_NAME, NAMESPACE, shared=True
+            ) as rbd:
+                metadata = rbd.get_all_image_metadata(disk_name)
+
+            preferred_host = metadata.get("_preferred_host", preferred_host)
+            pinned_host = metadata.get("_pinned_host", pinned_host)
+            if metadata.get("_live_migration") == "true":
+                live_migration = "true"
+            migration_user = metadata.get("_migration_user", migration_user)
+            stop_timeout = metadata.get("_stop_timeout", stop_timeout)
+            migrate_to_timeout = metadata.get(
+                "_migrate_to_timeout", migrate_to_timeout
+            )
+            migration_downtime = metadata.get(
+                "_migration_downtime", migration_downtime
+            )
+            if "_crm_config_cmd" in metadata:
+                crm_config_cmd = metadata["_crm_config_cmd"].split("\n")
+            priority = metadata.get("_priority", priority)
+            remote_node = metadata.get("_remote_node", remote_node)
+            remote_node_address = metadata.get(
+                "_remote_node_address", remote_node_address
+            )
+            remote_node_port = metadata.get(
+                "_remote_node_port", remote_node_port
+            )
+            remote_node_timeout = metadata.get(
+                "_remote_node_timeout", remote_node_timeout
+            )
+            if "_pacemaker_meta" in metadata:
+                custom_meta = json.loads(metadata["_pacemaker_meta"])
+            if type(custom_meta) is not dict:
+                raise ValueError("Custom metadata must be a dictionary")
+            if "_pacemaker_params" in metadata:
+                custom_params = json.loads(metadata["_pacemaker_params"])
+            if type(custom_params) is not dict:
+                raise ValueError("Custom params must be a dictionary")
+            if "_pacemaker_utilization" in metadata:
+                custom_utilization = json.loads(
+                    metadata["_pacemaker_utilization"]
+                )
+            if type(custom_utilization) is not dict:
+                raise ValueError("Custom utilization must be a dictionary")
 
             if pinned_host and not Pacemaker.is_valid_host(pinned_host):
                 raise Exception(f"{pinned_host} is not valid hypervisor")
@@ -864,7 +1143,7 @@ def status(vm_name):
     :return: the status of the VM, among Starting, Started, Paused,
              Stopped, Stopping, Disabled, Undefined and FAILED
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         if not rbd.group_exists(vm_name):
             return "Undefined"
 
@@ -904,6 +1183,13 @@ def stop(vm_name, force=False):
 def clone(vm_options_with_nones):
     """
     Create a new VM from another
+
+    The disks are deep copies of the source disks, or with the fast option
+    copy-on-write clones of new snapshots of them. They keep the layouts
+    of the source disks, which the disk_layout and additional_disk_layouts
+    options override as for create(). The source VM cannot be
+    removed while it has fast clones that have not been flattened; with
+    the flatten option the new disks are queued for flatten_vm().
     """
     vm_options = {
         k: v for k, v in vm_options_with_nones.items() if v is not None
@@ -942,35 +1228,25 @@ def clone(vm_options_with_nones):
     src_disk = OS_DISK_PREFIX + src_vm_name
     dst_disk = OS_DISK_PREFIX + dst_vm_name
 
+    # Read all the source settings in one go
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        src_metadata = rbd.get_all_image_metadata(src_disk)
+
     if "base_xml" not in vm_options:
-        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-            try:
-                vm_options["base_xml"] = rbd.get_image_metadata(
-                    src_disk, "_base_xml"
-                )
-            except KeyError as e:
-                logger.error(
-                    f"Could not get xml libvirt configuration, {src_disk} has no _base_xml metadata"
-                )
-                raise e
+        if "_base_xml" not in src_metadata:
+            logger.error(
+                f"Could not get xml libvirt configuration, {src_disk} has no _base_xml metadata"
+            )
+            raise KeyError("_base_xml")
+        vm_options["base_xml"] = src_metadata["_base_xml"]
     if (
         "clear_constraint" not in vm_options
         and "preferred_host" not in vm_options
         and "pinned_host" not in vm_options
     ):
-        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-            try:
-                vm_options["preferred_host"] = rbd.get_image_metadata(
-                    src_disk, "_preferred_host"
-                )
-            except KeyError:
-                pass
-            try:
-                vm_options["pinned_host"] = rbd.get_image_metadata(
-                    src_disk, "_pinned_host"
-                )
-            except KeyError:
-                pass
+        for host_arg in ("preferred_host", "pinned_host"):
+            if f"_{host_arg}" in src_metadata:
+                vm_options[host_arg] = src_metadata[f"_{host_arg}"]
     if "pinned_host" in vm_options and not Pacemaker.is_valid_host(
         vm_options["pinned_host"]
     ):
@@ -992,88 +1268,115 @@ def clone(vm_options_with_nones):
         if not clear_arg:
             pacemaker_new_arg = vm_options.get(pacemaker_arg, {})
             logging.debug(f"{pacemaker_arg} new arg: {pacemaker_new_arg}")
-            with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-                try:
-                    vm_options[pacemaker_arg] = json.loads(
-                        rbd.get_image_metadata(src_disk, f"_{pacemaker_arg}")
-                    )
-                    logging.debug(
-                        f"Found previous {pacemaker_arg}: {vm_options[pacemaker_arg]}"
+            if f"_{pacemaker_arg}" in src_metadata:
+                vm_options[pacemaker_arg] = json.loads(
+                    src_metadata[f"_{pacemaker_arg}"]
+                )
+                logging.debug(
+                    f"Found previous {pacemaker_arg}: {vm_options[pacemaker_arg]}"
+                )
+                if type(vm_options[pacemaker_arg]) is not dict:
+                    raise ValueError(
+                        f"{pacemaker_arg} metadata must be a dictionary"
                     )
-                    if type(vm_options[pacemaker_arg]) is not dict:
-                        raise ValueError(
-                            f"{pacemaker_arg} metadata must be a dictionary"
-                        )
-                except KeyError:
-                    vm_options[pacemaker_arg] = {}
+            else:
+                vm_options[pacemaker_arg] = {}
             vm_options[pacemaker_arg].update(pacemaker_new_arg)
             logging.debug(
                 f"Updated {pacemaker_arg} with new arg: {vm_options[pacemaker_arg]}"
             )
-    if "force" not in vm_options:
-        vm_options["force"] = False
-    _create_vm_group(dst_vm_name, vm_options["force"])
+    src_additional_count = json.loads(
+        src_metadata.get("_additional_disks", "0")
+    )
 
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-        try:
-            # Overwrite image if necessary
-            if rbd.image_exists(dst_disk):
-                rbd.remove_image(dst_disk)
-
-            # Note: Only deep-copy works for images that are on a group
-            # (destination img will keep the snaps but not the group)
-            rbd.copy_image(
-                src_disk, dst_disk, overwrite=vm_options["force"], deep=True
+    disks = [(src_disk, dst_disk)]
+    for i in range(src_additional_count):
+        disks.append(
+            (
+                _additional_disk_name(i, src_vm_name),
+                _additional_disk_name(i, dst_vm_name),
             )
-            if not rbd.image_exists(dst_disk):
-                raise Exception("Could not create image disk " + dst_disk)
+        )
 
-            # Copy additional disks from source VM
-            src_additional_count = 0
-            try:
-                src_additional_count = json.loads(
-                    rbd.get_image_metadata(src_disk, "_additional_disks")
+    # The clones keep the layouts of the source disks unless overridden
+    inherited = [json.loads(src_metadata.get("_disk_layout", "{}"))]
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        for src, _ in disks[1:]:
+            inherited.append(
+                json.loads(
+                    rbd.get_all_image_metadata(src).get("_disk_layout", "{}")
                 )
-            except KeyError:
-                pass
+            )
+    layouts = _disk_layouts(vm_options, len(disks), inherited)
 
-            for i in range(src_additional_count):
-                src_add_disk = _additional_disk_name(i, src_vm_name)
-                dst_add_disk = _additional_disk_name(i, dst_vm_name)
-                if rbd.image_exists(dst_add_disk):
-                    rbd.remove_image(dst_add_disk)
-                logger.info(
-                    "Clone additional disk %s -> %s",
-                    src_add_disk,
-                    dst_add_disk,
-                )
-                rbd.copy_image(
-                    src_add_disk,
-                    dst_add_disk,
-                    overwrite=vm_options["force"],
-                    deep=True,
-                )
-                if not rbd.image_exists(dst_add_disk):
-                    raise RuntimeError(
-                        "Could not clone additional disk " + dst_add_disk
+    if "force" not in vm_options:
+        vm_options["force"] = False
+    _create_vm_group(dst_vm_name, vm_options["force"])
+
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        try:
+            for (src, dst), layout in zip(disks, layouts):
+                # Overwrite image if necessary
+                if rbd.image_exists(dst):
+                    _remove_disk(rbd, dst)
+                logger.info("Clone disk " + src + " -> " + dst)
+                if vm_options.get("fast", False):
+                    _fast_clone_disk(rbd, src, dst, dst_vm_name, layout)
+                else:
+                    # Note: Only deep-copy works for images that are on a
+                    # group (destination img will keep the snaps but not
+                    # the group)
+                    with _progress_tracker(
+                        "copy",
+                        dst,
+                        dst_vm_name,
+                        vm_options.get("progress", False),
+                    ) as tracker:
+                        rbd.copy_image(
+                            src,
+                            dst,
+                            overwrite=vm_options["force"],
+                            deep=True,
+                            on_progress=tracker,
+                            layout=layout,
+                        )
+                # The name cache already holds dst, check the cluster
+                rbd.refresh()
+                if not rbd.image_exists(dst):
+                    raise RuntimeError("Could not clone disk " + dst)
+                if layout:
+                    rbd.set_image_metadata(
+                        dst, "_disk_layout", json.dumps(layout)
                     )
+            if vm_options.get("verify", False):
+                # Fast clones read as the snapshot they were cloned from
+                src_snap = None
+                if vm_options.get("fast", False):
+                    src_snap = CLONE_SNAPSHOT_PREFIX + dst_vm_name
+                _verify_disks(
+                    rbd,
+                    [(dst, src) for src, dst in disks],
+                    lambda dst, src: rbd.compare_images(
+                        dst, src, other_snap=src_snap
+                    ),
+                )
 
             # Pass known additional count so _configure_vm can set up XML + group
             if src_additional_count:
                 vm_options["_known_additional_count"] = src_additional_count
 
-            for disk_metadata in (
-                "_preferred_host",
-                "_pinned_host",
-                "_pacemaker_meta",
-                "_pacemaker_params",
-                "_pacemaker_utilization",
-            ):
-                try:
-                    rbd.remove_image_metadata(dst_disk, disk_metadata)
-                except KeyError:
-                    pass
+            rbd.remove_image_metadata_many(
+                dst_disk,
+                [
+                    "_preferred_host",
+                    "_pinned_host",
+                    "_pacemaker_meta",
+                    "_pacemaker_params",
+                    "_pacemaker_utilization",
+                ],
+            )
 
+            dst_metadata = {}
             for pacemaker_arg in (
                 "pacemaker_meta",
                 "pacemaker_param",
@@ -1081,17 +1384,14 @@ def clone(vm_options_with_nones):
             ):
                 dst_pacemaker_arg = vm_options.get(pacemaker_arg, {})
                 if dst_pacemaker_arg:
-                    rbd.set_image_metadata(
-                        dst_disk,
-                        f"_{pacemaker_arg}",
-                        json.dumps(dst_pacemaker_arg),
+                    dst_metadata[f"_{pacemaker_arg}"] = json.dumps(
+                        dst_pacemaker_arg
                     )
+            rbd.set_image_metadata_many(dst_disk, dst_metadata)
 
-            try:
-                vm_options["disk_bus"] = rbd.get_image_metadata(
-                    src_disk, "_disk_bus"
-                )
-            except KeyError:
+            if "_disk_bus" in src_metadata:
+                vm_options["disk_bus"] = src_metadata["_disk_bus"]
+            else:
                 logger.warning(
                     f"{src_disk} has no disk_bus metadata, set it to virtio for VM {dst_vm_name}"
                 )
@@ -1108,7 +1408,17 @@ def clone(vm_options_with_nones):
             _configure_vm(vm_options)
 
         except Exception as err:
+            # Our open instances of the destination disks would keep
+            # remove() from deleting them
+            rbd.close_images()
             remove(dst_vm_name)
+            # Additional disks only join the VM group in _configure_vm(),
+            # so remove() misses them if the copy failed. _remove_disk()
+            # also releases the _clone_ snapshots of fast clones.
+            rbd.refresh()
+            for _, dst in disks:
+                if rbd.image_exists(dst):
+                    _remove_disk(rbd, dst)
             if not rbd.is_image_in_group(src_disk, src_vm_name):
                 rbd.add_image_to_group(src_disk, src_vm_name)
             # Re-add source additional disks to source group if needed
@@ -1124,6 +1434,86 @@ def clone(vm_options_with_nones):
     logger.info(
         "VM " + src_vm_name + " successfully cloned into " + dst_vm_name
     )
+    if vm_options.get("fast", False) and vm_options.get("flatten", False):
+        flatten_vm(dst_vm_name)
+
+
+def _fast_clone_disk(rbd, src, dst, dst_vm_name, layout=None):
+    """
+    Create dst as a copy-on-write clone of a new snapshot of src, with
+    layout if given, and record the snapshot it depends on in its
+    _clone_parent metadata.
+    """
+    snap = CLONE_SNAPSHOT_PREFIX + dst_vm_name
+    # Left over by a clone removed without remove()
+    if rbd.image_snapshot_exists(src, snap):
+        rbd.remove_image_snapshot(src, snap)
+    rbd.create_image_snapshot(src, snap)
+    rbd.clone_image(src, dst, snap, layout=layout)
+    rbd.set_image_metadata(
+        dst, "_clone_parent", json.dumps({"image": src, "snapshot": snap})
+    )
+
+
+def _remove_disk(rbd, img):
+    """
+    Remove img. If it is a fast clone, also remove the snapshot it was
+    cloned from once no other image depends on it.
+    """
+    parent = rbd.get_all_image_metadata(img).get("_clone_parent")
+    rbd.remove_image(img)
+    if parent is not None:
+        _release_clone_parent(rbd, json.loads(parent))
+
+
+def _release_clone_parent(rbd, parent):
+    """
+    Remove the snapshot described by parent, the decoded _clone_parent
+    metadata of a former fast clone, if no image depends on it anymore.
+    """
+    if (
+        rbd.image_exists(parent["image"])
+        and rbd.image_snapshot_exists(parent["image"], parent["snapshot"])
+        and not rbd.list_image_snapshot_children(
+            parent["image"], parent["snapshot"]
+        )
+    ):
+        rbd.remove_image_snapshot(parent["image"], parent["snapshot"])
+
+
+def _list_fast_clones(rbd, vm_name):
+    """
+    Return the images fast cloned from the disks of a VM.
+    """
+    clones = []
+    for disk_name in _get_all_disk_names(rbd, vm_name):
+        if not rbd.image_exists(disk_name):
+            continue
+        for snap in rbd.list_image_snapshots(disk_name):
+            if snap.startswith(CLONE_SNAPSHOT_PREFIX):
+                clones.extend(
+                    rbd.list_image_snapshot_children(disk_name, snap)
+                )
+    return clones
+
+
+def _list_user_snapshots(rbd, disk_name, detailed=False):
+    """
+    Return the snapshots of a disk, without the ones taken by fast clones,
+    as names or, if detailed, as list_image_snapshots_detailed() returns
+    them.
+    """
+    if not detailed:
+        return [
+            snap
+            for snap in rbd.list_image_snapshots(disk_name)
+            if not snap.startswith(CLONE_SNAPSHOT_PREFIX)
+        ]
+    return [
+        snap
+        for snap in rbd.list_image_snapshots_detailed(disk_name)
+        if not snap["name"].startswith(CLONE_SNAPSHOT_PREFIX)
+    ]
 
 
 def _get_all_disk_names(rbd, vm_name):
@@ -1136,22 +1526,285 @@ def _get_all_disk_names(rbd, vm_name):
     return [OS_DISK_PREFIX + vm_name]
 
 
-def create_snapshot(vm_name, snapshot_name):
+def flatten_vm(vm_name):
+    """
+    Queue the fast cloned disks of a VM to be flattened, detaching them
+    from their parent snapshot, by run_flatten_queue().
+
+    :param vm_name: the VM whose disks must be flattened
+    :return: the list of the disks queued
+    """
+    queued = []
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        for disk_name in _get_all_disk_names(rbd, vm_name):
+            if not rbd.image_exists(disk_name):
+                continue
+            metadata = rbd.get_all_image_metadata(disk_name)
+            if "_clone_parent" not in metadata:
+                continue
+            record = json.loads(metadata.get("_flatten", "{}"))
+            if record.get("state") in ("queued", "running"):
+                continue
+            rbd.set_image_metadata(
+                disk_name,
+                "_flatten",
+                json.dumps(
+                    {"state": "queued", "progress": 0.0, "queued": _now()}
+                ),
+            )
+            queued.append(disk_name)
+            logger.info("Disk " + disk_name + " queued for flatten")
+    return queued
+
+
+def flatten_status(vm_name=None):
+    """
+    Return the flatten state of the disks of a VM, or of all the disks,
+    as a dictionary of the disks that have been queued. Each state is a
+    dictionary with the "state" (queued, running, done or failed), the
+    "progress" in percent, the UTC times of the transitions and the
+    "runner" id of the run_flatten_queue() which claimed the disk.
+
+    :param vm_name: the VM name, None for all the VMs
+    :return: the flatten states by disk name
+    """
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        if vm_name is None:
+            return _read_flatten_records(rbd, rbd.list_images())
+        return _read_flatten_records(rbd, _get_all_disk_names(rbd, vm_name))
+
+
+def run_flatten_queue(max_concurrent=2):
+    """
+    Flatten the queued disks, at most max_concurrent at a time, until the
+    queue is empty. The progress is saved in the _flatten metadata of the
+    disks every FLATTEN_HEARTBEAT seconds. A disk left running for more
+    than FLATTEN_STALE_TIMEOUT seconds without update, by a worker which
+    died, is flattened again.
+
+    Several runners, on any host, can work on the queue at once: each
+    disk is claimed with a lock on the FLATTEN_LOCK_OBJECT RADOS object,
+    renewed with the progress, so that a disk is only flattened by one
+    of them. The locks of a runner which died expire after
+    FLATTEN_STALE_TIMEOUT seconds. A runner which cannot renew the lock
+    of a disk stops saving its state and leaves it out of its results.
+
+    :param max_concurrent: the maximum number of flattens running at once
+    :return: the final flatten states by disk name
+    """
+    if max_concurrent < 1:
+        raise ValueError("max_concurrent must be at least 1")
+    runner = uuid.uuid4().hex
+    results = {}
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        queue = []
+        for disk_name, record in _read_flatten_records(
+            rbd, rbd.list_images()
+        ).items():
+            if _flatten_pending(record):
+                queue.append((record["queued"], disk_name))
+        queue.sort()
+        queue = [
+            (queued, disk_name)
+            for queued, disk_name in queue
+            if _claim_flatten(rbd, disk_name, runner)
+        ]
+
+        # Updated by the librbd callbacks, saved from this thread only
+        progress = {disk_name: 0.0 for _, disk_name in queue}
+
+        def flatten_disk(disk_name):
+            def on_progress(offset, total):
+                progress[disk_name] = 100.0 * offset / total if total else 0
+                return 0
+
+            rbd.flatten_image(disk_name, on_progress=on_progress)
+
+        records = {}
+        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+            futures = {}
+            for queued, disk_name in queue:
+                records[disk_name] = {
+                    "state": "queued",
+                    "progress": 0.0,
+                    "queued": queued,
+                    "runner": runner,
+                }
+                futures[executor.submit(flatten_disk, disk_name)] = disk_name
+            pending = set(futures)
+            # The disks whose lock expired and may have been claimed by
+            # another runner, which owns their records from then on
+            lost = set()
+
+            def renew(disk_name):
+                if disk_name in lost:
+                    return False
+                if rbd.try_lock(
+                    FLATTEN_LOCK_OBJECT,
+                    disk_name,
+                    runner,
+                    FLATTEN_STALE_TIMEOUT,
+                ):
+                    return True
+                lost.add(disk_name)
+                logger.warning(
+                    "Claim of disk "
+                    + disk_name
+                    + " lost to another runner, its flatten state is no "
+                    + "longer saved"
+                )
+                return False
+
+            while pending:
+                done, pending = wait(pending, timeout=FLATTEN_HEARTBEAT)
+                for future in done:
+                    disk_name = futures[future]
+                    if not renew(disk_name):
+                        continue
+                    record = records[disk_name]
+                    record["finished"] = _now()
+                    error = future.exception()
+                    if error is None:
+                        record["state"] = "done"
+                        record["progress"] = 100.0
+                        _forget_clone_parent(rbd, disk_name)
+                        logger.info("Disk " + disk_name + " flattened")
+                    else:
+                        record["state"] = "failed"
+                        record["error"] = str(error)
+                        logger.error(
+                            "Flatten of "
+                            + disk_name
+                            + " failed: "
+                            + str(error)
+                        )
+                    _save_flatten_record(rbd, disk_name, record)
+                    rbd.unlock(FLATTEN_LOCK_OBJECT, disk_name, runner)
+                    results[disk_name] = record
+                for future in list(pending):
+                    if not renew(futures[future]):
+                        # A flatten cannot be interrupted once started
+                        if future.cancel():
+                            pending.discard(future)
+                        continue
+                    if not future.running():
+                        continue
+                    record = records[futures[future]]
+                    if record["state"] == "queued":
+                        record["state"] = "running"
+                        record["started"] = _now()
+                    record["progress"] = progress[futures[future]]
+                    _save_flatten_record(rbd, futures[future], record)
+    return results
+
+
+def _flatten_pending(record):
+    """
+    Check if a flatten record is queued, or left running by a worker
+    which died.
+    """
+    return record["state"] == "queued" or (
+        record["state"] == "running"
+        and _age(record["updated"]) > FLATTEN_STALE_TIMEOUT
+    )
+
+
+def _claim_flatten(rbd, disk_name, runner):
+    """
+    Lock a queued disk for runner, and check that it is still pending
+    once locked: another runner may have flattened it meanwhile.
+    """
+    if not rbd.try_lock(
+        FLATTEN_LOCK_OBJECT, disk_name, runner, FLATTEN_STALE_TIMEOUT
+    ):
+        logger.info("Disk " + disk_name + " claimed by another runner")
+        return False
+    record = _read_flatten_records(rbd, [disk_name]).get(disk_name)
+    if record is None or not _flatten_pending(record):
+        rbd.unlock(FLATTEN_LOCK_OBJECT, disk_name, runner)
+        return False
+    return True
+
+
+def _read_flatten_records(rbd, disk_names):
+    """
+    Return the decoded _flatten metadata of the disks that have one.
+    """
+    records = {}
+    for disk_name in disk_names:
+        if not rbd.image_exists(disk_name):
+            continue
+        record = rbd.get_all_image_metadata(disk_name).get("_flatten")
+        if record is not None:
+            records[disk_name] = json.loads(record)
+    return records
+
+
+def _forget_clone_parent(rbd, disk_name):
+    """
+    Drop the _clone_parent metadata of a flattened disk and release its
+    former parent snapshot.
+    """
+    parent = rbd.get_all_image_metadata(disk_name).get("_clone_parent")
+    if parent is not None:
+        rbd.remove_image_metadata(disk_name, "_clone_parent")
+        _release_clone_parent(rbd, json.loads(parent))
+
+
+def _save_flatten_record(rbd, disk_name, record):
+    """
+    Save the flatten state of a disk in its _flatten metadata.
+    """
+    record["updated"] = _now()
+    rbd.set_image_metadata(disk_name, "_flatten", json.dumps(record))
+
+
+def _now():
+    """
+    Return the current UTC time as an ISO 8601 string. The times of the
+    flatten records are compared across hosts, local times would be off
+    when the hosts change their UTC offset.
+    """
+    return utcnow().isoformat(timespec="seconds")
+
+
+def _age(timestamp):
+    """
+    Return the number of seconds elapsed since a _now() timestamp.
+    """
+    return (
+        utcnow() - datetime.datetime.fromisoformat(timestamp)
+    ).total_seconds()
+
+
+def create_snapshot(vm_name, snapshot_name, per_image=False):
     """
     Create a snapshot. The snapshot can be a system disk snapshot only or
     a VM snapshot (os disk and data disk).
 
+    By default the snapshot is a group snapshot of the VM, taken in one
+    operation and consistent across all the disks. per_image takes a
+    separate snapshot of each disk instead, as older versions did.
+
     :param vm_name: the VM to be snapshot
     :param snapshot_name: the snapshot name
+    :param per_image: snapshot each disk separately (default False)
     """
 
     _check_name(snapshot_name)
 
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
 
         disk_names = _get_all_disk_names(rbd, vm_name)
 
         # Validate that no snapshot with this name exists on any disk
+        if snapshot_name in _list_group_snapshots(rbd, vm_name):
+            raise Exception(
+                "Snapshot "
+                + snapshot_name
+                + " already exists on VM "
+                + vm_name
+            )
         for disk_name in disk_names:
             if rbd.image_snapshot_exists(disk_name, snapshot_name):
                 raise Exception(
@@ -1161,6 +1814,17 @@ def create_snapshot(vm_name, snapshot_name):
                     + disk_name
                 )
 
+        if not per_image and rbd.group_exists(vm_name):
+            rbd.create_group_snapshot(vm_name, snapshot_name)
+            logger.info(
+                "Snapshot "
+                + snapshot_name
+                + " of VM "
+                + vm_name
+                + " successfully created"
+            )
+            return
+
         # Create snapshot on all disks
         for disk_name in disk_names:
             rbd.create_image_snapshot(disk_name, snapshot_name)
@@ -1180,39 +1844,121 @@ def remove_snapshot(vm_name, snapshot_name):
     :param vm_name: the VM from which the snapshot must be removed
     :param snapshot_name: the name of the snapshot to be removed
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-        disk_names = _get_all_disk_names(rbd, vm_name)
-        for disk_name in disk_names:
-            if rbd.image_snapshot_exists(disk_name, snapshot_name):
-                rbd.remove_image_snapshot(disk_name, snapshot_name)
-                logger.info(
-                    "Snapshot "
-                    + snapshot_name
-                    + " from image "
-                    + disk_name
-                    + " successfully removed"
-                )
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        _remove_vm_snapshot(rbd, vm_name, snapshot_name)
 
 
-def list_snapshots(vm_name):
+def _remove_vm_snapshot(rbd, vm_name, snapshot_name):
+    """
+    Remove the group snapshot and the per-image snapshots named
+    snapshot_name from a VM.
+    """
+    if snapshot_name in _list_group_snapshots(rbd, vm_name):
+        rbd.remove_group_snapshot(vm_name, snapshot_name)
+        logger.info(
+            "Snapshot "
+            + snapshot_name
+            + " of VM "
+            + vm_name
+            + " successfully removed"
+        )
+    for disk_name in _get_all_disk_names(rbd, vm_name):
+        if rbd.image_snapshot_exists(disk_name, snapshot_name):
+            rbd.remove_image_snapshot(disk_name, snapshot_name)
+            logger.info(
+                "Snapshot "
+                + snapshot_name
+                + " from image "
+                + disk_name
+                + " successfully removed"
+            )
+
+
+def list_snapshots(vm_name, detailed=False):
     """
     Get the snapshot list of a VM.
 
+    With detailed, each snapshot also comes with the bytes it pins: the
+    bytes changed since the previous snapshot, summed over all the disks
+    of the VM. These deltas are cached, only the new snapshots cost a
+    diff.
+
     :param vm_name: the VM name from which to list the snapshots
-    :return: the snapshot list
+    :param detailed: return dictionaries with the snapshot "name", its
+                     "timestamp", whether it is a "group" snapshot, the
+                     bytes it pins as "size" and whether this size is
+                     "exact" (see RbdManager.list_image_snapshot_deltas())
+                     instead of names
+    :return: the snapshot list, oldest first
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-        disk_name = OS_DISK_PREFIX + vm_name
-        return rbd.list_image_snapshots(disk_name)
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        snaps = _list_vm_snapshots(rbd, vm_name)
+        if not detailed:
+            return [snap["name"] for snap in snaps]
+
+        for snap in snaps:
+            snap["size"] = 0
+            snap["exact"] = True
+        by_key = {(snap["name"], snap["group"]): snap for snap in snaps}
+        for disk_name in _get_all_disk_names(rbd, vm_name):
+            for delta in rbd.list_image_snapshot_deltas(disk_name):
+                snap = by_key.get((delta["name"], delta["group"]))
+                if snap is not None:
+                    snap["size"] += delta["used"]
+                    snap["exact"] &= delta["exact"]
+        return snaps
+
+
+def _list_group_snapshots(rbd, vm_name):
+    """
+    Return the group snapshots of a VM, an empty list if it has no group.
+    """
+    if not rbd.group_exists(vm_name):
+        return []
+    return rbd.list_group_snapshots(vm_name)
 
 
-def purge_image(vm_name, date=None, number=None):
+def _list_vm_snapshots(rbd, vm_name):
+    """
+    Return the snapshots of a VM, oldest first, as dictionaries with the
+    snapshot "name", its "timestamp" and whether it is a "group"
+    snapshot or a set of per-image snapshots. The timestamps are the ones
+    of the system disk.
+    """
+    disk_name = OS_DISK_PREFIX + vm_name
+    snaps = []
+    if rbd.group_exists(vm_name):
+        timestamps = rbd.get_group_snapshot_timestamps(disk_name)
+        for name in rbd.list_group_snapshots(vm_name):
+            snaps.append(
+                {
+                    "name": name,
+                    "timestamp": timestamps.get(name),
+                    "group": True,
+                }
+            )
+    for snap in _list_user_snapshots(rbd, disk_name, detailed=True):
+        snaps.append(
+            {
+                "name": snap["name"],
+                "timestamp": snap["timestamp"],
+                "group": False,
+            }
+        )
+    # A group snapshot without timestamp does not include the system disk
+    snaps.sort(key=lambda snap: snap["timestamp"] or datetime.datetime.min)
+    return snaps
+
+
+def purge_image(vm_name, date=None, number=None, progress=False):
     """
     Remove all snapshots of the given type on the given VM.
 
     :param vm_name: the VM name to be purged
     :param date: date until snapshots must be removed
     :param number: number of snapshots to delete starting from the oldest
+    :param progress: print the progress of the purge, or a callable the
+                     progress records are passed to (default False)
     """
 
     if date:
@@ -1222,14 +1968,31 @@ def purge_image(vm_name, date=None, number=None):
         if not isinstance(date, datetime.datetime):
             raise ValueError("Parameter date is not datetime")
 
-        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+            if rbd.group_exists(vm_name):
+                timestamps = rbd.get_group_snapshot_timestamps(
+                    OS_DISK_PREFIX + vm_name
+                )
+                for snap in rbd.list_group_snapshots(vm_name):
+                    snap_ts = timestamps.get(snap)
+                    if snap_ts and snap_ts.timestamp() < date.timestamp():
+                        rbd.remove_group_snapshot(vm_name, snap)
+
             for disk_name in _get_all_disk_names(rbd, vm_name):
-                for snap in rbd.list_image_snapshots(disk_name, flat=False):
-                    snap_ts = rbd.get_image_snapshot_timestamp(
-                        disk_name, snap["id"]
+                snaps = [
+                    snap["name"]
+                    for snap in _list_user_snapshots(
+                        rbd, disk_name, detailed=True
                     )
-                    if snap_ts.timestamp() < date.timestamp():
-                        rbd.remove_image_snapshot(disk_name, snap["name"])
+                    if snap["timestamp"].timestamp() < date.timestamp()
+                ]
+                with _progress_tracker(
+                    "purge", disk_name, vm_name, progress, unit="snapshots"
+                ) as tracker:
+                    for i, snap in enumerate(snaps):
+                        tracker(i, len(snaps))
+                        rbd.remove_image_snapshot(disk_name, snap)
+                    tracker(len(snaps), len(snaps))
 
             logger.info(
                 "Snapshots of VM "
@@ -1243,20 +2006,38 @@ def purge_image(vm_name, date=None, number=None):
         if not isinstance(number, int) or number < 0:
             raise ValueError("Parameter number must be a non-negative integer")
 
-        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
-            all_disks = _get_all_disk_names(rbd, vm_name)
-            # To recover from previous errors where not all snapshots were removed
-            min_snap_count = min(
-                len(rbd.list_image_snapshots(d)) for d in all_disks
-            )
-            for disk_name in all_disks:
-                snap_list = rbd.list_image_snapshots(disk_name)
-                to_remove = number + (len(snap_list) - min_snap_count)
-                if len(snap_list) <= to_remove:
-                    rbd.purge_image(disk_name)
-                else:
-                    for snap in snap_list[:to_remove]:
-                        rbd.remove_image_snapshot(disk_name, snap)
+        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+            snaps = _list_vm_snapshots(rbd, vm_name)[:number]
+            with _progress_tracker(
+                "purge", vm_name, vm_name, progress, unit="snapshots"
+            ) as tracker:
+                for i, snap in enumerate(snaps):
+                    tracker(i, len(snaps))
+                    _remove_vm_snapshot(rbd, vm_name, snap["name"])
+                tracker(len(snaps), len(snaps))
+
+            # To recover from previous errors where not all per-image
+            # snapshots were removed, remove the oldest snapshots of the
+            # disks that have more than the others
+            disk_snaps = {
+                disk_name: [
+                    snap["name"]
+                    for snap in _list_user_snapshots(
+                        rbd, disk_name, detailed=True
+                    )
+                ]
+                for disk_name in _get_all_disk_names(rbd, vm_name)
+            }
+            min_snap_count = min(len(names) for names in disk_snaps.values())
+            for disk_name, names in disk_snaps.items():
+                for snap in names[: len(names) - min_snap_count]:
+                    rbd.remove_image_snapshot(disk_name, snap)
+                    logger.info(
+                        "Leftover snapshot "
+                        + snap
+                        + " removed from image "
+                        + disk_name
+                    )
 
             logger.info(
                 "First "
@@ -1267,52 +2048,823 @@ def purge_image(vm_name, date=None, number=None):
             )
     else:
 
-        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+            if rbd.group_exists(vm_name):
+                rbd.purge_group(vm_name)
             disk_names = _get_all_disk_names(rbd, vm_name)
             for disk_name in disk_names:
-                rbd.purge_image(disk_name)
+                with _progress_tracker(
+                    "purge", disk_name, vm_name, progress, unit="snapshots"
+                ) as tracker:
+                    rbd.purge_image(disk_name, on_progress=tracker)
             logger.info("VM " + vm_name + " successfully purged")
 
 
-def rollback_snapshot(vm_name, snapshot_name):
+def apply_retention(
+    keep_last=0,
+    keep_hourly=0,
+    keep_daily=0,
+    keep_weekly=0,
+    max_age=None,
+    exclude=(),
+    vm_names=None,
+    dry_run=False,
+    jobs=4,
+):
+    """
+    Apply a snapshot retention policy to VMs, all the VMs of the pool by
+    default. The snapshots of every VM are listed and the whole plan is
+    made first, over a single Ceph connection, then the snapshots to
+    remove are removed by jobs threads, one VM at a time per thread. A
+    VM failing does not stop the others: the failures are raised once
+    all the VMs have been handled.
+
+    See RetentionPolicy for the rules. The snapshots taken by fast
+    clones are not subject to the policy.
+
+    :param keep_last: the number of most recent snapshots to keep
+    :param keep_hourly: the number of hours to keep a snapshot of
+    :param keep_daily: the number of days to keep a snapshot of
+    :param keep_weekly: the number of weeks to keep a snapshot of
+    :param max_age: a datetime.timedelta, older snapshots are removed
+                    unless keep_last keeps them
+    :param exclude: fnmatch patterns of snapshot names to keep, like the
+                    ones of backup snapshots
+    :param vm_names: the VMs to apply the policy to (default all)
+    :param dry_run: only return the plan, without removing anything
+    :param jobs: the number of VMs handled at once
+    :return: the plan, the list of the snapshots of each VM as
+             list_snapshots() returns them, with "keep" and "reasons" set
+             as RetentionPolicy.select() does
+    """
+    policy = RetentionPolicy(
+        keep_last, keep_hourly, keep_daily, keep_weekly, max_age, exclude
+    )
+    if jobs < 1:
+        raise ValueError("jobs must be at least 1")
+
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        if vm_names is None:
+            vm_names = rbd.list_groups()
+        # Snapshot timestamps are in UTC
+        now = utcnow()
+        plan = {}
+        for vm_name in vm_names:
+            if not rbd.image_exists(OS_DISK_PREFIX + vm_name):
+                raise Exception("VM " + vm_name + " does not exist")
+            plan[vm_name] = policy.select(
+                _list_vm_snapshots(rbd, vm_name), now
+            )
+        if dry_run:
+            return plan
+
+        def remove_snapshots(vm_name, snaps):
+            with _progress_tracker(
+                "retention", vm_name, vm_name, False, unit="snapshots"
+            ) as tracker:
+                disk_names = _get_all_disk_names(rbd, vm_name)
+                for i, snap in enumerate(snaps):
+                    tracker(i, len(snaps))
+                    # Not _remove_vm_snapshot(): a group snapshot and
+                    # per-image snapshots of the same name may be planned
+                    # differently
+                    if snap["group"]:
+                        rbd.remove_group_snapshot(vm_name, snap["name"])
+                        continue
+                    for disk_name in disk_names:
+                        if rbd.image_snapshot_exists(disk_name, snap["name"]):
+                            rbd.remove_image_snapshot(disk_name, snap["name"])
+                tracker(len(snaps), len(snaps))
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+            for vm_name, entries in plan.items():
+                snaps = [entry for entry in entries if not entry["keep"]]
+                if snaps:
+                    future = executor.submit(remove_snapshots, vm_name, snaps)
+                    futures[future] = vm_name
+            for future in as_completed(futures):
+                vm_name = futures[future]
+                try:
+                    future.result()
+                except Exception as err:
+                    logger.error(
+                        "Retention of VM " + vm_name + " failed: " + str(err)
+                    )
+                    errors[vm_name] = err
+    if errors:
+        raise Exception(
+            "Retention failed on VMs "
+            + ", ".join(
+                vm_name + " (" + str(errors[vm_name]) + ")"
+                for vm_name in sorted(errors)
+            )
+        )
+    logger.info("Retention applied to " + str(len(plan)) + " VMs")
+    return plan
+
+
+def upgrade_features(
+    vm_names=None, features=None, jobs=4, dry_run=False, progress=False
+):
+    """
+    Enable features on the disks of existing VMs, all the VMs of the pool
+    by default, and rebuild their invalid object maps, the ones of the
+    disks object-map is enabled on included. The disks are listed and the
+    plan is made first, over a single Ceph connection, then jobs threads
+    upgrade them, one disk at a time per thread. A disk failing does not
+    stop the others: the failures are raised once all the disks have
+    been handled.
+
+    Only the DYNAMIC_IMAGE_FEATURES can be enabled on an existing disk;
+    the other features requested that a disk lacks are reported as
+    unsupported.
+
+    :param vm_names: the VMs to upgrade (default all)
+    :param features: the names of the features the disks must have
+                     (default DISK_FEATURES)
+    :param jobs: the number of disks upgraded at once
+    :param dry_run: only return the plan, without changing anything
+    :param progress: as for _progress_tracker(), the progress counts the
+                     object maps rebuilt
+    :return: the plan, a list with a dictionary per disk holding its
+             "vm", its "disk" name, its current "features", the features
+             to "enable", the "unsupported" ones, whether object maps
+             must be rebuilt ("rebuild") and the number "rebuilt"
+    """
+    if features is None:
+        features = DISK_FEATURES
+    features = check_image_layout({"features": list(features)})["features"]
+    if jobs < 1:
+        raise ValueError("jobs must be at least 1")
+
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        if vm_names is None:
+            vm_names = rbd.list_groups()
+        plan = []
+        for vm_name in vm_names:
+            if not rbd.image_exists(OS_DISK_PREFIX + vm_name):
+                raise Exception("VM " + vm_name + " does not exist")
+            for disk_name in _get_all_disk_names(rbd, vm_name):
+                current = rbd.get_image_features(disk_name)
+                missing = [name for name in features if name not in current]
+                enable = [
+                    name for name in missing if name in DYNAMIC_IMAGE_FEATURES
+                ]
+                plan.append(
+                    {
+                        "vm": vm_name,
+                        "disk": disk_name,
+                        "features": current,
+                        "enable": enable,
+                        "unsupported": [
+                            name for name in missing if name not in enable
+                        ],
+                        "rebuild": "object-map" in enable
+                        or bool(rbd.list_invalid_object_maps(disk_name)),
+                        "rebuilt": 0,
+                    }
+                )
+        if dry_run:
+            return plan
+
+        if progress is True:
+            # Concurrent progress bars would overwrite each other
+            progress = ProgressPrinter(step=10 if jobs > 1 else None)
+
+        def upgrade_disk(entry):
+            if entry["enable"]:
+                rbd.enable_image_features(entry["disk"], entry["enable"])
+            if entry["rebuild"]:
+                with _progress_tracker(
+                    "features",
+                    entry["disk"],
+                    entry["vm"],
+                    progress,
+                    unit="maps",
+                ) as tracker:
+                    entry["rebuilt"] = rbd.rebuild_image_object_maps(
+                        entry["disk"], on_progress=tracker
+                    )
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(upgrade_disk, entry): entry["disk"]
+                for entry in plan
+                if entry["enable"] or entry["rebuild"]
+            }
+            for future in as_completed(futures):
+                disk_name = futures[future]
+                try:
+                    future.result()
+                except Exception as err:
+                    logger.error(
+                        "Upgrade of disk " + disk_name + " failed: " + str(err)
+                    )
+                    errors[disk_name] = err
+    if errors:
+        raise Exception(
+            "Feature upgrade failed on disks "
+            + ", ".join(
+                disk_name + " (" + str(errors[disk_name]) + ")"
+                for disk_name in sorted(errors)
+            )
+        )
+    logger.info("Features upgraded on " + str(len(plan)) + " disks")
+    return plan
+
+
+def rollback_snapshot(
+    vm_name, snapshot_name, keep_resource=False, progress=False
+):
     """
     Restore a VM to a previous state based on the given snapshot.
 
+    By default the VM is disabled during the rollback and enabled again
+    afterwards, which recreates its Pacemaker resource. With keep_resource
+    the resource is only stopped and started again, keeping the primitive
+    and its constraints as they are.
+
     :param vm_name: the VM name to be restored
     :param snapshot_name: the snapshot name to be used for rollback
+    :param keep_resource: stop and start the Pacemaker resource instead
+                          of deleting and recreating it (default False)
+    :param progress: print the progress of the rollback, or a callable
+                     the progress records are passed to (default False)
     """
 
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
 
         disk_names = _get_all_disk_names(rbd, vm_name)
-        for dn in disk_names:
-            if not rbd.image_snapshot_exists(dn, snapshot_name):
-                raise Exception(
-                    "Snapshot "
-                    + snapshot_name
-                    + " does not exist on disk "
-                    + dn
-                    + " of VM "
-                    + vm_name
-                )
+        group_snapshot = snapshot_name in _list_group_snapshots(rbd, vm_name)
+        if not group_snapshot:
+            for dn in disk_names:
+                if not rbd.image_snapshot_exists(dn, snapshot_name):
+                    raise Exception(
+                        "Snapshot "
+                        + snapshot_name
+                        + " does not exist on disk "
+                        + dn
+                        + " of VM "
+                        + vm_name
+                    )
 
         enabled = is_enabled(vm_name)
-        if enabled:
+        started = False
+        if enabled and keep_resource:
+            with Pacemaker(vm_name) as p:
+                if p.show() != "Stopped (disabled)":
+                    started = True
+                    logger.info("Stop " + vm_name + " for rollback")
+                    p.stop()
+                    p.wait_for("Stopped (disabled)")
+        elif enabled:
             disable_vm(vm_name)
 
-        for dn in disk_names:
-            rbd.rollback_image(dn, snapshot_name)
+        if group_snapshot:
+            # The rbd bindings do not report the progress of a group
+            # rollback, only its end is
+            with _progress_tracker(
+                "rollback", vm_name, vm_name, progress, unit="groups"
+            ) as tracker:
+                tracker(0, 1)
+                rbd.rollback_group(vm_name, snapshot_name)
             logger.info(
-                "Image "
-                + dn
+                "VM "
+                + vm_name
                 + " successfully rollbacked to snapshot "
                 + snapshot_name
             )
+        else:
+            for dn in disk_names:
+                with _progress_tracker(
+                    "rollback", dn, vm_name, progress
+                ) as tracker:
+                    rbd.rollback_image(dn, snapshot_name, on_progress=tracker)
+                logger.info(
+                    "Image "
+                    + dn
+                    + " successfully rollbacked to snapshot "
+                    + snapshot_name
+                )
+
+    if started:
+        with Pacemaker(vm_name) as p:
+            logger.info("Start " + vm_name + " after rollback")
+            p.start()
+            p.wait_for("Started")
+    elif enabled and not keep_resource:
+        enable_vm(vm_name)
+
+
+def get_usage(vm_name=None, jobs=16):
+    """
+    Compute the Ceph space used by the disks of a VM, or of all the VMs
+    of the pool, and by their snapshots. The disks are walked
+    concurrently. See RbdManager.get_image_usage() for how the space used
+    is computed.
+
+    :param vm_name: the VM to report, None for all the VMs
+    :param jobs: the number of disks walked at once
+    :return: a list of dictionaries, one per VM sorted by name, with the
+             VM "name", its "provisioned" and "used" bytes, whether the
+             figures are "exact" and its "disks" as returned by
+             get_image_usage() with their "name"
+    """
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        if vm_name is None:
+            vm_names = sorted(rbd.list_groups())
+        elif rbd.group_exists(vm_name) or rbd.image_exists(
+            OS_DISK_PREFIX + vm_name
+        ):
+            vm_names = [vm_name]
+        else:
+            raise Exception("VM " + vm_name + " does not exist")
+        disks = {name: _get_all_disk_names(rbd, name) for name in vm_names}
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = {
+                (name, disk_name): executor.submit(
+                    rbd.get_image_usage, disk_name
+                )
+                for name in vm_names
+                for disk_name in disks[name]
+            }
+            report = []
+            for name in vm_names:
+                vm_usage = {
+                    "name": name,
+                    "provisioned": 0,
+                    "used": 0,
+                    "exact": True,
+                    "disks": [],
+                }
+                for disk_name in disks[name]:
+                    usage = futures[(name, disk_name)].result()
+                    usage["name"] = disk_name
+                    vm_usage["disks"].append(usage)
+                    vm_usage["provisioned"] += usage["provisioned"]
+                    vm_usage["used"] += usage["used"] + sum(
+                        snap["used"] for snap in usage["snapshots"]
+                    )
+                    vm_usage["exact"] &= usage["exact"]
+                report.append(vm_usage)
+    return report
+
+
+def verify_vm(vm_name, image=None, additional_disks=None, src_vm=None, jobs=4):
+    """
+    Check that the disks of a VM have the content of their source: the
+    qcow2 files they were imported from, or the disks of another VM they
+    were cloned from. Holes are skipped and the disks are read with up to
+    jobs parallel reads.
+
+    :param vm_name: the VM to check
+    :param image: the qcow2 file of the system disk
+    :param additional_disks: the qcow2 files of the additional disks
+    :param src_vm: the VM to compare all the disks with, instead of files
+    :param jobs: the number of chunks read and hashed at once
+    :return: a dictionary telling, for each disk checked, if it matches
+    """
+    if src_vm is not None and (image or additional_disks):
+        raise ValueError("Compare with either files or a VM, not both")
+    if src_vm is None and not (image or additional_disks):
+        raise ValueError("No source to compare the VM with")
+
+    results = {}
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        if src_vm is not None:
+            for disk_name in _get_all_disk_names(rbd, vm_name):
+                src_disk = _disk_name_for_role(
+                    src_vm, _disk_role(vm_name, disk_name)
+                )
+                if not rbd.image_exists(src_disk):
+                    raise Exception(
+                        "VM " + src_vm + " has no disk " + src_disk
+                    )
+                results[disk_name] = rbd.compare_images(
+                    disk_name, src_disk, jobs=jobs
+                )
+        else:
+            pairs = [(OS_DISK_PREFIX + vm_name, image)] + [
+                (_additional_disk_name(i, vm_name), path)
+                for i, path in enumerate(additional_disks or [])
+            ]
+            for disk_name, path in pairs:
+                if path is None:
+                    continue
+                if not rbd.image_exists(disk_name):
+                    raise Exception(
+                        "Disk "
+                        + disk_name
+                        + " of VM "
+                        + vm_name
+                        + " is missing"
+                    )
+                results[disk_name] = rbd.compare_image_with_file(
+                    disk_name, path, jobs=jobs
+                )
+
+    for disk_name, match in results.items():
+        logger.info(
+            "Disk " + disk_name + (" matches" if match else " differs")
+        )
+    return results
+
+
+def backup_vm(vm_name, path, since=None, snapshot_name=None):
+    """
+    Back up the disks of a VM to a delta file. A new snapshot of every
+    disk is taken and, with since, only the extents that changed since
+    snapshot since are written, otherwise all the allocated extents are.
+    The snapshot is kept as the base of the next incremental backup.
+
+    RBD can only compute the changes since a snapshot of the image, not
+    since a group snapshot: the backup snapshots are per-image snapshots.
+
+    :param vm_name: the VM to back up
+    :param path: the delta file to write
+    :param since: the snapshot of a previous backup to start from, None
+                  for a full backup
+    :param snapshot_name: the name of the backup snapshot, "backup"
+                          followed by the current date by default
+    :return: the name of the backup snapshot
+    """
+    snapshot_name = _backup_snapshot_name(snapshot_name)
+
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        disk_names = _get_all_disk_names(rbd, vm_name)
+        if since is not None:
+            for disk_name in disk_names:
+                if not rbd.image_snapshot_exists(disk_name, since):
+                    raise Exception(
+                        "Snapshot "
+                        + since
+                        + " does not exist on disk "
+                        + disk_name
+                        + " of VM "
+                        + vm_name
+                        + ", incremental backups need per-image snapshots"
+                    )
+
+        _create_backup_snapshot(rbd, vm_name, disk_names, snapshot_name)
+        try:
+            with DeltaWriter(path, vm_name, snapshot_name, since) as delta:
+                for disk_name in disk_names:
+                    delta.add_disk(
+                        _disk_role(vm_name, disk_name),
+                        disk_name,
+                        rbd.get_image_size(disk_name),
+                    )
+                    for offset, length, data in rbd.iter_image_changes(
+                        disk_name, snapshot_name, since, queue_depth=8
+                    ):
+                        delta.add_extent(offset, length, data)
+        except Exception:
+            _remove_backup_snapshot(rbd, disk_names, snapshot_name)
+            raise
+
+    logger.info(
+        "VM "
+        + vm_name
+        + " backed up to "
+        + path
+        + " at snapshot "
+        + snapshot_name
+    )
+    return snapshot_name
+
+
+def restore_vm(vm_name, paths):
+    """
+    Restore the disks of a VM from a chain of delta files written by
+    backup_vm(): a full backup or an incremental backup whose base
+    snapshot still exists on the VM, followed by the incremental backups
+    taken after it, in order. The disks must exist: restore to a new VM
+    by creating it first. The snapshot of every delta is recreated on the
+    disks, so that later incremental backups can be restored on top.
+
+    :param vm_name: the VM to restore
+    :param paths: the delta files to apply, oldest first
+    """
+    if not paths:
+        raise ValueError("No delta file to restore")
+
+    readers = []
+    try:
+        for path in paths:
+            delta = DeltaReader(path)
+            readers.append(delta)
+            if len(readers) > 1 and delta.since != readers[-2].snapshot:
+                raise Exception(
+                    path + " does not follow snapshot " + readers[-2].snapshot
+                )
+            delta.verify()
+
+        with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+            targets = {}
+            for disk in readers[0].disks:
+                disk_name = _disk_name_for_role(vm_name, disk["role"])
+                if not rbd.image_exists(disk_name):
+                    raise Exception(
+                        "Disk "
+                        + disk_name
+                        + " of VM "
+                        + vm_name
+                        + " is missing"
+                    )
+                targets[str(disk["role"])] = disk_name
+            base = readers[0].since
+            if base is not None:
+                for disk_name in targets.values():
+                    if not rbd.image_snapshot_exists(disk_name, base):
+                        raise Exception(
+                            "Snapshot "
+                            + base
+                            + " does not exist on disk "
+                            + disk_name
+                            + " of VM "
+                            + vm_name
+                        )
+
+            enabled = is_enabled(vm_name)
+            if enabled:
+                disable_vm(vm_name)
+
+            if base is not None:
+                for disk_name in targets.values():
+                    rbd.rollback_image(disk_name, base)
+            for delta in readers:
+                _apply_delta(rbd, delta, targets)
+                logger.info(
+                    "Delta " + delta.path + " restored on VM " + vm_name
+                )
+    finally:
+        for delta in readers:
+            delta.close()
+
+    if enabled:
+        enable_vm(vm_name)
+
+
+def _apply_delta(rbd, delta, targets):
+    """
+    Write the extents of a delta file to the disks it maps to in targets
+    and take the snapshot of the delta.
+    """
+    for disk in delta.disks:
+        disk_name = targets.get(str(disk["role"]))
+        if disk_name is None:
+            raise Exception(
+                delta.path + " holds unknown disk " + str(disk["name"])
+            )
+        if rbd.get_image_size(disk_name) != disk["size"]:
+            rbd.resize_image(disk_name, disk["size"])
+        if delta.since is None:
+            # A full backup only holds the allocated extents
+            rbd.zero_image(disk_name, 0, disk["size"])
+        with rbd.open_image_stream(disk_name, queue_depth=8) as stream:
+            for offset, length, data in delta.iter_extents(disk):
+                if data is None:
+                    stream.flush()
+                    rbd.zero_image(disk_name, offset, length)
+                else:
+                    stream.seek(offset)
+                    stream.write(data)
+        if rbd.image_snapshot_exists(disk_name, delta.snapshot):
+            rbd.remove_image_snapshot(disk_name, delta.snapshot)
+        rbd.create_image_snapshot(disk_name, delta.snapshot)
+
+
+def _backup_snapshot_name(snapshot_name):
+    """
+    Check the name of a backup snapshot, "backup" followed by the current
+    date if None.
+    """
+    if snapshot_name is None:
+        snapshot_name = "backup" + datetime.datetime.now().strftime(
+            "%Y%m%d%H%M%S"
+        )
+    _check_name(snapshot_name)
+    return snapshot_name
+
+
+def _create_backup_snapshot(rbd, vm_name, disk_names, snapshot_name):
+    """
+    Take the per-image snapshot snapshot_name of the disks of a VM.
+    """
+    if snapshot_name in _list_group_snapshots(rbd, vm_name):
+        raise Exception(
+            "Snapshot " + snapshot_name + " already exists on VM " + vm_name
+        )
+    for disk_name in disk_names:
+        if rbd.image_snapshot_exists(disk_name, snapshot_name):
+            raise Exception(
+                "Snapshot "
+                + snapshot_name
+                + " already exists on image "
+                + disk_name
+            )
+    try:
+        for disk_name in disk_names:
+            rbd.create_image_snapshot(disk_name, snapshot_name)
+    except Exception:
+        _remove_backup_snapshot(rbd, disk_names, snapshot_name)
+        raise
+
+
+def _remove_backup_snapshot(rbd, disk_names, snapshot_name):
+    """
+    Remove the per-image snapshot snapshot_name from the disks that
+    have it.
+    """
+    for disk_name in disk_names:
+        if rbd.image_snapshot_exists(disk_name, snapshot_name):
+            rbd.remove_image_snapshot(disk_name, snapshot_name)
+
+
+def backup_vm_to_store(vm_name, store_path, backup_name=None, jobs=4):
+    """
+    Back up the disks of a VM to a deduplicated chunk store. The disks
+    are cut in chunks of CHUNK_STORE_CHUNK_SIZE bytes read from a
+    temporary snapshot, and only the chunks missing from the store are
+    written. The store is created if it does not exist.
+
+    :param vm_name: the VM to back up
+    :param store_path: the directory of the chunk store
+    :param backup_name: the name of the backup, "backup" followed by the
+                        current date by default
+    :param jobs: the number of chunks read, hashed and stored at once
+    :return: the name of the backup
+    """
+    backup_name = _backup_snapshot_name(backup_name)
+    store = ChunkStore(store_path, create=True)
+    if store.backup_exists(vm_name, backup_name):
+        raise Exception(
+            "Backup " + backup_name + " of VM " + vm_name + " already exists"
+        )
+    manifest = {
+        "vm": vm_name,
+        "created": _now(),
+        "chunk_size": CHUNK_STORE_CHUNK_SIZE,
+        "disks": [],
+    }
+    stored = 0
+
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        disk_names = _get_all_disk_names(rbd, vm_name)
+        _create_backup_snapshot(rbd, vm_name, disk_names, backup_name)
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                for disk_name in disk_names:
+                    chunks = []
+                    pending = {}
+                    for offset, data in rbd.iter_image_allocated_chunks(
+                        disk_name,
+                        backup_name,
+                        CHUNK_STORE_CHUNK_SIZE,
+                        queue_depth=jobs,
+                    ):
+                        if data.count(0) == len(data):
+                            continue
+                        future = executor.submit(store.put_chunk, data)
+                        pending[future] = offset
+                        # Bound the chunks held in memory
+                        if len(pending) >= 2 * jobs:
+                            stored += _collect_chunks(pending, chunks)
+                    stored += _collect_chunks(pending, chunks, wait_all=True)
+                    chunks.sort()
+                    manifest["disks"].append(
+                        {
+                            "role": _disk_role(vm_name, disk_name),
+                            "name": disk_name,
+                            "size": rbd.get_image_size(disk_name),
+                            "chunks": chunks,
+                        }
+                    )
+            store.save_manifest(vm_name, backup_name, manifest)
+        finally:
+            _remove_backup_snapshot(rbd, disk_names, backup_name)
+
+    logger.info(
+        "VM "
+        + vm_name
+        + " backed up to store "
+        + store_path
+        + " as "
+        + backup_name
+        + ", "
+        + str(stored)
+        + " new chunks stored"
+    )
+    return backup_name
+
+
+def _collect_chunks(pending, chunks, wait_all=False):
+    """
+    Wait for the first stored chunk of pending, or all of them with
+    wait_all, append their [offset, digest] to chunks and return the
+    number of chunks written to the store.
+    """
+    stored = 0
+    done, _ = wait(
+        pending, return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED
+    )
+    for future in done:
+        offset = pending.pop(future)
+        digest, written = future.result()
+        chunks.append([offset, digest])
+        stored += written
+    return stored
+
+
+def restore_vm_from_store(vm_name, store_path, backup_name, jobs=4):
+    """
+    Restore the disks of a VM from a backup of a chunk store written by
+    backup_vm_to_store(). The disks must exist: restore to a new VM by
+    creating it first.
+
+    :param vm_name: the VM to restore
+    :param store_path: the directory of the chunk store
+    :param backup_name: the backup of the VM to restore
+    :param jobs: the number of chunks read from the store and written at
+                 once
+    """
+    store = ChunkStore(store_path)
+    manifest = store.load_manifest(vm_name, backup_name)
+
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
+        targets = []
+        for disk in manifest["disks"]:
+            disk_name = _disk_name_for_role(vm_name, disk["role"])
+            if not rbd.image_exists(disk_name):
+                raise Exception(
+                    "Disk " + disk_name + " of VM " + vm_name + " is missing"
+                )
+            targets.append((disk_name, disk))
+
+        enabled = is_enabled(vm_name)
+        if enabled:
+            disable_vm(vm_name)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for disk_name, disk in targets:
+                if rbd.get_image_size(disk_name) != disk["size"]:
+                    rbd.resize_image(disk_name, disk["size"])
+                # The store only holds the chunks with data, the others
+                # must read as zeros
+                rbd.zero_image(disk_name, 0, disk["size"])
+                with rbd.open_image_stream(
+                    disk_name, queue_depth=jobs
+                ) as stream:
+                    pending = []
+                    for offset, digest in disk["chunks"]:
+                        pending.append(
+                            (offset, executor.submit(store.get_chunk, digest))
+                        )
+                        if len(pending) >= 2 * jobs:
+                            offset, future = pending.pop(0)
+                            stream.seek(offset)
+                            stream.write(future.result())
+                    for offset, future in pending:
+                        stream.seek(offset)
+                        stream.write(future.result())
+                logger.info(
+                    "Disk "
+                    + disk_name
+                    + " restored from backup "
+                    + backup_name
+                )
 
     if enabled:
         enable_vm(vm_name)
 
 
+def _disk_role(vm_name, disk_name):
+    """
+    Return the role of a disk of a VM in a backup: "system" for its
+    system disk, the index of an additional disk otherwise.
+    """
+    if disk_name == OS_DISK_PREFIX + vm_name:
+        return "system"
+    prefix = DATA_DISK_PREFIX + vm_name + "_"
+    index = disk_name.replace(prefix, "", 1)
+    if disk_name.startswith(prefix) and index.isdigit():
+        return int(index)
+    raise Exception("Disk " + disk_name + " does not belong to " + vm_name)
+
+
+def _disk_name_for_role(vm_name, role):
+    """
+    Return the name of the disk of a VM with a backup role.
+    """
+    if role == "system":
+        return OS_DISK_PREFIX + vm_name
+    return _additional_disk_name(role, vm_name)
+
+
 def list_metadata(vm_name):
     """
     List all metadata associated to the given VM
@@ -1320,7 +2872,7 @@ def list_metadata(vm_name):
     :param vm_name: the VM name from which the metadata will be listed
     :return: the metadata list
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         disk_name = OS_DISK_PREFIX + vm_name
         return rbd.list_image_metadata(disk_name)
 
@@ -1333,7 +2885,7 @@ def get_metadata(vm_name, metadata_name):
     :param metadata_name: the metadata name to get
     :return: the metadata value (a str)
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         disk_name = OS_DISK_PREFIX + vm_name
         return rbd.get_image_metadata(disk_name, metadata_name)
 
@@ -1349,7 +2901,7 @@ def set_metadata(vm_name, metadata_name, metadata_value):
     """
 
     _check_name(metadata_name)
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         disk_name = OS_DISK_PREFIX + vm_name
         rbd.set_image_metadata(disk_name, metadata_name, metadata_value)
 
@@ -1389,15 +2941,17 @@ def remove_pacemaker_remote(vm_name):
 
     :param vm_name: the VM name to remove the pacemaker remote configuration
     """
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         disk_name = OS_DISK_PREFIX + vm_name
-        try:
-            rbd.remove_image_metadata(disk_name, "_remote_node")
-            rbd.remove_image_metadata(disk_name, "_remote_node_address")
-            rbd.remove_image_metadata(disk_name, "_remote_node_port")
-            rbd.remove_image_metadata(disk_name, "_remote_node_timeout")
-        except KeyError:
-            pass
+        rbd.remove_image_metadata_many(
+            disk_name,
+            [
+                "_remote_node",
+                "_remote_node_address",
+                "_remote_node_port",
+                "_remote_node_timeout",
+            ],
+        )
     with Pacemaker(vm_name) as p:
         p.remove_meta("remote-node")
         p.remove_meta("remote-addr")
@@ -1423,20 +2977,17 @@ def add_pacemaker_remote(
     """
 
     _check_name(remote_node)
-    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE) as rbd:
+    with RbdManager(CEPH_CONF, POOL_NAME, NAMESPACE, shared=True) as rbd:
         disk_name = OS_DISK_PREFIX + vm_name
-        rbd.set_image_metadata(disk_name, "_remote_node", remote_node)
-        rbd.set_image_metadata(
-            disk_name, "_remote_node_address", remote_node_address
-        )
+        metadata = {
+            "_remote_node": remote_node,
+            "_remote_node_address": remote_node_address,
+        }
         if remote_node_port:
-            rbd.set_image_metadata(
-                disk_name, "_remote_node_port", remote_node_port
-            )
+            metadata["_remote_node_port"] = remote_node_port
         if remote_node_timeout:
-            rbd.set_image_metadata(
-                disk_name, "_remote_node_timeout", remote_node_timeout
-            )
+            metadata["_remote_node_timeout"] = remote_node_timeout
+        rbd.set_image_metadata_many(disk_name, metadata)
     with Pacemaker(vm_name) as p:
         if remote_node_port:
             p.add_meta("remote-port", remote_node_port)
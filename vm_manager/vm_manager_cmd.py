@@ -10,6 +10,9 @@ import argparse
 import vm_manager
 import logging
 import datetime
+import json
+import sys
+from vm_manager.helpers.progress import format_progress, format_size
 
 
 class ParseMetaData(argparse.Action):
@@ -44,7 +47,7 @@ def get_parser():
         help="command", dest="command", required=True, metavar="command"
     )
     create_parser = subparsers.add_parser("create", help="Create a new VM")
-    subparsers.add_parser("remove", help="Remove a VM")
+    remove_parser = subparsers.add_parser("remove", help="Remove a VM")
     subparsers.add_parser("start", help="Start a VM")
     stop_parser = subparsers.add_parser("stop", help="Stop a VM")
     subparsers.add_parser("list", help="List all VMs")
@@ -98,6 +101,12 @@ def get_parser():
         rollback_parser = subparsers.add_parser(
             "rollback", help="Rollback a VM to a given snapshot"
         )
+        backup_parser = subparsers.add_parser(
+            "backup", help="Back up the disks of a VM to a delta file"
+        )
+        restore_parser = subparsers.add_parser(
+            "restore", help="Restore the disks of a VM from delta files"
+        )
         list_md_parser = subparsers.add_parser(
             "list_metadata", help="Lists all metadata from an image"
         )
@@ -122,9 +131,58 @@ def get_parser():
             "add-to-cluster",
             help="Add an existing libvirt VM to the cluster",
         )
+        verify_parser = subparsers.add_parser(
+            "verify",
+            help="Check that the disks of a VM have the content of their "
+            "source",
+        )
+        flatten_parser = subparsers.add_parser(
+            "flatten",
+            help="Detach fast cloned disks from their parent snapshot",
+        )
+        usage_parser = subparsers.add_parser(
+            "usage",
+            help="Report the Ceph space used by VMs and their snapshots",
+            description="Report the Ceph space used by VMs and their "
+            "snapshots, as rbd du does. RBD can only diff from per-image "
+            "snapshots: the bytes pinned by a snapshot that follows a "
+            "group snapshot are counted from the previous per-image "
+            "snapshot, which over-counts them, and the VM is marked *.",
+        )
+        trash_parser = subparsers.add_parser(
+            "trash",
+            help="Manage the disks of the VMs removed with --deferred",
+            description="Manage the disks of the VMs removed with "
+            "--deferred. Nothing purges the trash by itself: run 'trash "
+            "purge' periodically on one host of the cluster, from a "
+            "systemd timer for instance, or the removed disks keep using "
+            "their space.",
+        )
+        retention_parser = subparsers.add_parser(
+            "retention",
+            help="Apply a snapshot retention policy to the VMs",
+        )
+        features_parser = subparsers.add_parser(
+            "features",
+            help="Enable RBD features like fast-diff on the VM disks",
+        )
+        progress_parser = subparsers.add_parser(
+            "progress",
+            help="Show the progress of the running and last imports, "
+            "copies, rollbacks and purges",
+        )
 
     for name, subparser in subparsers.choices.items():
-        if name not in ("list", "console"):
+        if name not in (
+            "list",
+            "console",
+            "flatten",
+            "usage",
+            "progress",
+            "retention",
+            "trash",
+            "features",
+        ):
             subparser.add_argument(
                 "-n",
                 "--name",
@@ -211,6 +269,43 @@ def get_parser():
             "setting with the system disk.",
         )
 
+        for p in [create_parser, import_parser]:
+            p.add_argument(
+                "--import-backend",
+                choices=["qemu-img", "native"],
+                required=False,
+                default=None,
+                help="How to copy the disk images into Ceph: run qemu-img "
+                "convert, or write them from vm_manager with parallel "
+                "asynchronous writes (default qemu-img). The native backend "
+                "does not support compressed, encrypted or backed images",
+            )
+            p.add_argument(
+                "--import-queue-depth",
+                type=int,
+                required=False,
+                default=None,
+                help="Number of writes in flight with the native import "
+                "backend (default 16)",
+            )
+            p.add_argument(
+                "--import-jobs",
+                type=int,
+                required=False,
+                default=None,
+                help="Maximum number of disk images imported at the same "
+                "time (default 4)",
+            )
+            p.add_argument(
+                "--sparse",
+                action="store_true",
+                dest="import_sparse",
+                required=False,
+                help="With the native import backend, also leave holes in "
+                "Ceph for the chunks of the allocated data of the disk "
+                "images that only hold zeros",
+            )
+
         for p in [create_parser, clone_parser, import_parser]:
             p.add_argument(
                 "--disable",
@@ -372,6 +467,329 @@ def get_parser():
             "--xml", type=str, required=False, help="VM libvirt XML path"
         )
 
+        for p in [create_parser, clone_parser]:
+            p.add_argument(
+                "--verify",
+                action="store_true",
+                required=False,
+                help="Check that the disks have the content of their source "
+                "once copied, the VM is removed if they do not",
+            )
+
+        for p in [create_parser, clone_parser, import_parser]:
+            p.add_argument(
+                "--object-size",
+                type=_parse_object_size,
+                dest="layout_order",
+                required=False,
+                default=None,
+                help="Size of the RBD objects of the disks, a power of two "
+                "from 4K to 32M, i.e., 1M (default the pool setting)",
+            )
+            p.add_argument(
+                "--stripe-unit",
+                type=_parse_size,
+                dest="layout_stripe_unit",
+                required=False,
+                default=None,
+                help="Bytes written to an RBD object before moving to the "
+                "next one, a divisor of the object size, i.e., 64K. Needs "
+                "--stripe-count",
+            )
+            p.add_argument(
+                "--stripe-count",
+                type=int,
+                dest="layout_stripe_count",
+                required=False,
+                default=None,
+                help="Number of RBD objects the disks are striped over. "
+                "Needs --stripe-unit",
+            )
+            p.add_argument(
+                "--data-pool",
+                type=str,
+                dest="layout_data_pool",
+                required=False,
+                default=None,
+                help="Pool storing the data of the disks, i.e., an erasure "
+                "coded pool (default the pool of the VM)",
+            )
+            p.add_argument(
+                "--features",
+                type=lambda value: value.split(","),
+                dest="layout_features",
+                required=False,
+                default=None,
+                help="Comma separated RBD features of the disks, i.e., "
+                "layering,exclusive-lock (default layering,exclusive-lock,"
+                "object-map,fast-diff,deep-flatten for create and "
+                "add-to-cluster, the ones of the source disks for clone)",
+            )
+
+        clone_parser.add_argument(
+            "--fast",
+            action="store_true",
+            required=False,
+            help="Create the disks as copy-on-write clones of snapshots of "
+            "the source disks instead of copying them. The source VM cannot "
+            "be removed while such clones exist",
+        )
+
+        clone_parser.add_argument(
+            "--flatten",
+            action="store_true",
+            required=False,
+            help="With --fast, queue the new disks to be flattened by "
+            "'flatten --run'",
+        )
+
+        for p in [clone_parser, purge_parser, rollback_parser]:
+            p.add_argument(
+                "-p",
+                "--progress",
+                action="store_true",
+                required=False,
+                help="Print the progress of the operation",
+            )
+
+        remove_parser.add_argument(
+            "--deferred",
+            action="store_true",
+            required=False,
+            help="Move the disks to the RBD trash and return at once. They "
+            "are removed by 'trash purge' once the undo window has passed, "
+            "until then 'trash restore' brings the VM back. 'trash purge' "
+            "is not run automatically: schedule it, with a systemd timer "
+            "for instance",
+        )
+        remove_parser.add_argument(
+            "--undo-window",
+            type=_parse_duration,
+            required=False,
+            default=None,
+            help="With --deferred, time during which the VM can be "
+            "restored, in hours, days or weeks, i.e., 12h (default 1d)",
+        )
+
+        trash_parser.add_argument(
+            "action",
+            choices=["list", "restore", "purge"],
+            help="list: show the disks in the trash, restore: bring a VM "
+            "back, purge: remove the disks whose undo window has passed",
+        )
+        trash_parser.add_argument(
+            "-n",
+            "--name",
+            type=str,
+            required=False,
+            help="The VM to list, restore or purge (default all the VMs "
+            "for list and purge)",
+        )
+        trash_parser.add_argument(
+            "--force",
+            action="store_true",
+            required=False,
+            help="With purge, also remove the disks whose undo window has "
+            "not passed",
+        )
+        trash_parser.add_argument(
+            "--rate",
+            type=int,
+            required=False,
+            help="With purge, maximum MiB per second removed (default no "
+            "limit)",
+        )
+        trash_parser.add_argument(
+            "-p",
+            "--progress",
+            action="store_true",
+            required=False,
+            help="With purge, print the progress of the removals",
+        )
+        trash_parser.add_argument(
+            "--json",
+            action="store_true",
+            required=False,
+            help="With list, print the disks as JSON",
+        )
+
+        retention_parser.add_argument(
+            "action",
+            choices=["apply"],
+            help="apply: remove the snapshots the policy does not keep",
+        )
+        retention_parser.add_argument(
+            "-n",
+            "--name",
+            type=str,
+            required=False,
+            help="The VM to apply the policy to (default all the VMs of "
+            "the pool)",
+        )
+        for rule, help_text in (
+            ("last", "Number of most recent snapshots to keep"),
+            ("hourly", "Number of hours to keep the last snapshot of"),
+            ("daily", "Number of days to keep the last snapshot of"),
+            ("weekly", "Number of weeks to keep the last snapshot of"),
+        ):
+            retention_parser.add_argument(
+                "--keep-" + rule,
+                type=int,
+                required=False,
+                default=0,
+                help=help_text + " (default 0)",
+            )
+        retention_parser.add_argument(
+            "--max-age",
+            type=_parse_duration,
+            required=False,
+            help="Remove the snapshots older than this, in hours, days or "
+            "weeks, i.e., 12h, 30d or 8w, except the ones --keep-last keeps",
+        )
+        retention_parser.add_argument(
+            "--exclude",
+            type=str,
+            metavar="PATTERN",
+            action="append",
+            required=False,
+            default=[],
+            help="Keep the snapshots whose name matches this shell pattern, "
+            "i.e., 'backup*'. Can be specified multiple times.",
+        )
+        retention_parser.add_argument(
+            "--jobs",
+            type=int,
+            required=False,
+            default=4,
+            help="Number of VMs handled at once (default 4)",
+        )
+        retention_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            required=False,
+            help="Only print the plan, do not remove any snapshot",
+        )
+        retention_parser.add_argument(
+            "--json",
+            action="store_true",
+            required=False,
+            help="Print the plan as JSON",
+        )
+
+        features_parser.add_argument(
+            "action",
+            choices=["upgrade"],
+            help="upgrade: enable the features missing on the disks and "
+            "rebuild their invalid object maps",
+        )
+        features_parser.add_argument(
+            "-n",
+            "--name",
+            type=str,
+            required=False,
+            help="The VM to upgrade (default all the VMs of the pool)",
+        )
+        features_parser.add_argument(
+            "--features",
+            type=lambda value: value.split(","),
+            required=False,
+            default=None,
+            help="Comma separated RBD features the disks must have (default "
+            "layering,exclusive-lock,object-map,fast-diff,deep-flatten). "
+            "Only exclusive-lock, object-map, fast-diff and journaling can "
+            "be enabled on existing disks",
+        )
+        features_parser.add_argument(
+            "--jobs",
+            type=int,
+            required=False,
+            default=4,
+            help="Number of disks upgraded at once (default 4)",
+        )
+        features_parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            required=False,
+            help="Only print the plan, do not change any disk",
+        )
+        features_parser.add_argument(
+            "-p",
+            "--progress",
+            action="store_true",
+            required=False,
+            help="Print the progress of the object map rebuilds",
+        )
+        features_parser.add_argument(
+            "--json",
+            action="store_true",
+            required=False,
+            help="Print the plan as JSON",
+        )
+
+        progress_parser.add_argument(
+            "-n",
+            "--name",
+            type=str,
+            required=False,
+            help="The VM whose operations are shown (default all of them)",
+        )
+        progress_parser.add_argument(
+            "--json",
+            action="store_true",
+            required=False,
+            help="Print the progress records as JSON",
+        )
+
+        usage_parser.add_argument(
+            "-n",
+            "--name",
+            type=str,
+            required=False,
+            help="The VM to report (default all the VMs of the pool)",
+        )
+        usage_parser.add_argument(
+            "--json",
+            action="store_true",
+            required=False,
+            help="Print the report as JSON",
+        )
+        usage_parser.add_argument(
+            "--jobs",
+            type=int,
+            required=False,
+            default=16,
+            help="Number of disks walked at once (default 16)",
+        )
+
+        flatten_parser.add_argument(
+            "-n",
+            "--name",
+            type=str,
+            required=False,
+            help="The VM whose disks must be queued, or shown with --status",
+        )
+        flatten_action = flatten_parser.add_mutually_exclusive_group()
+        flatten_action.add_argument(
+            "--run",
+            action="store_true",
+            required=False,
+            help="Flatten the queued disks until the queue is empty",
+        )
+        flatten_action.add_argument(
+            "--status",
+            action="store_true",
+            required=False,
+            help="Show the state of the queued and flattened disks",
+        )
+        flatten_parser.add_argument(
+            "--max-concurrent",
+            type=int,
+            required=False,
+            default=2,
+            help="Maximum number of disks flattened at once with --run "
+            "(default 2)",
+        )
+
         import_parser.add_argument(
             "-i",
             "--image",
@@ -417,6 +835,14 @@ def get_parser():
             help="Snapshot to be created",
         )
 
+        create_snap_parser.add_argument(
+            "--per-image",
+            action="store_true",
+            required=False,
+            help="Snapshot each disk separately instead of taking one "
+            "snapshot of the VM group, consistent across all its disks",
+        )
+
         remove_snap_parser.add_argument(
             "--snap_name",
             type=str,
@@ -439,6 +865,16 @@ def get_parser():
             help="Number of snapshots to delete starting from the oldest",
         )
 
+        list_snaps_parser.add_argument(
+            "--detailed",
+            action="store_true",
+            required=False,
+            help="Also show the date of the snapshots and the bytes each "
+            "one pins, changed since the previous snapshot. The bytes of a "
+            "snapshot following a group snapshot are counted from the "
+            "previous per-image snapshot, over-counted and marked *",
+        )
+
         rollback_parser.add_argument(
             "--snap_name",
             type=str,
@@ -446,6 +882,117 @@ def get_parser():
             help="Snapshot to be rollbacked",
         )
 
+        rollback_parser.add_argument(
+            "--keep-resource",
+            action="store_true",
+            required=False,
+            help="Only stop and start the VM resource in Pacemaker around "
+            "the rollback instead of removing and adding it again",
+        )
+
+        verify_parser.add_argument(
+            "-i",
+            "--image",
+            type=str,
+            required=False,
+            help="qcow2 image the system disk was imported from",
+        )
+
+        verify_parser.add_argument(
+            "--additional-disk",
+            type=str,
+            metavar="PATH",
+            dest="additional_disks",
+            action="append",
+            required=False,
+            default=None,
+            help="qcow2 image an additional disk was imported from, in the "
+            "order of the disks. Can be specified multiple times.",
+        )
+
+        verify_parser.add_argument(
+            "--src_name",
+            type=str,
+            required=False,
+            help="VM whose disks are compared with the ones of the VM, "
+            "instead of images",
+        )
+
+        verify_parser.add_argument(
+            "--jobs",
+            type=int,
+            default=4,
+            required=False,
+            help="Number of chunks read and hashed at once (default 4)",
+        )
+
+        backup_target = backup_parser.add_mutually_exclusive_group(
+            required=True
+        )
+        backup_target.add_argument(
+            "-o",
+            "--output",
+            type=str,
+            help="Delta file to write",
+        )
+
+        backup_target.add_argument(
+            "--store",
+            type=str,
+            help="Deduplicated chunk store directory to back up to, "
+            "created if needed",
+        )
+
+        backup_parser.add_argument(
+            "--since",
+            type=str,
+            required=False,
+            help="Snapshot of a previous backup, only the changes since "
+            "this snapshot are backed up (delta files only)",
+        )
+
+        backup_parser.add_argument(
+            "--snap_name",
+            type=str,
+            required=False,
+            help="Name of the backup snapshot, 'backup' followed by the "
+            "date by default",
+        )
+
+        restore_source = restore_parser.add_mutually_exclusive_group(
+            required=True
+        )
+        restore_source.add_argument(
+            "-i",
+            "--input",
+            type=str,
+            nargs="+",
+            help="Delta files to restore, oldest first",
+        )
+
+        restore_source.add_argument(
+            "--store",
+            type=str,
+            help="Deduplicated chunk store directory to restore from",
+        )
+
+        restore_parser.add_argument(
+            "--snap_name",
+            type=str,
+            required=False,
+            help="Backup to restore from the chunk store",
+        )
+
+        for subparser in (backup_parser, restore_parser):
+            subparser.add_argument(
+                "--jobs",
+                type=int,
+                default=4,
+                required=False,
+                help="Number of chunks processed at once with --store "
+                "(default 4)",
+            )
+
         get_md_parser.add_argument(
             "--metadata_name",
             type=str,
@@ -519,6 +1066,166 @@ def get_parser():
     return parser
 
 
+def _print_snapshots(snapshots):
+    """Print the detailed list of list_snapshots() as a table."""
+    row = "{:<30} {:<20} {:>12}"
+    print(row.format("NAME", "TIMESTAMP", "SIZE"))
+    approximate = False
+    for snap in snapshots:
+        name = snap["name"]
+        if snap["group"]:
+            name += " (group)"
+        size = format_size(snap["size"])
+        if not snap["exact"]:
+            size = "*" + size
+            approximate = True
+        timestamp = ""
+        if snap["timestamp"]:
+            timestamp = snap["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+        print(row.format(name, timestamp, size))
+    if approximate:
+        print("* over-estimated, the snapshot follows a group snapshot")
+
+
+def _parse_duration(value):
+    """Parse a duration like 12h, 30d or 8w into a timedelta."""
+    units = {"h": "hours", "d": "days", "w": "weeks"}
+    if len(value) < 2 or value[-1] not in units or not value[:-1].isdigit():
+        raise argparse.ArgumentTypeError(
+            "invalid duration " + value + ", expected i.e. 12h, 30d or 8w"
+        )
+    return datetime.timedelta(**{units[value[-1]]: int(value[:-1])})
+
+
+def _parse_size(value):
+    """Parse a size like 65536, 64K or 1M into bytes."""
+    units = {"K": 1, "M": 2, "G": 3}
+    number = value[:-1] if value[-1:].upper() in units else value
+    if not number.isdigit() or int(number) == 0:
+        raise argparse.ArgumentTypeError(
+            "invalid size " + value + ", expected i.e. 65536, 64K or 1M"
+        )
+    return int(number) * 1024 ** units.get(value[-1].upper(), 0)
+
+
+def _parse_object_size(value):
+    """Parse an object size like 1M into an RBD image order."""
+    size = _parse_size(value)
+    order = size.bit_length() - 1
+    if size != 1 << order or not 12 <= order <= 25:
+        raise argparse.ArgumentTypeError(
+            "invalid object size " + value + ", expected a power of two "
+            "from 4K to 32M"
+        )
+    return order
+
+
+def _disk_layout(args):
+    """
+    Return the disk layout given by the --object-size, --stripe-*,
+    --data-pool and --features options, or None if none is given.
+    """
+    layout = {
+        key.replace("layout_", "", 1): value
+        for key, value in vars(args).items()
+        if key.startswith("layout_") and value is not None
+    }
+    return layout or None
+
+
+def _print_retention(plan, dry_run):
+    """Print the plan of apply_retention() as a table."""
+    row = "{:<30} {:<30} {:<20} {:<13} {}"
+    print(row.format("VM", "SNAPSHOT", "TIMESTAMP", "ACTION", "REASONS"))
+    for vm_name, entries in sorted(plan.items()):
+        for entry in entries:
+            name = entry["name"]
+            if entry["group"]:
+                name += " (group)"
+            timestamp = ""
+            if entry["timestamp"]:
+                timestamp = entry["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+            if entry["keep"]:
+                action = "keep"
+            else:
+                action = "would remove" if dry_run else "removed"
+            print(
+                row.format(
+                    vm_name,
+                    name,
+                    timestamp,
+                    action,
+                    ", ".join(entry["reasons"]),
+                )
+            )
+
+
+def _print_features(plan):
+    """Print the plan of upgrade_features() as a table."""
+    row = "{:<30} {:<20} {:<35} {:<8} {}"
+    print(row.format("DISK", "VM", "ENABLE", "REBUILD", "UNSUPPORTED"))
+    for entry in plan:
+        print(
+            row.format(
+                entry["disk"],
+                entry["vm"],
+                ",".join(entry["enable"]) or "-",
+                "yes" if entry["rebuild"] else "no",
+                ",".join(entry["unsupported"]) or "-",
+            )
+        )
+
+
+def _print_trash(disks):
+    """Print the list of list_trash() as a table."""
+    row = "{:<30} {:<20} {:<20} {:<20} {}"
+    print(row.format("NAME", "VM", "DELETED", "PURGEABLE", "ID"))
+    for disk in disks:
+        print(
+            row.format(
+                disk["name"],
+                disk["vm"],
+                disk["deleted"].strftime("%Y-%m-%d %H:%M:%S"),
+                disk["purgeable"].strftime("%Y-%m-%d %H:%M:%S"),
+                disk["id"],
+            )
+        )
+
+
+def _print_usage(report):
+    """Print the report of get_usage() as a table."""
+    row = "{:<40} {:>12} {:>12}"
+    print(row.format("NAME", "PROVISIONED", "USED"))
+    approximate = False
+    for vm in report:
+        name = vm["name"]
+        if not vm["exact"]:
+            name += " *"
+            approximate = True
+        print(
+            row.format(
+                name,
+                format_size(vm["provisioned"]),
+                format_size(vm["used"]),
+            )
+        )
+        for disk in vm["disks"]:
+            print(
+                row.format(
+                    "  " + disk["name"],
+                    format_size(disk["provisioned"]),
+                    format_size(disk["used"]),
+                )
+            )
+            for snap in disk["snapshots"]:
+                snap_name = "    @" + snap["name"]
+                if snap["group"]:
+                    snap_name += " (group)"
+                print(row.format(snap_name, "", format_size(snap["used"])))
+    if approximate:
+        print("* over-estimated, some snapshots follow group snapshots")
+
+
 def main():
     parser = get_parser()
     args = parser.parse_args()
@@ -534,7 +1241,39 @@ def main():
     elif args.command == "stop":
         vm_manager.stop(args.name, force=args.force)
     elif args.command == "remove":
-        vm_manager.remove(args.name)
+        if "deferred" in args and args.deferred:
+            if args.undo_window is None:
+                vm_manager.remove(args.name, deferred=True)
+            else:
+                vm_manager.remove(
+                    args.name,
+                    deferred=True,
+                    undo_window=int(args.undo_window.total_seconds()),
+                )
+        else:
+            if "undo_window" in args and args.undo_window is not None:
+                parser.error("--undo-window requires --deferred")
+            vm_manager.remove(args.name)
+    elif args.command == "trash":
+        if args.action == "list":
+            disks = vm_manager.list_trash(args.name)
+            if args.json:
+                print(json.dumps(disks, indent=2, default=str))
+            else:
+                _print_trash(disks)
+        elif args.action == "restore":
+            if not args.name:
+                parser.error("trash restore requires --name")
+            vm_manager.restore_from_trash(args.name)
+        else:
+            removed = vm_manager.purge_trash(
+                args.name,
+                force=args.force,
+                rate=args.rate * 1024 * 1024 if args.rate else None,
+                progress=args.progress,
+            )
+            for disk_name in removed:
+                print(disk_name)
     elif args.command == "create":
         with open(args.xml, "r") as xml:
             args.base_xml = xml.read()
@@ -548,6 +1287,7 @@ def main():
         else:
             if "enable" in args:
                 args.enable = True
+        args.disk_layout = _disk_layout(args)
         vm_manager.create(vars(args))
     elif args.command == "clone":
         args.base_xml = None
@@ -556,6 +1296,7 @@ def main():
                 args.base_xml = xml.read()
         args.live_migration = args.enable_live_migration
         args.crm_config_cmd = args.add_crm_config_cmd
+        args.disk_layout = _disk_layout(args)
         vm_manager.clone(vars(args))
     elif args.command == "disable":
         vm_manager.disable_vm(args.name)
@@ -564,15 +1305,115 @@ def main():
     elif args.command == "status":
         print(vm_manager.status(args.name))
     elif args.command == "create_snapshot":
-        vm_manager.create_snapshot(args.name, args.snap_name)
+        vm_manager.create_snapshot(
+            args.name, args.snap_name, per_image=args.per_image
+        )
     elif args.command == "remove_snapshot":
         vm_manager.remove_snapshot(args.name, args.snap_name)
     elif args.command == "list_snapshots":
-        print(vm_manager.list_snapshots(args.name))
+        if args.detailed:
+            _print_snapshots(
+                vm_manager.list_snapshots(args.name, detailed=True)
+            )
+        else:
+            print(vm_manager.list_snapshots(args.name))
     elif args.command == "purge":
-        vm_manager.purge_image(args.name, args.date, args.number)
+        vm_manager.purge_image(
+            args.name, args.date, args.number, progress=args.progress
+        )
     elif args.command == "rollback":
-        vm_manager.rollback_snapshot(args.name, args.snap_name)
+        vm_manager.rollback_snapshot(
+            args.name,
+            args.snap_name,
+            keep_resource=args.keep_resource,
+            progress=args.progress,
+        )
+    elif args.command == "retention":
+        plan = vm_manager.apply_retention(
+            keep_last=args.keep_last,
+            keep_hourly=args.keep_hourly,
+            keep_daily=args.keep_daily,
+            keep_weekly=args.keep_weekly,
+            max_age=args.max_age,
+            exclude=args.exclude,
+            vm_names=[args.name] if args.name else None,
+            dry_run=args.dry_run,
+            jobs=args.jobs,
+        )
+        if args.json:
+            print(json.dumps(plan, indent=2, default=str))
+        else:
+            _print_retention(plan, args.dry_run)
+    elif args.command == "features":
+        plan = vm_manager.upgrade_features(
+            vm_names=[args.name] if args.name else None,
+            features=args.features,
+            jobs=args.jobs,
+            dry_run=args.dry_run,
+            progress=args.progress,
+        )
+        if args.json:
+            print(json.dumps(plan, indent=2))
+        else:
+            _print_features(plan)
+    elif args.command == "progress":
+        records = vm_manager.list_progress(args.name)
+        if args.json:
+            print(json.dumps(records, indent=2))
+        else:
+            for record in records:
+                print(format_progress(record))
+    elif args.command == "usage":
+        report = vm_manager.get_usage(args.name, jobs=args.jobs)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            _print_usage(report)
+    elif args.command == "verify":
+        if args.src_name and (args.image or args.additional_disks):
+            parser.error("--src_name cannot be used with image files")
+        if not (args.src_name or args.image or args.additional_disks):
+            parser.error(
+                "verify requires --image, --additional-disk or --src_name"
+            )
+        results = vm_manager.verify_vm(
+            args.name,
+            image=args.image,
+            additional_disks=args.additional_disks,
+            src_vm=args.src_name,
+            jobs=args.jobs,
+        )
+        for disk_name, match in results.items():
+            print(disk_name + (" OK" if match else " MISMATCH"))
+        if not all(results.values()):
+            sys.exit(1)
+    elif args.command == "backup":
+        if args.store:
+            if args.since:
+                parser.error("--since cannot be used with --store")
+            print(
+                vm_manager.backup_vm_to_store(
+                    args.name, args.store, args.snap_name, jobs=args.jobs
+                )
+            )
+        else:
+            print(
+                vm_manager.backup_vm(
+                    args.name,
+                    args.output,
+                    since=args.since,
+                    snapshot_name=args.snap_name,
+                )
+            )
+    elif args.command == "restore":
+        if args.store:
+            if not args.snap_name:
+                parser.error("restore --store requires --snap_name")
+            vm_manager.restore_vm_from_store(
+                args.name, args.store, args.snap_name, jobs=args.jobs
+            )
+        else:
+            vm_manager.restore_vm(args.name, args.input)
     elif args.command == "list_metadata":
         print(vm_manager.list_metadata(args.name))
     elif args.command == "get_metadata":
@@ -602,7 +1443,25 @@ def main():
             args.enable = not args.disable
         else:
             args.enable = True
+        args.disk_layout = _disk_layout(args)
         vm_manager.add_to_cluster(vars(args))
+    elif args.command == "flatten":
+        if args.status:
+            status = vm_manager.flatten_status(args.name)
+            for disk_name, record in sorted(status.items()):
+                line = "{} {} {:.1f}%".format(
+                    disk_name, record["state"], record["progress"]
+                )
+                if "error" in record:
+                    line += " " + record["error"]
+                print(line)
+        else:
+            if args.name:
+                vm_manager.flatten_vm(args.name)
+            elif not args.run:
+                parser.error("flatten requires --name, --run or --status")
+            if args.run:
+                vm_manager.run_flatten_queue(args.max_concurrent)
     elif args.command == "autostart":
         vm_manager.autostart(args.name, args.enable)
     elif args.command == "console":